@@ -0,0 +1,91 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from plc_simulator import add_arguments, fleet_options, start_fleet
+
+logger = logging.getLogger(__name__)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_historian(plc_list, duration, period, workdir, extra_args=()):
+    """Run main.py against the PLCs as a child process and return its metrics snapshot and resource usage"""
+    metrics_path = os.path.join(workdir, 'metrics.json')
+    output = os.path.join(workdir, 'historian')
+    os.makedirs(output, exist_ok=True)
+    command = [sys.executable, os.path.join(HERE, 'main.py'), str(duration), str(period),
+               '--plcs', *[f'{name}:{ip}:{port}' for name, ip, port in plc_list],
+               '--output', output, '--metrics', metrics_path, '--queryport', '0', *extra_args]
+
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    with open(os.path.join(workdir, 'historian.log'), 'w') as log:
+        subprocess.run(command, cwd=HERE, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                       check=True)
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    with open(metrics_path) as f:
+        metrics = json.load(f)
+    usage = {'wall': elapsed,
+             'cpu': (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime),
+             # ru_maxrss is in KB on Linux: peak of the largest child so far
+             'max_rss_mb': after.ru_maxrss / 1024}
+    return metrics, usage
+
+
+def report(plc_list, duration, period, metrics, usage):
+    plcs = metrics['plcs'].values()
+    samples = sum(p['samples'] for p in plcs)
+    expected = len(plc_list) * int(duration / period)
+    written = sum(p['bytes_written'] for p in plcs)
+    missed = sum(p['missed_deadlines'] for p in plcs)
+    p99 = max((p['poll_latency']['p99'] or 0 for p in plcs), default=0)
+
+    lines = [f'PLCs: {len(plc_list)}, period: {period} s, duration: {duration} s',
+             f'Samples: {samples} of {expected} ({100 * samples / max(expected, 1):.1f}%), '
+             f'{samples / duration:.1f} samples/s',
+             f'Missed deadlines: {missed}, missed ticks: {metrics["missed_ticks"]}, '
+             f'worst poll p99: {p99 * 1000:.1f} ms',
+             f'Written: {written / 2**20:.2f} MB ({written / max(samples, 1):.0f} bytes/sample)',
+             f'CPU: {usage["cpu"]:.2f} s ({100 * usage["cpu"] / usage["wall"]:.1f}% of {usage["wall"]:.1f} s), '
+             f'max RSS: {usage["max_rss_mb"]:.1f} MB']
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Historian throughput benchmark on simulated PLCs")
+    add_arguments(parser)
+    parser.add_argument('-d', "--duration", type=int, default=30, help="capture length in seconds")
+    parser.add_argument('-t', "--period", type=float, default=1.0, help="sampling period in seconds")
+    parser.add_argument('-w', "--workdir", type=str, default=None,
+                        help="directory of the captured data (a temporary directory if omitted)")
+    parser.add_argument("historian_args", nargs=argparse.REMAINDER,
+                        help="options passed to main.py after --, e.g. -- --shards 4 --recording changes")
+    args = parser.parse_args()
+    extra_args = [a for a in args.historian_args if a != '--']
+
+    logging.basicConfig(level=logging.INFO)
+    simulators, plc_list = start_fleet(args.count, args.port, **fleet_options(args))
+    try:
+        if args.workdir:
+            os.makedirs(args.workdir, exist_ok=True)
+            metrics, usage = run_historian(plc_list, args.duration, args.period, args.workdir, extra_args)
+        else:
+            with tempfile.TemporaryDirectory(prefix='plc-benchmark-') as workdir:
+                metrics, usage = run_historian(plc_list, args.duration, args.period, workdir, extra_args)
+    finally:
+        for simulator in simulators:
+            simulator.stop()
+    print(report(plc_list, args.duration, args.period, metrics, usage))
+
+
+if __name__ == '__main__':
+    main()
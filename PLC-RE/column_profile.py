@@ -0,0 +1,223 @@
+import hashlib
+import io
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataset_store import read_dataset, read_dtypes
+
+logger = logging.getLogger(__name__)
+
+# Distinct values recorded per column: above it only the cardinality is lost (None)
+PROFILE_VALUES = 256
+# Bytes at the end of the profiled rows compared to tell appended rows from a rewritten csv
+PROFILE_TAIL = 4096
+
+
+def profile_path(path):
+    """Column profile of a csv dataset: PLC1Dataset.csv -> PLC1Dataset.profile.json"""
+    return os.path.splitext(path)[0] + '.profile.json'
+
+
+def _source(path, size=None):
+    """Header, size, mtime and digest of the last `size` bytes of the csv (None if the dataset has no csv)"""
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    size = stat.st_size if size is None else size
+    with open(path, 'rb') as f:
+        header = f.readline().decode()
+        f.seek(max(size - PROFILE_TAIL, 0))
+        tail = hashlib.sha1(f.read(size - f.tell())).hexdigest()
+    return {'header': header, 'size': size, 'mtime_ns': stat.st_mtime_ns, 'tail': tail}
+
+
+def _scalar(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class _ColumnStats:
+    """Statistics of a column, updated a chunk at a time"""
+
+    def __init__(self, saved=None):
+        saved = saved or {'dtype': None, 'nonzero': 0, 'nulls': 0, 'min': None, 'max': None, 'cardinality': 0,
+                          'values': []}
+        self.dtype = saved['dtype']
+        self.nonzero = saved['nonzero']
+        self.nulls = saved['nulls']
+        self.min = saved['min']
+        self.max = saved['max']
+        self.many = saved['cardinality'] is None
+        self.nan = any(isinstance(v, float) and np.isnan(v) for v in saved['values'])
+        self.values = dict.fromkeys(v for v in saved['values'] if not (isinstance(v, float) and np.isnan(v)))
+
+    def update(self, column):
+        # Type common to all the chunks, as if the column were read whole
+        empty = pd.Series([], dtype=column.dtype)
+        self.dtype = str(column.dtype if self.dtype is None
+                         else pd.concat([pd.Series([], dtype=pd.api.types.pandas_dtype(self.dtype)), empty]).dtype)
+        self.nonzero += int((column != 0).sum())
+        self.nulls += int(column.isna().sum())
+        if not pd.api.types.is_numeric_dtype(pd.api.types.pandas_dtype(self.dtype)):
+            # Column not numeric as a whole (e.g. numbers in the first chunks, text after)
+            self.min = self.max = None
+        elif column.notna().any():
+            low, high = _scalar(column.min()), _scalar(column.max())
+            self.min = low if self.min is None else min(self.min, low)
+            self.max = high if self.max is None else max(self.max, high)
+
+        if not self.many:
+            unique = pd.unique(column)
+            if len(unique) > PROFILE_VALUES:
+                self.many = True
+            else:
+                for value in unique:
+                    if pd.isna(value):
+                        self.nan = True
+                    else:
+                        self.values[_scalar(value)] = None
+                self.many = len(self.values) + self.nan > PROFILE_VALUES
+            if self.many:
+                self.values = dict()
+                self.nan = False
+
+    def to_dict(self):
+        # cardinality and values as len(df[col].unique()) and df[col].unique(), NaN included
+        values = list(self.values) + ([float('nan')] if self.nan else [])
+        return {'dtype': self.dtype, 'nonzero': self.nonzero, 'nulls': self.nulls, 'min': self.min, 'max': self.max,
+                'cardinality': None if self.many else len(values), 'values': values}
+
+
+def _add_chunks(profile, chunks):
+    """Add the rows of `chunks` to `profile`"""
+    stats = {col: _ColumnStats(saved) for col, saved in profile['columns'].items()}
+    for chunk in chunks:
+        for col in chunk.columns:
+            stats.setdefault(col, _ColumnStats()).update(chunk[col])
+        profile['rows'] += len(chunk)
+    profile['columns'] = {col: s.to_dict() for col, s in stats.items()}
+    return profile
+
+
+def _profile_rows(path, profile, chunksize):
+    """Add to `profile` the rows of the dataset after the ones already profiled"""
+    skip = {'skiprows': range(1, profile['rows'] + 1)} if profile['rows'] else {}
+    with read_dataset(path, bool_as_int=True, chunksize=chunksize, **skip) as chunks:
+        return _add_chunks(profile, chunks)
+
+
+def _appended(saved, source, path):
+    """True if the csv is the one profiled (`saved` source) with rows appended at the end"""
+    # Header and last profiled rows did not change
+    return not (saved is None or source is None or source['size'] < saved['size']
+                or source['header'] != saved['header'] or _source(path, saved['size'])['tail'] != saved['tail'])
+
+
+def write_profile(path, profile):
+    """Save the profile of a dataset (atomically), for the csv as it is now"""
+    profile['source'] = _source(path)
+    tmp = profile_path(path) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(profile, f, indent=1)
+    os.replace(tmp, profile_path(path))
+
+
+def _saved_profile(path):
+    if not os.path.exists(profile_path(path)):
+        return None
+    with open(profile_path(path)) as f:
+        return json.load(f)
+
+
+def current_profile(path):
+    """Statistics saved for a dataset (as read_profile()) if the csv did not change since, None otherwise
+
+    Unlike read_profile() the dataset is never read, for the tools that read only part of it.
+    """
+    profile = _saved_profile(path)
+    if profile is None or profile['source'] != _source(path):
+        return None
+    return profile['columns']
+
+
+def read_profile(path, chunksize=100000, rows=None):
+    """Per column statistics of a dataset: dtype, nonzero and null values, min/max (numeric columns),
+    cardinality and distinct values (None and [] with more than PROFILE_VALUES distinct values)
+
+    The statistics are computed in a single pass, a chunk at a time, and saved in a sidecar next to the
+    dataset (profile_path()). They are reused while the dataset does not change and updated with the
+    rows appended to it since (a rewritten csv is profiled again). A tool that has already read the whole
+    dataset with read_dataset(path, bool_as_int=True) passes it as `rows`, profiled instead of the csv.
+
+    Returns:
+        {column: statistics} in the order of the columns of the dataset
+    """
+    source = _source(path)
+    profile = _saved_profile(path)
+    if profile is not None:
+        saved = profile['source']
+        if saved == source:
+            return profile['columns']
+        if not _appended(saved, source, path):
+            profile = None
+
+    if rows is not None:
+        profile = _add_chunks({'rows': 0, 'columns': dict()}, [rows])
+    elif profile is None:
+        profile = _profile_rows(path, {'rows': 0, 'columns': dict()}, chunksize)
+    else:
+        logger.info("%s: profiling the rows appended after row %d", path, profile['rows'])
+        profile = _profile_rows(path, profile, chunksize)
+    try:
+        write_profile(path, profile)
+    except OSError as e:
+        logger.warning("%s: column profile not saved (%s)", path, e)
+    return profile['columns']
+
+
+def profile_frame(path, df, append=False, date_format=None):
+    """Save the profile of the rows `df` just written (appended with append=True) to the dataset `path` by
+    write_dataset(), computed from the rows in memory, so that the tools reading the dataset do not scan it
+
+    The statistics are the ones read_profile() would compute from the csv: bools as 0/1, and the columns
+    without a type in the schema (e.g. timestamps) as read back from their text. Appended rows extend the
+    saved profile only if it was current before the append (otherwise it is left to read_profile()).
+    """
+    profile = {'rows': 0, 'columns': dict()}
+    if append:
+        profile = _saved_profile(path)
+        if profile is None or not _appended(profile['source'], _source(path), path):
+            return
+    if df.columns.has_duplicates:
+        # Repeated names renamed as pd.read_csv() does: Timestamp, Timestamp.1, ...
+        seen = dict()
+        names = list()
+        for col in df.columns:
+            names.append(f'{col}.{seen[col]}' if col in seen else col)
+            seen[col] = seen.get(col, 0) + 1
+        df = df.set_axis(names, axis=1)
+    dtypes = read_dtypes(path)
+    untyped = [col for col in df.columns if col not in dtypes]
+    rows = df.astype({col: np.uint8 for col, d in dtypes.items() if d == 'bool' and col in df.columns})
+    if untyped:
+        text = rows[untyped].to_csv(index=False, date_format=date_format)
+        rows = rows.assign(**pd.read_csv(io.StringIO(text)).set_axis(rows.index, axis=0))
+    profile = _add_chunks(profile, [rows])
+
+    # Min, max and float values as read back from the csv: the parser can differ by an ulp from the values in memory
+    floats = [stats for stats in profile['columns'].values() if np.dtype(stats['dtype']).kind == 'f'
+              and stats['min'] is not None]
+    numbers = [v for stats in floats for v in [stats['min'], stats['max'], *stats['values']]]
+    if numbers:
+        parsed = iter(pd.read_csv(io.StringIO(pd.DataFrame({'v': numbers}).to_csv(index=False)),
+                                  dtype=np.float64)['v'].tolist())
+        for stats in floats:
+            stats['min'], stats['max'] = next(parsed), next(parsed)
+            stats['values'] = [next(parsed) for _ in stats['values']]
+    try:
+        write_profile(path, profile)
+    except OSError as e:
+        logger.warning("%s: column profile not saved (%s)", path, e)
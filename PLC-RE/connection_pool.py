@@ -0,0 +1,149 @@
+import logging
+import random
+import socket
+import threading
+import time
+
+from modbus_tk import modbus_tcp
+from modbus_tk.exceptions import ModbusError
+
+logger = logging.getLogger(__name__)
+
+
+class PLCConnection:
+    """Persistent Modbus TCP connection to a PLC, with health and round trip time tracking.
+
+    The request timeout follows the observed round trip time (as the TCP retransmission
+    timeout does: smoothed RTT + 4 * RTT variation), clamped to [min_timeout, max_timeout],
+    so a stalled PLC is detected in a few RTTs instead of a fixed 5 s.
+    """
+
+    def __init__(self, name, ip, port, min_timeout=0.05, max_timeout=5.0, initial_timeout=1.0, metrics=None):
+        self.name = str(name)
+        self.ip = str(ip)
+        self.port = int(port)
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout = initial_timeout
+        self.master = modbus_tcp.TcpMaster(host=self.ip, port=self.port, timeout_in_sec=initial_timeout)
+
+        self.healthy = False
+        self.failures = 0
+        self.next_retry = 0.0
+        self.srtt = None
+        self.rttvar = None
+        self.metrics = metrics
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """Open the connection (raises on failure)"""
+        with self._lock:
+            self.master.close()
+            # Connect with the largest timeout: a slow handshake is not a dead PLC
+            self.master.set_timeout(self.max_timeout)
+            self.master.open()
+            sock = getattr(self.master, '_sock', None)
+            if sock is not None:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            self.master.set_timeout(self.timeout)
+            self.healthy = True
+            self.failures = 0
+        logger.info("Connected to PLC %s (%s:%s)", self.name, self.ip, self.port)
+
+    def _update_timeout(self, rtt):
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.timeout = min(max(self.srtt + 4 * self.rttvar, self.min_timeout), self.max_timeout)
+        self.master.set_timeout(self.timeout)
+
+    def execute(self, *args, **kwargs):
+        """Same as TcpMaster.execute(); a network error marks the PLC as unhealthy"""
+        with self._lock:
+            start = time.perf_counter()
+            try:
+                result = self.master.execute(*args, **kwargs)
+            except ModbusError:
+                # The PLC answered with an exception code: it is alive
+                self._observe(args, start, failed=True)
+                raise
+            except Exception:
+                self._observe(args, start, failed=True)
+                self.healthy = False
+                self.master.close()
+                raise
+            rtt = time.perf_counter() - start
+            self._update_timeout(rtt)
+            self._observe(args, start)
+        return result
+
+    def _observe(self, args, start, failed=False):
+        if self.metrics is not None and len(args) > 1:
+            self.metrics.observe_request(self.name, args[1], time.perf_counter() - start, failed)
+
+    def close(self):
+        with self._lock:
+            self.master.close()
+            self.healthy = False
+
+
+class ConnectionPool:
+    """Connections to all the PLCs, in the order of plc_list.
+
+    Unhealthy connections are reopened by a background thread with exponential backoff
+    (with jitter), while the poller keeps sampling the healthy ones.
+    """
+
+    def __init__(self, plc_list, min_timeout=0.05, max_timeout=5.0, initial_timeout=1.0,
+                 backoff=1.0, max_backoff=60.0, metrics=None):
+        self.connections = [PLCConnection(plc[0], plc[1], plc[2], min_timeout, max_timeout, initial_timeout,
+                                          metrics)
+                            for plc in plc_list]
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __getitem__(self, index):
+        return self.connections[index]
+
+    def __len__(self):
+        return len(self.connections)
+
+    def __iter__(self):
+        return iter(self.connections)
+
+    def _try_connect(self, connection):
+        try:
+            connection.connect()
+        except Exception as e:
+            connection.failures += 1
+            delay = min(self.backoff * 2 ** (connection.failures - 1), self.max_backoff)
+            connection.next_retry = time.monotonic() + delay * random.uniform(0.5, 1.0)
+            logger.warning("PLC %s (%s:%s) unreachable (%s), retry in %.1f s",
+                           connection.name, connection.ip, connection.port, e, delay)
+
+    def _reconnect_loop(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for connection in self.connections:
+                if not connection.healthy and connection.next_retry <= now and not self._stop.is_set():
+                    self._try_connect(connection)
+            self._stop.wait(0.1)
+
+    def start(self):
+        """Connect to all the PLCs and start the background reconnection"""
+        for connection in self.connections:
+            self._try_connect(connection)
+        self._thread = threading.Thread(target=self._reconnect_loop, name='plc-reconnect', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        for connection in self.connections:
+            connection.close()
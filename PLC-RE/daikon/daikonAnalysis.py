@@ -2,11 +2,15 @@
 
 import os
 import re
+import sys
 import subprocess
 import networkx as nx
 import argparse
 import configparser
-import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from column_profile import read_profile
+from dataset_store import read_dataset
 
 
 class DaikonAnalysis:
@@ -144,14 +148,15 @@ class DaikonAnalysis:
         return str_max, str_min
 
     def find_sensors(self):
-        df = pd.read_csv(self.dataset)
-        df_cols = list(df.columns)
+        # Valori distinti delle colonne dal profilo del dataset, senza rileggerlo
+        profile = read_profile(self.dataset)
+        df_cols = list(profile)
         actuators_list = [k for k, v, in self.actuators.items()]
 
         # Se le colonne hanno un unico valore, abbiamo un attuatore di spare o un setpoint settato
         # nei registri, quindi elimino il registro dalla lista
         for col in df_cols[:]:
-            if len(df[col].unique()) == 1:
+            if profile[col]['cardinality'] == 1:
                 df_cols.remove(col)
 
         # Rimuovo dalla lista gli attuatori trovati in precedenza, ottenendo così i soli sensori
@@ -211,10 +216,10 @@ class DaikonAnalysis:
         # actuators_list = [key for key, value in self.actuators.items()]
         actuators_list = self.__select_actuators()
 
-        df = pd.read_csv(os.path.join(self.config['PATHS']['project_dir'],
-                                      self.config['DAIKON']['daikon_invariants_dir'],
-                                      self.dataset),
-                         usecols=actuators_list)
+        df = read_dataset(os.path.join(self.config['PATHS']['project_dir'],
+                                       self.config['DAIKON']['daikon_invariants_dir'],
+                                       self.dataset),
+                          bool_as_int=True, usecols=actuators_list)
 
         actuators_states = df[actuators_list].drop_duplicates().to_numpy()
         sensor_condition = ''
@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 
-import pandas as pd
 import os
+import sys
 import argparse
 import configparser
 import subprocess
 import re
 import tslearn
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dataset_store import read_dataset
+
 
 class ActuatorsBehaviour:
     def __init__(self):
@@ -103,7 +106,8 @@ class ActuatorsBehaviour:
         return equals
 
     def actuator_status_change(self, file, actuator, sensor):
-        df = pd.read_csv(file, usecols=[actuator, self.config["DATASET"]["prev_cols_prefix"] + actuator, sensor])
+        df = read_dataset(file, bool_as_int=True,
+                          usecols=[actuator, self.config["DATASET"]["prev_cols_prefix"] + actuator, sensor])
 
         for v in self.actuators[actuator]:
             print(df[df.eval(f'{actuator} == {v} and {self.config["DATASET"]["prev_cols_prefix"]}{actuator} != {v}')])
@@ -112,7 +116,7 @@ class ActuatorsBehaviour:
         # print(df[df.eval(f'P1.MV101 == 0 and P1.P101 == 1')])
 
     def actuator_status_period(self, file, actuator):
-        df = pd.read_csv(file, encoding='utf-8', usecols=[actuator])
+        df = read_dataset(file, bool_as_int=True, encoding='utf-8', usecols=[actuator])
         vals_act = [x for x in df[actuator]]
 
         for v in self.actuators[actuator]:
@@ -0,0 +1,427 @@
+import contextlib
+import glob
+import io
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from pandas._libs.tslibs.parsing import guess_datetime_format
+
+from partition_store import PartitionedDataset
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+# Row index of a csv dataset (row_index()): rows between two offsets, and bytes before the end of the
+# indexed rows compared to tell appended rows from a rewritten csv
+ROW_INDEX_STEP = 1024
+ROW_INDEX_TAIL = 4096
+
+
+def column_name(plc, column):
+    """Dataset column of a register, e.g. Coils/%QX0.0 of PLC 1 -> PLC1_Coils_QX00"""
+    return f'PLC{plc}_' + column.replace('/', '_').replace('%', '').replace('.', '')
+
+
+def dataset_path(directory, plc):
+    return os.path.join(directory, f'PLC{plc}Dataset.csv')
+
+
+def dataset_files(directory):
+    """csv datasets of a directory, including the ones kept only as partitions (the csv was deleted after the
+    import)"""
+    files = set(glob.glob(os.path.join(directory, '*.csv')))
+    files.update(os.path.splitext(p)[0] + '.csv' for p in glob.glob(os.path.join(directory, '*.parts'))
+                 if PartitionedDataset.exists(os.path.splitext(p)[0] + '.csv'))
+    return sorted(files)
+
+
+def dtypes_path(path):
+    """Type schema of a csv dataset: PLC1Dataset.csv -> PLC1Dataset.dtypes.json"""
+    return os.path.splitext(path)[0] + '.dtypes.json'
+
+
+def write_dtypes(path, dtypes):
+    """Save the column -> dtype name (bool, uint16, int16, float32, ...) schema of a csv dataset"""
+    with open(dtypes_path(path), 'w') as f:
+        json.dump({column: np.dtype(dtype).name for column, dtype in dtypes.items()}, f, indent=1)
+
+
+def read_dtypes(path):
+    """Type schema of a csv dataset, empty if the dataset has none"""
+    if not os.path.exists(dtypes_path(path)):
+        return {}
+    with open(dtypes_path(path)) as f:
+        return json.load(f)
+
+
+def parse_timestamps(values, format=None):
+    """Timestamp column as datetime64, parsed at once with `format` (inferred from the first value if None;
+    per value only if the values have different formats)"""
+    try:
+        return pd.to_datetime(values, format=format)
+    except (ValueError, TypeError):
+        return pd.to_datetime(values)
+
+
+def timestamp_format(path, timestamp_col='Timestamp'):
+    """Format of the timestamps of a csv dataset, inferred from its first row (None without csv or rows)
+
+    Every read of the dataset parses its timestamps with it, so that the rows found by the binary search
+    of time_range_offsets() and the rows filtered after reading them compare the same way (e.g. with
+    day-first dates).
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        header = f.readline().decode().rstrip('\r\n').split(',')
+        fields = f.readline().decode().rstrip('\r\n').split(',')
+    if timestamp_col not in header or len(fields) <= header.index(timestamp_col):
+        return None
+    return guess_datetime_format(fields[header.index(timestamp_col)])
+
+
+def _row_at(f, pos, data_start, column, format=None):
+    """Offset and timestamp of the first row starting at or after byte `pos` (timestamp None after the last row)"""
+    if pos > data_start:
+        # If pos-1 is a line end, pos is already the start of a row
+        f.seek(pos - 1)
+        f.readline()
+    else:
+        f.seek(data_start)
+    offset = f.tell()
+    fields = f.readline().rstrip(b'\r\n').split(b',')
+    if len(fields) <= column:
+        return offset, None
+    return offset, parse_timestamps(pd.Series([fields[column].decode()]), format)[0]
+
+
+def time_range_offsets(path, start, end, timestamp_col='Timestamp'):
+    """Byte offsets [first, last) of the rows of a chronological csv dataset with timestamp in [start, end],
+    found by binary search on the rows (without reading the rest of the file)"""
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    format = timestamp_format(path, timestamp_col)
+    with open(path, 'rb') as f:
+        header = f.readline()
+        column = header.decode().rstrip('\r\n').split(',').index(timestamp_col)
+        data_start = f.tell()
+        size = os.fstat(f.fileno()).st_size
+
+        def first_row(after):
+            # First row with timestamp > end (after) or >= start
+            lo, hi = data_start, size
+            while lo < hi:
+                mid = (lo + hi) // 2
+                _, ts = _row_at(f, mid, data_start, column, format)
+                if ts is None or (ts > end if after else ts >= start):
+                    hi = mid
+                else:
+                    lo = mid + 1
+            return _row_at(f, lo, data_start, column)[0]
+
+        return first_row(False), first_row(True)
+
+
+def row_index_path(path):
+    """Row offsets index of a csv dataset: PLC1Dataset.csv -> PLC1Dataset.rows.npz"""
+    return os.path.splitext(path)[0] + '.rows.npz'
+
+
+def _index_rows(f, index, size):
+    """Extend `index` with the offsets of the rows multiple of its step, from its end to the last complete row"""
+    step = index['step']
+    offsets = [index['offsets']]
+    f.seek(index['end'])
+    pos = index['end']
+    while pos < size:
+        block = np.frombuffer(f.read(min(1 << 24, size - pos)), dtype=np.uint8)
+        if not len(block):
+            break
+        # The next row starts after every line end
+        starts = np.flatnonzero(block == ord('\n')) + pos + 1
+        numbers = index['rows'] + 1 + np.arange(len(starts))
+        offsets.append(starts[numbers % step == 0])
+        if len(starts):
+            index['rows'] += len(starts)
+            index['end'] = int(starts[-1])
+        pos += len(block)
+    index['offsets'] = np.concatenate(offsets)
+    return index
+
+
+def row_index(path, step=ROW_INDEX_STEP):
+    """Byte offsets of the rows 0, step, 2*step, ... of a csv dataset, kept in a sidecar next to it
+    (row_index_path()) and extended to the rows appended since (the datasets only grow by appended rows,
+    see DatasetWriter; a rewritten csv is indexed again). Rows with quoted line breaks are not supported."""
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        header = f.readline()
+        index = None
+        if os.path.exists(row_index_path(path)):
+            with np.load(row_index_path(path)) as saved:
+                index = {k: saved[k] if k == 'offsets' else saved[k].item() for k in saved.files}
+            if index['size'] == stat.st_size and index['mtime_ns'] == stat.st_mtime_ns and index['step'] == step:
+                return index
+            # Rows appended at the end: the last indexed rows did not change
+            f.seek(max(index['end'] - ROW_INDEX_TAIL, 0))
+            if (index['header'] != header or index['step'] != step or index['end'] > stat.st_size
+                    or f.read(index['end'] - f.tell()) != index['tail']):
+                index = None
+        if index is None:
+            index = {'step': step, 'header': header, 'offsets': np.array([len(header)], dtype=np.int64),
+                     'rows': 0, 'end': len(header)}
+        index = _index_rows(f, index, stat.st_size)
+        f.seek(max(index['end'] - ROW_INDEX_TAIL, 0))
+        index.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns, tail=f.read(index['end'] - f.tell()))
+
+    tmp = row_index_path(path) + '.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            np.savez(f, **index)
+        os.replace(tmp, row_index_path(path))
+    except OSError as e:
+        logger.warning("%s: row index not saved (%s)", path, e)
+    return index
+
+
+def row_offsets(path, first, last=None):
+    """Byte offsets [first, last) of the data rows first .. last-1 of a csv dataset (to the end of the file
+    if `last` is None), found from the row index instead of reading the rows before"""
+    index = row_index(path)
+    step = index['step']
+    with open(path, 'rb') as f:
+        def offset(row):
+            i = min(row // step, len(index['offsets']) - 1)
+            f.seek(index['offsets'][i])
+            for _ in range(row - i * step):
+                if not f.readline():
+                    break
+            return f.tell()
+
+        return offset(first), os.fstat(f.fileno()).st_size if last is None else offset(last)
+
+
+def _leading_rows(skiprows):
+    """Rows skipped by a `skiprows` of the first rows after the header (1 .. n), None for any other skiprows"""
+    if skiprows is None:
+        return 0
+    if callable(skiprows) or isinstance(skiprows, int):
+        return None
+    rows = range(1, len(skiprows) + 1)
+    if isinstance(skiprows, range):
+        return len(rows) if skiprows == rows else None
+    return len(rows) if list(skiprows) == list(rows) else None
+
+
+class _RowsWindow(io.RawIOBase):
+    """File-like object with the header and the bytes [first, last) of a csv dataset"""
+
+    def __init__(self, path, first, last):
+        self._file = open(path, 'rb')
+        self._header = self._file.readline()
+        self._file.seek(first)
+        self._left = max(last - first, 0)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._header:
+            n = min(len(b), len(self._header))
+            b[:n], self._header = self._header[:n], self._header[n:]
+            return n
+        n = self._file.readinto(memoryview(b)[:min(len(b), self._left)])
+        self._left -= n
+        return n
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def _read_partitions(dataset, dtypes, timerange, datetimes, usecols=None, skiprows=None, nrows=None,
+                     chunksize=None, encoding=None):
+    """read_dataset() from the partitions of the dataset"""
+    if callable(usecols):
+        usecols = [c for c in dataset.columns if usecols(c)]
+    # The skiprows of read_dataset() are the rows skipped after the header: 1 .. start
+    start = _leading_rows(skiprows)
+
+    def typed(df):
+        df = df.astype({c: d for c, d in dtypes.items() if c in df.columns})
+        if not datetimes and dataset.timestamp_col in df.columns:
+            df[dataset.timestamp_col] = df[dataset.timestamp_col].dt.strftime(TIMESTAMP_FORMAT)
+        return df
+
+    def rechunked():
+        # Chunks of chunksize rows as with pd.read_csv(), whatever the size of the partitions
+        frames = list()
+        rows = 0
+        for df in dataset.chunks(usecols, start, nrows, timerange):
+            frames.append(df)
+            rows += len(df)
+            while rows >= chunksize:
+                df = pd.concat(frames)
+                yield typed(df.iloc[:chunksize])
+                frames = [df.iloc[chunksize:]]
+                rows -= chunksize
+        if rows:
+            yield typed(pd.concat(frames))
+
+    if chunksize:
+        # closing() to use it like the reader of pd.read_csv()
+        return contextlib.closing(rechunked())
+    return typed(dataset.read(usecols, start, nrows, timerange))
+
+
+def read_dataset(path, bool_as_int=False, timerange=None, timestamp_col='Timestamp', datetimes=False, **kwargs):
+    """pd.read_csv() with the column types of the dataset schema (explicit `dtype` entries win)
+
+    If the dataset was imported in partitions (pre-processing/partitionDatasets.py) and the csv did not
+    change since, only the partitions and the columns selected are loaded from them.
+
+    Args:
+        path (string): csv dataset
+        bool_as_int (bool): read the bool columns as uint8, for the tools that format the values
+            into Daikon conditions (1, not True)
+        timerange (tuple): optional (start, end), read only the rows with `timestamp_col` in the range;
+            the rows of the dataset must be in chronological order (as captured), the range is found
+            by binary search and only its bytes are read
+        skiprows: as in pd.read_csv(); the first rows after the header (e.g. range(1, n + 1)) are not
+            read at all, the first row read is found from the row index of the dataset (row_index())
+        datetimes (bool): keep the timestamps of a partitioned dataset as datetime64 instead of formatting
+            them as in the csv (TIMESTAMP_FORMAT), for the tools that parse them anyway
+    """
+    dtypes = read_dtypes(path)
+    if bool_as_int:
+        dtypes = {c: 'uint8' if d == 'bool' else d for c, d in dtypes.items()}
+    usecols = kwargs.get('usecols')
+    if usecols is not None and not callable(usecols):
+        dtypes = {c: d for c, d in dtypes.items() if c in set(usecols)}
+    dtypes.update(kwargs.pop('dtype', None) or {})
+
+    if PartitionedDataset.exists(path):
+        dataset = PartitionedDataset(path)
+        supported = set(kwargs) <= {'usecols', 'skiprows', 'nrows', 'chunksize', 'encoding'} \
+            and _leading_rows(kwargs.get('skiprows')) is not None
+        if dataset.current() and supported:
+            return _read_partitions(dataset, dtypes, timerange, datetimes, **kwargs)
+        logger.warning("%s: partitions not used (csv changed after the import, or unsupported options)", path)
+
+    if timerange is not None:
+        first, last = time_range_offsets(path, timerange[0], timerange[1], timestamp_col)
+    elif _leading_rows(kwargs.get('skiprows')):
+        # The skipped rows are not read: start from the offset of the first row (row index)
+        start = _leading_rows(kwargs.pop('skiprows'))
+        nrows = kwargs.get('nrows')
+        first, last = row_offsets(path, start, None if nrows is None else start + nrows)
+    else:
+        return pd.read_csv(path, dtype=dtypes or None, **kwargs)
+
+    window = io.BufferedReader(_RowsWindow(path, first, last))
+    if kwargs.get('chunksize') or kwargs.get('iterator'):
+        # The file is closed with the reader
+        return pd.read_csv(window, dtype=dtypes or None, **kwargs)
+    with window:
+        return pd.read_csv(window, dtype=dtypes or None, **kwargs)
+
+
+def write_dataset(df, path, **kwargs):
+    """df.to_csv() plus the type schema of the typed columns; bools are written as 0/1, timestamps as text
+    (pass date_format to choose their format)"""
+    dtypes = {c: d for c, d in df.dtypes.items() if d != object and not isinstance(d, pd.StringDtype)
+              and not pd.api.types.is_datetime64_any_dtype(d)}
+    bools = [c for c, d in dtypes.items() if d == bool]
+    if bools:
+        df = df.astype({c: np.uint8 for c in bools})
+    df.to_csv(path, index=False, **kwargs)
+    write_dtypes(path, dtypes)
+
+
+class DatasetWriter:
+    """Flattened CSV dataset of a PLC, in the format read by mergeDatasets.py.
+
+    One row per sample: the timestamp column and one column per register, named as
+    convertoCSV.py names them, with the type of the register map saved in the schema
+    sidecar (bools are written as 0/1). Rows are buffered and written `block_rows`
+    at a time. A capture with the same registers is appended to an existing dataset;
+    a dataset with different columns is renamed to *.csv.old first.
+    """
+
+    def __init__(self, directory, name, columns, timestamp_col='Timestamp', block_rows=60, metrics=None):
+        self.name = str(name)
+        self.path = dataset_path(directory, self.name)
+        self.block_rows = block_rows
+        self.metrics = metrics
+        self.header = ','.join([timestamp_col] + [column_name(self.name, c) for c, _ in columns]) + '\n'
+        self.rows = list()
+        self.bools = [i for i, (_, dtype) in enumerate(columns) if np.dtype(dtype) == bool]
+
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                header = f.readline()
+            if header != self.header:
+                logger.warning("Columns of %s changed, the old dataset is renamed to %s.old", self.path, self.path)
+                os.replace(self.path, self.path + '.old')
+        new = not os.path.exists(self.path)
+        self._file = open(self.path, 'a')
+        if new:
+            self._write(self.header)
+        write_dtypes(self.path, {column_name(self.name, c): dtype for c, dtype in columns})
+
+    def _write(self, data):
+        self._file.write(data)
+        self._file.flush()
+        if self.metrics is not None:
+            self.metrics.add_bytes(self.name, len(data))
+
+    def append(self, ts, values):
+        timestamp = datetime.fromtimestamp(ts).strftime(TIMESTAMP_FORMAT)
+        fields = [str(v) for v in values]
+        for i in self.bools:
+            fields[i] = '1' if values[i] else '0'
+        self.rows.append(','.join([timestamp] + fields) + '\n')
+        if len(self.rows) >= self.block_rows:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self._write(''.join(self.rows))
+            self.rows = list()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class DatasetStore:
+    """Dataset writers of all the PLCs, created on the first sample of each PLC (same interface as SegmentStore)"""
+
+    def __init__(self, directory, timestamp_col='Timestamp', block_rows=60, metrics=None):
+        self.directory = directory
+        self.timestamp_col = timestamp_col
+        self.block_rows = block_rows
+        self.metrics = metrics
+        self.writers = dict()
+        self._lock = threading.Lock()
+
+    def append(self, name, ip, port, columns, ts, values, deadbands=None):
+        """Append a sample of a PLC (`ip`, `port` and `deadbands` are not used: every sample is stored)"""
+        key = str(name)
+        writer = self.writers.get(key)
+        if writer is None:
+            with self._lock:
+                if key not in self.writers:
+                    self.writers[key] = DatasetWriter(self.directory, name, columns, self.timestamp_col,
+                                                      self.block_rows, self.metrics)
+                writer = self.writers[key]
+        writer.append(ts, values)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
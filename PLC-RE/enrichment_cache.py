@@ -0,0 +1,72 @@
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EnrichmentCache:
+    """Content-addressed cache of the enrichment columns of mergeDatasets.py
+
+    An entry is the column computed by a feature (e.g. the STL trend) from the values of an input column,
+    saved as <key>.npy, where the key is the digest of the feature name, of the input values and of the
+    parameters that feature depends on: the other parameters, or the columns selected by the regexes,
+    can change without invalidating it. When the entries take more than `max_bytes`, the least recently
+    used ones are removed (evict()).
+
+    Only the STL trends go through the cache: the other features (max/min, slope_, prev_) are computed
+    from the columns in about the time it takes to hash them, let alone to read an entry back.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(feature, values, **params):
+        """Key of the column computed by `feature` from `values` with `params`"""
+        values = np.ascontiguousarray(values)
+        digest = hashlib.sha1(f'{feature} {sorted(params.items())} {values.dtype.str} {values.shape}'.encode())
+        digest.update(memoryview(values).cast('B'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, key):
+        """Cached column, None if there is no entry for `key`"""
+        try:
+            values = np.load(self._path(key))
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        # The modification time is the last use, for the LRU eviction
+        os.utime(self._path(key))
+        self.hits += 1
+        return values
+
+    def put(self, key, values):
+        tmp = self._path(key) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, values)
+        os.replace(tmp, self._path(key))
+
+    def evict(self):
+        """Remove the least recently used entries until the cache takes at most `max_bytes`"""
+        with os.scandir(self.directory) as entries:
+            entries = [(e.stat().st_mtime_ns, e.stat().st_size, e.path) for e in entries if e.name.endswith('.npy')]
+        size = sum(s for _, s, _ in entries)
+        for _, s, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= s
+        logger.info("%s: %d bytes in the cache", self.directory, size)
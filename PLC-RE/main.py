@@ -1,17 +1,25 @@
 import pandas as pd #json 
 import os
 from datetime import datetime # Per il timestamp dei file JSON (per uso futuro)
-import time #needed for sleep and to capture data for set amount of time
-import ray # Execute in parallel -> ray.get([plc1.remote(), plc2.remote()])
+import asyncio
+import argparse
+import configparser
+import functools
 import json 
 from collections import defaultdict
 import modbus_tk
-import modbus_tk.defines as cst
-from modbus_tk import modbus_tcp, hooks
+from modbus_tk import hooks
 import logging
 import itertools
-from time import sleep
-import sys
+
+from connection_pool import ConnectionPool
+from dataset_store import DatasetStore
+from modbus_poller import AsyncPoller
+from poll_metrics import PollMetrics
+from register_map import RegisterMap
+from ring_buffer import LiveBuffers, QueryServer
+from segment_store import SegmentStore
+from sharding import run_sharded
 
 #logger
 logger = modbus_tk.utils.create_logger("console", level=logging.DEBUG)
@@ -22,117 +30,44 @@ logging.basicConfig(filename="plcHistoryTOOL",
                         datefmt='%H:%M:%S',
                         level=logging.DEBUG)
 
-#parallel distributed execution 
-ray.init()
 
 
+##Function to read data from the PLCs: the registers to read and the requests to send come from the register map
+def read_registers(name,ip,port,master,ora=None,register_maps=None,store=None,buffers=None,metrics=None,
+                   directory='historian'):
+    register_map = register_maps[str(name)] if register_maps else RegisterMap.default()
+    values = register_map.read_values(master)
 
-def connect_to_slave(ip,port):
-    """Connect to the slave
+    if ora is None:
+        ora=datetime.now(tz=None)
 
-    Args:
-        ip (string): ip of the modbus slave
-        port (int): port of the modbus slave
-    """
-    # Connect to the slave
-    ip=str(ip)
-    port=int(port)
-    master = modbus_tcp.TcpMaster(host=ip,port=port)
-    master.set_timeout(5.0)
-    logger.info("Connected to ip=%s:%s",ip,port)
-    return(master)
-
-##Functions to read data from the PLCs
-def read_c(master):
-    """read coils, coils are addressed as follows: [0-xxx].[0-7]
-
-    Args:
-        master (object): to send the read command to the right plc
-    """
-    registers= {}
-    values=master.execute(1, cst.READ_COILS, 0, 90)  
-    count=0
-    for c in range(0,11):
-        for a in range(0,8):
-            registers['%QX' + str(c) + '.' + str(a)] = str(values[count])
-            count+=1
-            
-    return(registers)
-    
-def read_ir(master):
-    """read input registers, ir are addressed as follows: [0-xxx]
-
-    Args:
-        master (object): to send the read command to the right plc
-    """
-    registers= {}
-    values=master.execute(1, cst.READ_INPUT_REGISTERS, 0, 11)
-    c=0
-    for i in values:
-        registers['%IW' + str(c)] = str(i)
-        c+=1    
-    return(registers)
-
-def read_di(master):
-    """read discrete input, di are addressed as follows: [0-xxx].[0-7]
-
-    Args:
-        master (object): to send the read command to the right plc
-    """
-    registers= {}
-    values=master.execute(1, cst.READ_DISCRETE_INPUTS, 0, 90)
-    count=0
-    for c in range(0,11):
-        for a in range(0,8):
-            registers['%IX' + str(c) + '.' + str(a)] = str(values[count])
-            count+=1
-    return(registers)
-    
-def read_mr(master):
-    """read memory registers, mr are addressed as follows: [0-xxx] and are holding registers starting from the address 1024
-
-    Args:
-        master (object): to send the read command to the right plc
-    """
-    registers= {}
-    values=master.execute(1, cst.READ_HOLDING_REGISTERS, 1024, 11)
-    c=0
-    for i in values:
-        registers['%MW' + str(c)] = str(i)
-        c+=1    
-    return(registers)
-    
-def read_hr(master):
-    """read holding registers, hr are addressed as follows: [0-xxx]
-
-    Args:
-        master (object): to send the read command to the right plc
-    """
-    registers= {}
-    values=master.execute(1, cst.READ_HOLDING_REGISTERS, 0, 11)
-    c=0
-    for i in values:
-        registers['%QW' + str(c)] = str(i)
-        c+=1    
-    return(registers)
-    
-@ray.remote
-def read_registers(name,ip,port,master):
+    save_registers(name,ip,port,values,ora,register_map,store,buffers,metrics,directory)
+
+#function that stores a sample: in the live buffers, in the store of the PLC (segments or csv dataset) or in a json file
+#of the output directory
+def save_registers(name,ip,port,values,ora,register_map,store=None,buffers=None,metrics=None,directory='historian'):
     name=str(name)
     ip=str(ip)
     port=str(port)
+
+    #last minutes kept in memory for the query endpoint
+    if buffers is not None:
+        buffers.append(name, ip, port, register_map.schema(), ora.timestamp(), values)
+
+    #binary rows appended to the segments of the PLC, or flattened rows appended to its dataset
+    if store is not None:
+        store.append(name, ip, port, register_map.schema(), ora.timestamp(), values, register_map.deadbands)
+        return
+
+    #legacy format: one JSON file per poll
     single_plc_registers = defaultdict(dict)
-    
-    single_plc_registers[ip]['DiscreteInputRegisters'] = read_di(master)
-    single_plc_registers[ip]['InputRegisters'] = read_ir(master)
-    single_plc_registers[ip]['HoldingOutputRegisters'] = read_hr(master)
-    single_plc_registers[ip]['MemoryRegisters'] = read_mr(master)
-    single_plc_registers[ip]['Coils'] = read_c(master)
-    
-    ora=datetime.now(tz=None)
-
-    with open(f'historian/plc{name}-{ip}-{port}@{ora}.json', 'w') as sp:
-        sp.write(json.dumps(single_plc_registers, indent=4))
+    single_plc_registers[ip] = register_map.to_dict(values)
+
+    data = json.dumps(single_plc_registers, indent=4)
+    with open(os.path.join(directory, f'plc{name}-{ip}-{port}@{ora}.json'), 'w') as sp:
+        sp.write(data)
+    if metrics is not None:
+        metrics.add_bytes(name, len(data))
 
 #function that asks the user to input the ip and port of the PLCs and outputs a list of tuples
 def ask_plc():
@@ -146,26 +81,139 @@ def ask_plc():
         plc_list.append((name,ip,port))
     return(plc_list)
 
-#function that gets a list of tuples and connects the PLCs and return a list of objects with the connection
-def connect_plc(plc_list):
-    plc_connection=[]
+#function that parses a PLC given on the command line as name:ip:port
+def parse_plc(spec):
+    try:
+        name,ip,port=spec.rsplit(':',2)
+        return((name,ip,str(int(port))))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid PLC {spec!r}, expected name:ip:port")
+
+#function that gets a list of tuples and connects the PLCs. Returns the pool of connections (one per PLC, same order),
+#which keeps them alive and reconnects the unreachable PLCs in background
+def connect_plc(plc_list,config=None,metrics=None):
+    return(ConnectionPool(plc_list,metrics=metrics,**pool_options(config)).start())
+
+#function that returns the options of the connection pool set in config.ini
+def pool_options(config=None):
+    if config is None:
+        return({})
+    return(dict(min_timeout=config['HISTORIAN'].getfloat('timeout_min'),
+                max_timeout=config['HISTORIAN'].getfloat('timeout_max'),
+                initial_timeout=config['HISTORIAN'].getfloat('timeout_initial'),
+                backoff=config['HISTORIAN'].getfloat('reconnect_backoff'),
+                max_backoff=config['HISTORIAN'].getfloat('reconnect_backoff_max')))
+
+#function that loads the register map of every PLC (register_maps/plc<name>.ini, or default.ini)
+def load_register_maps(plc_list,directory,max_gap):
+    register_maps={}
     for plc in plc_list:
-        plc_connection.append(connect_to_slave(plc[1],plc[2]))
-    return(plc_connection)
-
-#function that triggers the read of the registers and saves the data in a json file
-def read_and_save(plc_list,plc_connection):
-    t_end = time.time() + int(sys.argv[1])
-    
-    while time.time() < t_end:
-        for plc,connection in zip(plc_list,plc_connection):
-            read_registers(plc[0],plc[1],plc[2],connection)
-            sleep(float(sys.argv[2]))
+        register_maps[plc[0]]=RegisterMap.for_plc(directory,plc[0],max_gap)
+        logger.info("PLC %s: %d read requests per poll",plc[0],len(register_maps[plc[0]].blocks))
+    return(register_maps)
+
+#function that triggers the read of the registers and saves the data in the store (or in json files).
+#All the PLCs are polled concurrently, once per period, on a shared clock
+def read_and_save(plc_list,plc_connection,duration,period,register_maps=None,store=None,buffers=None,metrics=None,
+                  directory='historian'):
+    poll_fn = functools.partial(read_registers, register_maps=register_maps, store=store, buffers=buffers,
+                                metrics=metrics, directory=directory)
+    poller = AsyncPoller(plc_list, plc_connection, period, poll_fn, metrics=metrics)
+    try:
+        asyncio.run(poller.run(duration))
+    finally:
+        if store is not None:
+            store.close()
+        if isinstance(plc_connection, ConnectionPool):
+            plc_connection.close()
+
+#same as read_and_save, with the PLCs split among worker processes that stream the samples to this process
+def read_and_save_sharded(plc_list,shards,duration,period,register_maps,store=None,buffers=None,config=None,
+                          metrics=None,directory='historian'):
+    save_fn = functools.partial(save_registers_by_name, register_maps=register_maps, store=store, buffers=buffers,
+                                metrics=metrics, directory=directory)
+    try:
+        run_sharded(plc_list, register_maps, shards, duration, period, save_fn, pool_options(config), metrics)
+    finally:
+        if store is not None:
+            store.close()
+
+def save_registers_by_name(name,ip,port,values,ora,register_maps,store=None,buffers=None,metrics=None,
+                           directory='historian'):
+    save_registers(name,ip,port,values,ora,register_maps[str(name)],store,buffers,metrics,directory)
+
+def parse_args(config):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("duration", type=int, help="capture length in seconds")
+    parser.add_argument("period", type=float, help="sampling period in seconds")
+    parser.add_argument('-m', "--mapdir", type=str, default=config['HISTORIAN']['register_maps_dir'],
+                        help="directory containing the register maps (plc<name>.ini)")
+    parser.add_argument('-g', "--maxgap", type=int, default=config['HISTORIAN']['max_gap'],
+                        help="max unused addresses read to merge two ranges in a single request")
+    parser.add_argument('-f', "--format", choices=['segment', 'csv', 'json'], default=config['HISTORIAN']['storage'],
+                        help="storage format: binary segments, analysis-ready csv datasets (PLC<name>Dataset.csv) "
+                             "or one json file per poll")
+    parser.add_argument('-r', "--recording", choices=['full', 'changes'], default=config['HISTORIAN']['recording'],
+                        help="store every sample, or keyframes plus the registers changed beyond their deadband")
+    parser.add_argument('-o', "--output", type=str, default=config['HISTORIAN']['historian_dir'],
+                        help="output directory of the segments, of the csv datasets or of the json files")
+    parser.add_argument('-j', "--shards", type=int, default=config['HISTORIAN']['shards'],
+                        help="number of polling processes (1 polls from this process)")
+    parser.add_argument('-q', "--queryport", type=int, default=config['HISTORIAN']['query_port'],
+                        help="localhost port of the live query endpoint (0 to disable)")
+    parser.add_argument('-p', "--plcs", type=parse_plc, nargs='+', default=None, metavar="NAME:IP:PORT",
+                        help="PLCs to poll (asked interactively if omitted)")
+    parser.add_argument("--metrics", type=str, default=config['HISTORIAN']['metrics_file'],
+                        help="json file where the polling metrics are exported (empty to disable)")
+    return parser.parse_args()
 
 def main(): 
-    plc_list=ask_plc()
-    plc_connection=connect_plc(plc_list)
-    read_and_save(plc_list,plc_connection)
+    config=configparser.ConfigParser()
+    config.read('config.ini')
+    args=parse_args(config)
+    plc_list=args.plcs if args.plcs else ask_plc()
+    register_maps=load_register_maps(plc_list,args.mapdir,args.maxgap)
+
+    metrics=PollMetrics(args.period)
+    if args.metrics:
+        metrics.start_export(args.metrics,config['HISTORIAN'].getfloat('metrics_interval'))
+
+    store=None
+    if args.format == 'segment':
+        store=SegmentStore(args.output,
+                           max_bytes=config['HISTORIAN'].getint('segment_max_mb')*2**20,
+                           max_seconds=config['HISTORIAN'].getint('segment_max_seconds'),
+                           block_rows=config['HISTORIAN'].getint('segment_block_rows'),
+                           recording=args.recording,
+                           keyframe_interval=config['HISTORIAN'].getint('keyframe_interval'),
+                           metrics=metrics)
+    elif args.format == 'csv':
+        store=DatasetStore(args.output,
+                           timestamp_col=config['DATASET']['timestamp_col'],
+                           block_rows=config['HISTORIAN'].getint('segment_block_rows'),
+                           metrics=metrics)
+    else:
+        #json files written straight in the output directory
+        os.makedirs(args.output, exist_ok=True)
+
+    buffers=None
+    server=None
+    if args.queryport:
+        buffers=LiveBuffers(config['HISTORIAN'].getfloat('live_minutes'),args.period)
+        server=QueryServer(buffers,args.queryport).start()
+    try:
+        if args.shards > 1:
+            read_and_save_sharded(plc_list,args.shards,args.duration,args.period,register_maps,store,buffers,config,
+                                  metrics,args.output)
+        else:
+            plc_connection=connect_plc(plc_list,config,metrics)
+            read_and_save(plc_list,plc_connection,args.duration,args.period,register_maps,store,buffers,metrics,
+                          args.output)
+    finally:
+        if server is not None:
+            server.close()
+        metrics.stop_export(args.metrics)
+        print(metrics.summary())
 
 if __name__ == '__main__':
     main()
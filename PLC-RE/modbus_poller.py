@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPoller:
+    """Poll all the PLCs concurrently on a shared, drift-compensated tick.
+
+    Ticks are scheduled at ``start + k * period`` on the monotonic clock, so the
+    sampling period does not grow with the number of PLCs and does not drift when
+    a poll takes longer than expected. Every PLC polled in the same tick gets the
+    same (wall clock) timestamp.
+
+    modbus_tk is blocking, so each poll runs in a worker thread. A PLC that is
+    still busy with the previous tick is skipped instead of queueing up requests,
+    and so is a PLC whose connection is not healthy (see connection_pool).
+    """
+
+    def __init__(self, plc_list, plc_connection, period, poll_fn, max_workers=None, metrics=None):
+        """
+        Args:
+            plc_list (list): list of (name, ip, port) tuples
+            plc_connection (list): connection objects, in the same order of plc_list
+            period (float): sampling period in seconds
+            poll_fn (callable): poll_fn(name, ip, port, connection, ora) reads and stores one sample
+            max_workers (int): number of polling threads (default: one per PLC)
+            metrics (PollMetrics): optional timing instrumentation
+        """
+        self.plc_list = plc_list
+        self.plc_connection = plc_connection
+        self.period = float(period)
+        self.poll_fn = poll_fn
+        self.max_workers = max_workers or max(len(plc_list), 1)
+        self.metrics = metrics
+
+        self.ticks = 0
+        self.missed_ticks = 0
+        self.skipped_polls = 0
+        self.failed_polls = 0
+        self.unhealthy_polls = 0
+        self._in_flight = set()
+
+    def _timed_poll(self, name, ip, port, connection, ora, tick):
+        started = time.monotonic()
+        try:
+            self.poll_fn(name, ip, port, connection, ora)
+        except Exception:
+            if self.metrics is not None:
+                self.metrics.observe_poll(name, tick, started, time.monotonic(), failed=True)
+            raise
+        if self.metrics is not None:
+            self.metrics.observe_poll(name, tick, started, time.monotonic())
+
+    async def _poll_plc(self, loop, executor, index, ora, tick):
+        name, ip, port = self.plc_list[index][:3]
+        try:
+            await loop.run_in_executor(executor, self._timed_poll, name, ip, port, self.plc_connection[index],
+                                       ora, tick)
+        except Exception as e:
+            self.failed_polls += 1
+            logger.error("Poll of PLC %s (%s:%s) failed: %s", name, ip, port, e)
+        finally:
+            self._in_flight.discard(index)
+
+    def _dispatch(self, loop, executor, tasks, ora, tick):
+        for index in range(len(self.plc_list)):
+            if index in self._in_flight:
+                # The previous poll of this PLC is still running: do not stack requests
+                self.skipped_polls += 1
+                if self.metrics is not None:
+                    self.metrics.skipped(self.plc_list[index][0], 'busy')
+                continue
+            if not getattr(self.plc_connection[index], 'healthy', True):
+                # Reconnection is handled in background: keep the cadence for the other PLCs
+                self.unhealthy_polls += 1
+                if self.metrics is not None:
+                    self.metrics.skipped(self.plc_list[index][0], 'unhealthy')
+                continue
+            self._in_flight.add(index)
+            task = loop.create_task(self._poll_plc(loop, executor, index, ora, tick))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    async def run(self, duration, start=None):
+        """Poll until `duration` seconds have elapsed.
+
+        Args:
+            duration (float): capture length in seconds
+            start (tuple): optional (monotonic, wall clock) start time, to align several pollers
+        """
+        loop = asyncio.get_running_loop()
+        start_mono, start_wall = start if start else (time.monotonic(), time.time())
+        end_mono = start_mono + float(duration)
+        tasks = set()
+        tick = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                tick_mono = start_mono + tick * self.period
+                if tick_mono >= end_mono:
+                    break
+
+                delay = tick_mono - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                ora = datetime.fromtimestamp(start_wall + tick * self.period)
+                self._dispatch(loop, executor, tasks, ora, tick_mono)
+                self.ticks += 1
+
+                # Drift compensation: if the slot of the next tick is already over, skip
+                # to the current one instead of firing a burst of late ticks
+                current = int((time.monotonic() - start_mono) // self.period)
+                if current > tick + 1:
+                    self.missed_ticks += current - tick - 1
+                    if self.metrics is not None:
+                        self.metrics.missed_ticks += current - tick - 1
+                    tick = current
+                else:
+                    tick += 1
+
+            if tasks:
+                await asyncio.gather(*tasks)
+
+        if self.missed_ticks or self.skipped_polls or self.unhealthy_polls:
+            logger.warning("Missed %d ticks, skipped %d polls of busy PLCs and %d of unhealthy PLCs",
+                           self.missed_ticks, self.skipped_polls, self.unhealthy_polls)
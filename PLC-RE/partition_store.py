@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Partitioned dataset layout, next to the csv it was imported from (PLC1Dataset.csv -> PLC1Dataset.parts/):
+#   manifest.json          columns, source csv and, per partition, rows, first/last timestamp and column stats
+#   <partition>/<i>.npy    values of the i-th column of the partition (e.g. 20151228T10/3.npy)
+# A dataset without timestamp column (e.g. the Daikon datasets) is split every PARTITION_ROWS rows.
+MANIFEST = 'manifest.json'
+FREQS = {'hour': ('h', '%Y%m%dT%H'), 'day': ('D', '%Y%m%d')}
+PARTITION_ROWS = 86400
+
+
+def partitions_path(path):
+    """Partitioned copy of a csv dataset: PLC1Dataset.csv -> PLC1Dataset.parts"""
+    return os.path.splitext(path)[0] + '.parts'
+
+
+def _source(path):
+    if not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def _stats(values):
+    """min, max, non-zero and null values of a numeric column of a partition"""
+    if values.dtype == bool:
+        values = values.astype(np.uint8)
+    nulls = int(np.isnan(values).sum()) if values.dtype.kind == 'f' else 0
+    valid = values[~np.isnan(values)] if nulls else values
+    return {'min': valid.min().item() if len(valid) else None,
+            'max': valid.max().item() if len(valid) else None,
+            'nonzero': int(np.count_nonzero(valid)),
+            'nulls': nulls}
+
+
+class PartitionWriter:
+    """Writes the rows of a dataset, in chronological order, in one partition per hour or day of the timestamps
+    (or per PARTITION_ROWS rows if the dataset has no `timestamp_col`)
+
+    Every partition is a directory with a .npy file per column; the manifest, written by close(),
+    records the columns and, per partition, its rows, first and last timestamp and the min, max,
+    non-zero and null values of the numeric columns. The previous partitions of the dataset are
+    replaced when the new ones are complete.
+    """
+
+    def __init__(self, path, timestamp_col='Timestamp', freq='day'):
+        self.path = path
+        self.directory = partitions_path(path)
+        self.timestamp_col = timestamp_col
+        self.freq, self.name_format = FREQS[freq]
+        self.manifest = {'source': _source(path), 'freq': freq, 'timestamp_col': timestamp_col,
+                         'columns': None, 'partitions': []}
+        self.rows = 0
+        self.key = None
+        self.pending = list()
+
+        self._tmp = self.directory + '.tmp'
+        shutil.rmtree(self._tmp, ignore_errors=True)
+        os.makedirs(self._tmp)
+
+    def append(self, df):
+        """Append rows; `timestamp_col` must be datetime64 (see dataset_store.parse_timestamps())"""
+        if self.manifest['columns'] is None:
+            self.manifest['columns'] = [[c, self._dtype(df[c]).str] for c in df.columns]
+            if self.timestamp_col not in df.columns:
+                self.manifest['timestamp_col'] = None
+        if self.manifest['timestamp_col'] is None:
+            keys = (self.rows + sum(len(p) for p in self.pending) + np.arange(len(df))) // PARTITION_ROWS
+        else:
+            keys = df[self.timestamp_col].dt.floor(self.freq).to_numpy()
+        # Consecutive rows with the same hour (or day)
+        bounds = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(df)]):
+            if keys[start] != self.key:
+                self._flush()
+                self.key = keys[start]
+            self.pending.append(df.iloc[start:end])
+
+    @staticmethod
+    def _dtype(column):
+        # Text columns are saved as fixed-length strings
+        return column.dtype if isinstance(column.dtype, np.dtype) and column.dtype != object else np.dtype(str)
+
+    def _flush(self):
+        if not self.pending:
+            return
+        df = pd.concat(self.pending)
+        self.pending = list()
+
+        if self.manifest['timestamp_col'] is None:
+            name = f'rows{self.rows}'
+        else:
+            name = pd.Timestamp(self.key).strftime(self.name_format)
+        names = {p['name'] for p in self.manifest['partitions']}
+        if name in names:
+            # Rows out of chronological order: the partition with the same hour becomes a separate partition
+            name += '-' + str(sum(n.split('-')[0] == name for n in names))
+        os.makedirs(os.path.join(self._tmp, name))
+
+        stats = dict()
+        for i, (column, dtype) in enumerate(self.manifest['columns']):
+            values = df[column].to_numpy()
+            if np.dtype(dtype).kind == 'U':
+                values = values.astype(str)
+            np.save(os.path.join(self._tmp, name, f'{i}.npy'), values.astype(dtype, copy=False))
+            if column != self.timestamp_col and np.dtype(dtype).kind in 'biuf':
+                stats[column] = _stats(values)
+
+        partition = {'name': name, 'first_row': self.rows, 'rows': len(df), 'ts_min': None, 'ts_max': None,
+                     'stats': stats}
+        if self.manifest['timestamp_col'] is not None:
+            partition['ts_min'] = df[self.timestamp_col].min().isoformat()
+            partition['ts_max'] = df[self.timestamp_col].max().isoformat()
+        self.manifest['partitions'].append(partition)
+        self.rows += len(df)
+
+    def close(self):
+        self._flush()
+        with open(os.path.join(self._tmp, MANIFEST), 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.replace(self._tmp, self.directory)
+        logger.info("%s: %d rows in %d partitions", self.directory, self.rows, len(self.manifest['partitions']))
+
+
+class PartitionedDataset:
+    """Reader of the partitions of a dataset (PartitionWriter), loading only the partitions and columns needed"""
+
+    def __init__(self, path):
+        self.path = path
+        self.directory = partitions_path(path)
+        with open(os.path.join(self.directory, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.timestamp_col = self.manifest['timestamp_col']
+        self.columns = [c for c, _ in self.manifest['columns']]
+        self.rows = sum(p['rows'] for p in self.manifest['partitions'])
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(partitions_path(path), MANIFEST))
+
+    def current(self):
+        """False if the csv was changed after the import (the csv can be deleted after the import)"""
+        source = _source(self.path)
+        return source is None or source == self.manifest['source']
+
+    def chunks(self, columns=None, start=0, nrows=None, timerange=None):
+        """Rows of the selected partitions, one DataFrame per partition
+
+        Args:
+            columns (list): columns to load, in the order of the dataset (default: all)
+            start (int): first row
+            nrows (int): max rows from `start`
+            timerange (tuple): optional (start, end), only the rows with timestamp in the range
+        """
+        if columns is None:
+            columns = self.columns
+        indexes = [i for i, c in enumerate(self.columns) if c in set(columns)]
+        end = self.rows if nrows is None else min(start + nrows, self.rows)
+        if timerange is not None:
+            if self.timestamp_col is None:
+                raise ValueError(f'{self.directory}: no timestamp column, cannot select a time range')
+            timerange = pd.Timestamp(timerange[0]), pd.Timestamp(timerange[1])
+
+        # Rows numbered from the first one selected, as pd.read_csv() returns them
+        index = 0
+        for partition in self.manifest['partitions']:
+            first, last = partition['first_row'], partition['first_row'] + partition['rows']
+            if last <= start or first >= end:
+                continue
+            if timerange is not None and (pd.Timestamp(partition['ts_max']) < timerange[0]
+                                          or pd.Timestamp(partition['ts_min']) > timerange[1]):
+                continue
+
+            rows = slice(max(start - first, 0), min(end, last) - first)
+            folder = os.path.join(self.directory, partition['name'])
+            selected = np.ones(rows.stop - rows.start, dtype=bool)
+            if timerange is not None:
+                timestamps = np.load(os.path.join(folder, f'{self.columns.index(self.timestamp_col)}.npy'),
+                                     mmap_mode='r')[rows]
+                selected = (timestamps >= timerange[0].to_datetime64()) & (timestamps <= timerange[1].to_datetime64())
+
+            df = pd.DataFrame({self.columns[i]: np.load(os.path.join(folder, f'{i}.npy'), mmap_mode='r')[rows][selected]
+                               for i in indexes})
+            df.index = pd.RangeIndex(index, index + len(df))
+            index += len(df)
+            yield df
+
+    def read(self, columns=None, start=0, nrows=None, timerange=None):
+        """Rows of the selected partitions in a single DataFrame (see chunks())"""
+        chunks = list(self.chunks(columns, start, nrows, timerange))
+        if not chunks:
+            return pd.DataFrame({c: np.array([], dtype=d) for c, d in self.manifest['columns']
+                                 if columns is None or c in set(columns)})
+        return pd.concat(chunks)
@@ -0,0 +1,163 @@
+import argparse
+import logging
+import random
+import threading
+import time
+
+import modbus_tk.defines as cst
+from modbus_tk import hooks, modbus_tcp
+
+from register_map import TABLES
+
+logger = logging.getLogger(__name__)
+
+# Modbus block type serving each read function
+BLOCK_TYPES = {
+    cst.READ_COILS: cst.COILS,
+    cst.READ_DISCRETE_INPUTS: cst.DISCRETE_INPUTS,
+    cst.READ_HOLDING_REGISTERS: cst.HOLDING_REGISTERS,
+    cst.READ_INPUT_REGISTERS: cst.ANALOG_INPUTS,
+}
+
+# Response delay of every simulated server, applied by the before_send hook
+_latencies = dict()
+_hook_lock = threading.Lock()
+_hook_installed = False
+
+
+def _delay_response(args):
+    server = args[0]
+    latency = _latencies.get(id(server))
+    if latency:
+        time.sleep(latency)
+
+
+def _install_hook():
+    global _hook_installed
+    with _hook_lock:
+        if not _hook_installed:
+            hooks.install_hook('modbus_tcp.TcpServer.before_send', _delay_response)
+            _hook_installed = True
+
+
+class SimulatedPLC:
+    """Modbus TCP slave on localhost exposing the register tables read by the historian.
+
+    Every table of register_map.TABLES is served from its base address: `bits` coils and
+    discrete inputs, `registers` input, holding and memory registers. A background thread
+    changes a fraction (`change_rate`) of the values every `update_period` seconds, and
+    every response is delayed by `latency` seconds to mimic a remote PLC.
+    """
+
+    def __init__(self, port, host='127.0.0.1', bits=88, registers=11, unit=1, latency=0.0, change_rate=0.1,
+                 update_period=0.1, seed=None):
+        self.port = int(port)
+        self.host = host
+        self.latency = float(latency)
+        self.change_rate = float(change_rate)
+        self.update_period = float(update_period)
+        self.random = random.Random(seed)
+
+        self.server = modbus_tcp.TcpServer(port=self.port, address=host)
+        self.slave = self.server.add_slave(unit)
+        self.blocks = list()
+        for table_name, table in TABLES.items():
+            size = bits if table.bits else registers
+            if size <= 0:
+                continue
+            self.slave.add_block(table_name, BLOCK_TYPES[table.function_code], table.base, size)
+            self.blocks.append((table_name, table.base, size, table.bits))
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def update(self):
+        """Change a random subset of the values (bits flip, registers take a random walk)"""
+        for table_name, base, size, bits in self.blocks:
+            changes = self.random.sample(range(size), max(int(size * self.change_rate), 0))
+            if not changes:
+                continue
+            values = list(self.slave.get_values(table_name, base, size))
+            for i in changes:
+                if bits:
+                    values[i] = 1 - values[i]
+                else:
+                    values[i] = min(max(values[i] + self.random.randint(-100, 100), 0), 65535)
+            self.slave.set_values(table_name, base, values)
+
+    def _update_loop(self):
+        while not self._stop.wait(self.update_period):
+            self.update()
+
+    def start(self):
+        _install_hook()
+        _latencies[id(self.server)] = self.latency
+        self.server.start()
+        if self.change_rate > 0:
+            self._thread = threading.Thread(target=self._update_loop, name=f'plc-sim-{self.port}', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.server.stop()
+        _latencies.pop(id(self.server), None)
+
+
+def start_fleet(count, first_port=5020, host='127.0.0.1', seed=None, **options):
+    """Start `count` simulated PLCs on consecutive ports
+
+    Returns:
+        simulators (list): the SimulatedPLC objects
+        plc_list (list): (name, ip, port) tuples, named 1..count
+    """
+    simulators = list()
+    plc_list = list()
+    for i in range(count):
+        simulator = SimulatedPLC(first_port + i, host, seed=None if seed is None else seed + i, **options)
+        simulators.append(simulator.start())
+        plc_list.append((str(i + 1), host, str(first_port + i)))
+    logger.info("Started %d simulated PLCs on %s:%d-%d", count, host, first_port, first_port + count - 1)
+    return simulators, plc_list
+
+
+def add_arguments(parser):
+    parser.add_argument('-n', "--count", type=int, default=3, help="number of simulated PLCs")
+    parser.add_argument('-p', "--port", type=int, default=5020, help="port of the first PLC")
+    parser.add_argument("--bits", type=int, default=88, help="coils and discrete inputs per PLC")
+    parser.add_argument("--registers", type=int, default=11, help="input, holding and memory registers per PLC")
+    parser.add_argument("--latency", type=float, default=0.0, help="response delay in seconds")
+    parser.add_argument("--change", type=float, default=0.1,
+                        help="fraction of the values changed at every update")
+    parser.add_argument("--update", type=float, default=0.1, help="update period of the values in seconds")
+    parser.add_argument("--seed", type=int, default=None, help="random seed of the value changes")
+
+
+def fleet_options(args):
+    return dict(bits=args.bits, registers=args.registers, latency=args.latency, change_rate=args.change,
+                update_period=args.update, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated Modbus TCP PLCs on localhost")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    simulators, plc_list = start_fleet(args.count, args.port, **fleet_options(args))
+    print("PLCs:", ' '.join(f'{name}:{ip}:{port}' for name, ip, port in plc_list))
+    print("Press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for simulator in simulators:
+            simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import modbus_tk.defines as cst
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the histogram buckets: 0.1 ms .. 10 s, 10 buckets per decade
+BUCKETS = [round(10 ** (e / 10), 6) for e in range(-40, 11)]
+
+FUNCTION_NAMES = {
+    cst.READ_COILS: 'read_coils',
+    cst.READ_DISCRETE_INPUTS: 'read_discrete_inputs',
+    cst.READ_HOLDING_REGISTERS: 'read_holding_registers',
+    cst.READ_INPUT_REGISTERS: 'read_input_registers',
+}
+
+
+class Histogram:
+    """Log-bucketed histogram of durations (seconds)"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile"""
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        cumulative = 0
+        for bound, count in zip(BUCKETS + [self.max], self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.total / self.count if self.count else None, 'max': self.max,
+                'p50': self.percentile(50), 'p90': self.percentile(90), 'p99': self.percentile(99),
+                'buckets': self.counts}
+
+
+class PLCMetrics:
+    def __init__(self):
+        self.samples = 0
+        self.failed = 0
+        self.skipped_busy = 0
+        self.skipped_unhealthy = 0
+        self.missed_deadlines = 0
+        self.bytes_written = 0
+        self.poll_latency = Histogram()
+        self.start_jitter = Histogram()
+        self.interval_jitter = Histogram()
+        self.requests = dict()
+        self.request_errors = dict()
+        self.last_start = None
+
+    def to_dict(self):
+        return {'samples': self.samples, 'failed': self.failed, 'skipped_busy': self.skipped_busy,
+                'skipped_unhealthy': self.skipped_unhealthy, 'missed_deadlines': self.missed_deadlines,
+                'bytes_written': self.bytes_written,
+                'poll_latency': self.poll_latency.to_dict(),
+                'start_jitter': self.start_jitter.to_dict(),
+                'interval_jitter': self.interval_jitter.to_dict(),
+                'requests': {f: h.to_dict() for f, h in self.requests.items()},
+                'request_errors': dict(self.request_errors)}
+
+
+class PollMetrics:
+    """Timing of the historian, per PLC: Modbus request latency per function, poll latency,
+    start jitter (delay from the scheduled tick), inter-sample jitter (deviation of the
+    interval between two polls from the period), missed deadlines and bytes written.
+
+    A PLC is only polled by one thread at a time, so its counters are updated without
+    locks; only the creation of the per-PLC entries is serialized.
+    """
+
+    def __init__(self, period):
+        self.period = float(period)
+        self.started = time.time()
+        self.plcs = dict()
+        self.missed_ticks = 0
+        self.remote = dict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def plc(self, name):
+        name = str(name)
+        metrics = self.plcs.get(name)
+        if metrics is None:
+            with self._lock:
+                metrics = self.plcs.setdefault(name, PLCMetrics())
+        return metrics
+
+    def observe_request(self, name, function_code, seconds, failed=False):
+        metrics = self.plc(name)
+        function = FUNCTION_NAMES.get(function_code, str(function_code))
+        if failed:
+            metrics.request_errors[function] = metrics.request_errors.get(function, 0) + 1
+            return
+        if function not in metrics.requests:
+            metrics.requests[function] = Histogram()
+        metrics.requests[function].observe(seconds)
+
+    def observe_poll(self, name, tick, started, finished, failed=False):
+        """Timing of a poll, on the monotonic clock: scheduled tick, start and end of the poll"""
+        metrics = self.plc(name)
+        metrics.start_jitter.observe(max(started - tick, 0.0))
+        if metrics.last_start is not None:
+            metrics.interval_jitter.observe(abs(started - metrics.last_start - self.period))
+        metrics.last_start = started
+        if failed:
+            metrics.failed += 1
+            return
+        metrics.samples += 1
+        metrics.poll_latency.observe(finished - started)
+        if finished > tick + self.period:
+            metrics.missed_deadlines += 1
+
+    def skipped(self, name, reason):
+        metrics = self.plc(name)
+        if reason == 'busy':
+            # The previous poll is still running: this sample is lost
+            metrics.skipped_busy += 1
+            metrics.missed_deadlines += 1
+        else:
+            metrics.skipped_unhealthy += 1
+
+    def add_bytes(self, name, nbytes):
+        self.plc(name).bytes_written += nbytes
+
+    def merge(self, source, snapshot):
+        """Keep the latest snapshot of another process (e.g. a polling shard)"""
+        self.remote[source] = snapshot
+
+    def snapshot(self):
+        plcs = {name: metrics.to_dict() for name, metrics in list(self.plcs.items())}
+        missed_ticks = self.missed_ticks
+        for remote in list(self.remote.values()):
+            missed_ticks += remote['missed_ticks']
+            for name, stats in remote['plcs'].items():
+                local_bytes = plcs.get(name, {}).get('bytes_written', 0)
+                plcs[name] = dict(stats, bytes_written=stats['bytes_written'] + local_bytes)
+
+        return {'time': datetime.now().isoformat(), 'uptime': time.time() - self.started, 'period': self.period,
+                'missed_ticks': missed_ticks, 'bucket_bounds': BUCKETS, 'plcs': plcs}
+
+    def export(self, path):
+        """Write the snapshot as JSON (atomically, readers never see a partial file)"""
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp, path)
+
+    def start_export(self, path, interval):
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.export(path)
+                except OSError as e:
+                    logger.error("Cannot export the metrics to %s: %s", path, e)
+
+        self._thread = threading.Thread(target=loop, name='metrics-export', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop_export(self, path=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if path:
+            self.export(path)
+
+    def summary(self):
+        snapshot = self.snapshot()
+
+        def ms(value):
+            return f'{value * 1000:8.1f}' if value is not None else f'{"-":>8}'
+
+        lines = [f'Historian summary: {snapshot["uptime"]:.0f} s, period {self.period} s, '
+                 f'{snapshot["missed_ticks"]} missed ticks',
+                 f'{"PLC":>6} {"samples":>8} {"failed":>7} {"missed":>7} {"poll p50":>8} {"poll p99":>8} '
+                 f'{"jit p99":>8} {"MB":>8}']
+        total_samples = total_bytes = 0
+        for name in sorted(snapshot['plcs']):
+            stats = snapshot['plcs'][name]
+            total_samples += stats['samples']
+            total_bytes += stats['bytes_written']
+            lines.append(f'{name:>6} {stats["samples"]:>8} {stats["failed"]:>7} {stats["missed_deadlines"]:>7} '
+                         f'{ms(stats["poll_latency"]["p50"])} {ms(stats["poll_latency"]["p99"])} '
+                         f'{ms(stats["interval_jitter"]["p99"])} {stats["bytes_written"] / 2**20:8.2f}')
+        lines.append(f'Total: {total_samples} samples ({total_samples / max(snapshot["uptime"], 1e-9):.1f}/s), '
+                     f'{total_bytes / 2**20:.2f} MB written (latencies in ms)')
+        return '\n'.join(lines)
@@ -1,8 +1,17 @@
+import argparse
 import json
+import numpy as np
 import pandas as pd
 import glob
 import os
+import shutil
 import sys
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dataset_store import column_name, dataset_path, dtypes_path, read_dtypes, write_dataset, write_dtypes
+from register_map import RegisterMap
+from segment_store import SegmentReader, TIMESTAMP
 
 
 path_csv ='PLC_CSV/'
@@ -41,42 +50,213 @@ def flatten_json(nested_json: dict, exclude: list=[''], sep: str='_') -> dict:
     flatten(nested_json)
     return out
 
-def convert(plc) :
-    # list of json files
-    files = sorted(glob.glob('../historian/plc'+str(plc)+'*.json'))
+def convert_segments(plc):
+    # Captures stored as binary segments: the reader already returns the whole time series
+    df = SegmentReader('../historian').to_dataframe(plc)
+    timestamp = df.pop(TIMESTAMP).dt.strftime('%Y-%m-%d %H:%M:%S.%f')
 
+    # Same column names of the flattened json files, e.g. Coils/%QX0.0 -> PLC1_Coils_QX00
+    df.columns = [column_name(plc, c) for c in df.columns]
+    if(plc == 1):
+        df.insert(0,'TimeStamp', timestamp)
+    return df
 
-    # list to add dataframe from each file
-    df_list = list()
+def json_leaves(nested_json: dict, exclude: list=['']) -> tuple:
+    """
+    Values of a nested dict in the order of flatten_json, with its structure (keys and
+    end of dict markers) to check that two files have the same columns without building them.
+    """
+    keys = list()
+    values = list()
+    def walk(x):
+        if type(x) is dict:
+            for a in x:
+                if a not in exclude:
+                    keys.append(a)
+                    walk(x[a])
+            keys.append(None)
+        elif type(x) is list:
+            keys.append(len(x))
+            for a in x:
+                walk(a)
+        else:
+            values.append(x)
 
-    #list to save timestamps values
-    timestamp = list()
+    walk(nested_json)
+    return keys, values
 
-    # iterate through json files
-    for file in files:
-        with open(file, 'r', encoding='utf-8') as f:
+def json_key(key, plc):
+    # Column name part, e.g. %IW0 -> IW0 and the ip 127.0.0.1 -> PLC1
+    return key.replace('%','').replace('.','').replace('127001','PLC'+str(plc))
 
-            # read with json
-            data = json.loads(f.read().replace('%','').replace('.','').replace('127001','PLC'+str(plc)))
-            print(file)
-            print(os.path.basename(file)[20:43])
-            #save timestamps values
-            timestamp.append(os.path.basename(file)[20:43])
-            # flatten_json into a dataframe and add to the dataframe list
-            df_list.append(pd.DataFrame.from_dict(flatten_json(data), orient='index').T)
+def read_json(file, plc):
+    with open(file, 'r', encoding='utf-8') as f:
+        # read with json: only the keys are cleaned, the values (e.g. 12.5 of the float32 registers) are kept
+        data = json.load(f, object_pairs_hook=lambda pairs: {json_key(k, plc): v for k, v in pairs})
+    # timestamp from the file name and nested registers
+    return os.path.basename(file)[20:43], data
 
+def infer_schema(plc, file):
+    # Column names are built once, from the first file: the other files are filled by position
+    _, data = read_json(file, plc)
+    keys, values = json_leaves(data)
+    names = list(flatten_json(data))
+    if len(names) != len(values):
+        # Keys that flatten to the same name: positions cannot be used
+        return None
+    # Column types from the register map of the PLC (text for the columns it does not list)
+    types = {column_name(plc, c): np.dtype(dtype) for c, dtype in RegisterMap.for_plc('../register_maps', plc).schema()}
+    return keys, names, [types.get(name, np.dtype(object)) for name in names]
 
-            
-    # concat all dataframes together
-    df = pd.concat(df_list).reset_index(drop=True)
+def convert_chunk_by_name(plc, files):
+    timestamp = list()
+    rows = list()
+    for file in files:
+        ts, data = read_json(file, plc)
+        timestamp.append(ts)
+        rows.append(flatten_json(data))
+    return timestamp, pd.DataFrame(rows)
+
+def convert_chunk(plc, files, schema=None):
+    # A chunk of json files becomes a single dataframe (run in the worker processes)
+    df = None
+    if schema is not None:
+        keys, names, dtypes = schema
+        timestamp = list()
+        # preallocated typed tables, one per register type, filled row by row with the values of each file
+        groups = dict()
+        for j, dtype in enumerate(dtypes):
+            groups.setdefault(dtype, list()).append(j)
+        groups = [(np.array(columns), np.empty((len(files), len(columns)), dtype=dtype))
+                  for dtype, columns in groups.items()]
+        for i, file in enumerate(files):
+            ts, data = read_json(file, plc)
+            file_keys, file_values = json_leaves(data)
+            if file_keys != keys:
+                # The registers of this chunk differ from the first file
+                break
+            file_values = np.array(file_values)
+            try:
+                for columns, table in groups:
+                    # bools are written as 0/1
+                    table[i] = file_values[columns].astype(np.uint8 if table.dtype == bool else table.dtype)
+            except ValueError:
+                # A value that does not fit the type of its register
+                break
+            timestamp.append(ts)
+        else:
+            df = pd.DataFrame({names[j]: table[:, k] for columns, table in groups for k, j in enumerate(columns)},
+                              columns=names)
+
+    if df is None:
+        timestamp, df = convert_chunk_by_name(plc, files)
 
     if(plc == 1):
         # insert timestamps in the first column
-        df.insert(0,'TimeStamp', timestamp) 
+        df.insert(0,'TimeStamp', timestamp)
+    return df
+
+def manifest_path(plc):
+    return 'PLC_CSV/PLC'+str(plc)+'Dataset.manifest'
+
+def pending_files(plc, full=False):
+    # Json files not converted yet: the manifest lists the files already in the csv dataset, in order
+    files = sorted(glob.glob('../historian/plc'+str(plc)+'*.json'))
+    converted = list()
+    if not full and os.path.exists(manifest_path(plc)) and os.path.exists('PLC_CSV/PLC'+str(plc)+'Dataset.csv'):
+        with open(manifest_path(plc)) as f:
+            converted = f.read().splitlines()
+    names = [os.path.basename(file) for file in files[:len(converted)]]
+    if names != converted:
+        # Files removed or older samples added: the dataset is rebuilt
+        converted = list()
+    return files[len(converted):], len(converted) > 0
 
-         
+def save_json_dataset(plc, df_list, files, append):
+    csv_file = 'PLC_CSV/PLC'+str(plc)+'Dataset.csv'
+    # concat all dataframes together
+    df = pd.concat(df_list).reset_index(drop=True)
     print(df)
-    df.to_csv(r'PLC_CSV/PLC'+str(plc)+'Dataset.csv', index = False)
-for x in range(1,int(sys.argv[1])+1):         
-    convert(x)
+    # bools as 0/1, like the csv datasets of the historian
+    df = df.astype({c: np.uint8 for c, dtype in df.dtypes.items() if dtype == bool})
+
+    # json values are plain text: the types come from the register map of the PLC
+    schema = {column_name(plc, c): dtype for c, dtype in RegisterMap.for_plc('../register_maps', plc).schema()}
+    # columns with missing values (registers added after the first samples) are left out of the types:
+    # an integer or bool column cannot hold them
+    missing = set(df.columns[df.isna().any()])
+
+    if append:
+        header = pd.read_csv(csv_file, nrows=0).columns
+        if list(header) == list(df.columns):
+            df.to_csv(csv_file, mode='a', header=False, index=False)
+            # the columns left out of the types before still have missing values in the older rows
+            if os.path.exists(dtypes_path(csv_file)):
+                previous = read_dtypes(csv_file)
+                missing.update(c for c in header if c in schema and c not in previous)
+        else:
+            # New registers in the new samples: rewrite the dataset with all the columns
+            old = pd.read_csv(csv_file, dtype=str, keep_default_na=False)
+            df = pd.concat([old, df]).reset_index(drop=True)
+            df.to_csv(csv_file, index=False)
+            missing = set(df.columns[(df.isna() | (df == '')).any()])
+    else:
+        df.to_csv(csv_file, index=False)
+
+    with open(manifest_path(plc), 'a' if append else 'w') as f:
+        f.writelines(os.path.basename(file) + '\n' for file in files)
+
+    columns = set(pd.read_csv(csv_file, nrows=0).columns)
+    dtypes = {c: dtype for c, dtype in schema.items() if c in columns and c not in missing}
+    if dtypes or os.path.exists(dtypes_path(csv_file)):
+        write_dtypes(csv_file, dtypes)
+
+def convert(plc, executor=None, chunk=1000, full=False):
+    # Captures stored with storage = csv are already flattened: nothing to convert
+    captured = dataset_path('../historian', plc)
+    if os.path.exists(captured):
+        shutil.copy(captured, 'PLC_CSV/PLC'+str(plc)+'Dataset.csv')
+        if os.path.exists(dtypes_path(captured)):
+            shutil.copy(dtypes_path(captured), dtypes_path('PLC_CSV/PLC'+str(plc)+'Dataset.csv'))
+        return None
+
+    if SegmentReader('../historian').segments(plc):
+        df = convert_segments(plc)
+        print(df)
+        # the segments are typed: the schema is saved next to the dataset
+        write_dataset(df, r'PLC_CSV/PLC'+str(plc)+'Dataset.csv')
+        return None
+
+    # json files: only the ones added since the last run, converted by chunks in the process pool
+    files, append = pending_files(plc, full)
+    if not files:
+        print('PLC'+str(plc)+': no new json files')
+        return None
+    print('PLC'+str(plc)+': converting '+str(len(files))+' json files')
+    schema = infer_schema(plc, files[0])
+    chunks = [files[i:i+chunk] for i in range(0, len(files), chunk)]
+    if executor is None:
+        save_json_dataset(plc, [convert_chunk(plc, c, schema) for c in chunks], files, append)
+        return None
+    # the dataset is saved by the caller when the chunks are done
+    return plc, [executor.submit(convert_chunk, plc, c, schema) for c in chunks], files, append
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("plcs", type=int, help="number of PLCs (PLC1 .. PLCn)")
+    parser.add_argument('-w', "--workers", type=int, default=os.cpu_count(), help="conversion processes")
+    parser.add_argument('-c', "--chunk", type=int, default=1000, help="json files converted by a single task")
+    parser.add_argument('-f', "--full", action='store_true',
+                        help="convert all the json files again instead of the new ones only")
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        # the chunks of all the PLCs are queued first, so the pool works on several PLCs at once
+        jobs = [convert(x, executor, args.chunk, args.full) for x in range(1,args.plcs+1)]
+        for job in jobs:
+            if job is not None:
+                plc, futures, files, append = job
+                save_json_dataset(plc, [future.result() for future in futures], files, append)
 
+if __name__ == '__main__':
+    main()
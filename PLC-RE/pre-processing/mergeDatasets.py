@@ -5,14 +5,157 @@ import numpy as np
 import os
 import sys
 import pandas as pd
-import glob
 import csv
 import argparse
 import configparser
+import hashlib
 import math
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 from statsmodels.tsa.seasonal import seasonal_decompose, STL
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from column_profile import current_profile, profile_frame, read_profile, write_profile
+from dataset_store import (TIMESTAMP_FORMAT, dataset_files, parse_timestamps, read_dataset, timestamp_format,
+                           write_dataset)
+from enrichment_cache import EnrichmentCache
+from timestamp_join import TimestampJoin
+
+# Righe minime di un chunk di merge_chunked(), in finestre dei trend (trend_window periodi): ogni fit comprende anche
+# le due finestre di contesto prima e dopo il raccordo, che con chunk più corti costerebbero più delle righe nuove
+CHUNK_TREND_WINDOWS = 3
+
+
+def stl_trend(values, period):
+    """Trend of a robust STL decomposition of a column"""
+    stl = STL(values, period=period, robust=True)
+    decomposition = stl.fit()
+    return np.asarray(decomposition.trend, dtype=np.float64)
+
+
+def shared_stl_trend(shm_name, shape, row, start, period):
+    """stl_trend() of a row, from column `start`, of the (columns x rows) float64 array in the shared memory
+    block `shm_name`"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        values = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)[row, start:].copy()
+    finally:
+        shm.close()
+    return stl_trend(values, period)
+
+
+def trends_path(directory, path):
+    """Decomposition state of a csv dataset in `directory`: /a/b/PLC1Dataset.csv -> PLC1Dataset-<digest>.trends.npz,
+    where the digest of the dataset path tells apart the datasets with the same name in different directories"""
+    digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:12]
+    return os.path.join(directory, f'{os.path.splitext(os.path.basename(path))[0]}-{digest}.trends.npz')
+
+
+def values_digest(values):
+    return hashlib.sha1(np.ascontiguousarray(values, dtype=np.float64).tobytes()).hexdigest()
+
+
+def read_trends(directory, path, period):
+    """{column: (digest of the fitted values, trend)} saved by the last incremental run, empty if there is none
+    or if it was fitted with another period"""
+    if not os.path.exists(trends_path(directory, path)):
+        return {}
+    with np.load(trends_path(directory, path)) as state:
+        if int(state['period']) != period:
+            return {}
+        return {key[:-len('.trend')]: (str(state[key[:-len('.trend')] + '.digest']), state[key])
+                for key in state.files if key.endswith('.trend')}
+
+
+def write_trends(directory, path, period, trends):
+    """Save the {column: (digest, trend)} decomposition state of a dataset (atomically)"""
+    arrays = {'period': np.array(period)}
+    for col, (digest, trend) in trends.items():
+        arrays[col + '.digest'] = np.array(digest)
+        arrays[col + '.trend'] = trend
+    os.makedirs(directory, exist_ok=True)
+    tmp = trends_path(directory, path) + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, trends_path(directory, path))
+
+
+def stitch_trend(old, trend, start, at, period, tolerance):
+    """Saved trend `old` of the first rows, followed by the trend fitted on the rows from `start` on
+
+    The two trends are crossfaded over the period from row `at`, at least a trend window away from
+    the edges of both fits (STL trends bend near the edges of the fitted rows). Returns None if they
+    differ there by more than `tolerance`, i.e. the fits do not agree on the shared rows.
+    """
+    s, e = at, at + period
+    if np.max(np.abs(old[s:e] - trend[s - start:e - start])) > tolerance:
+        return None
+    weights = np.linspace(0, 1, period)
+    return np.concatenate([old[:s], (1 - weights) * old[s:e] + weights * trend[s - start:e - start],
+                           trend[e - start:]])
+
+
+def trend_slopes(trend, granularity, last=None):
+    """slope_ column of a trend: sign (-1, 0, 1) of the slope of each block of `granularity` rows, from the first row
+    of the block to the first of the next one. The rows of the blocks ending after row `last` (default: the last
+    row of `trend`) are NaN"""
+    n = len(trend)
+    last = n - 1 if last is None else min(last, n - 1)
+    starts = np.arange(0, n, granularity)
+    starts = starts[starts + granularity <= last]
+
+    slope = (trend[starts + granularity] - trend[starts]) / granularity
+    # round(slope, 2) > 0 <=> slope >= 0.005 (0.005 as a double is just above 5e-3, so it rounds up)
+    sign = np.where(slope >= 0.005, 1.0, np.where(slope <= -0.005, -1.0, 0.0))
+
+    mean_slope = np.full(n, np.nan)
+    mean_slope[:len(starts) * granularity] = np.repeat(sign, granularity)
+    return mean_slope
+
+
+def prev_column(values, first):
+    """prev_ column: `values` shifted by a row, starting with `first` (the value of the row before)"""
+    return np.concatenate([np.array([first], dtype=values.dtype), values[:-1]])[:len(values)]
+
+
+class DatasetStream:
+    """A PLC dataset merged by chunks (MergeDatasets.merge_chunked())
+
+    The rows read and not enriched yet (tail) are kept with their trend, and the trend columns of the
+    last enriched rows (head), as the context of the next chunk; the enriched rows wait in `mining`
+    and `daikon` until the rows of all the PLCs can be written together.
+    """
+
+    def __init__(self, file, profile):
+        self.file = file
+        self.rows = profile['rows']
+        self.profile = profile
+        self.chunks = None
+        # Righe già arricchite, riga del dataset della prima riga di tail
+        self.offset = 0
+        self.tail = None
+        self.tail_trends = dict()
+        # Valori delle colonne dei trend (colonne x righe) delle ultime righe arricchite, prima di tail
+        self.head = None
+        self.prevs = dict()
+        self.mining = list()
+        self.daikon = list()
+        self.done = False
+        # Con meno righe degli altri PLC
+        self.padded = False
+
+    def pending(self):
+        return sum(len(df) for df in self.mining)
+
+    def take(self, rows):
+        """The first `rows` enriched rows (mining, daikon), padded with NaN after the end of the dataset"""
+        mining = pd.concat(self.mining).reset_index(drop=True)
+        daikon = pd.concat(self.daikon).reset_index(drop=True)
+        self.mining = [mining.iloc[rows:]]
+        self.daikon = [daikon.iloc[rows:]]
+        return mining.iloc[:rows].reindex(range(rows)), daikon.iloc[:rows].reindex(range(rows))
+
 
 class MergeDatasets:
 
@@ -36,163 +179,319 @@ class MergeDatasets:
         parser.add_argument('-o', "--output", type=str, default=self.config['PREPROC']['dataset_file'],
                             help="output file")
         parser.add_argument('-p', "--plcs", nargs='+', default=[], help="PLCs to include (w/o path)")
+        parser.add_argument('-w', "--workers", type=int, default=os.cpu_count(),
+                            help="processes fitting the trends (1 fits them in this process)")
+        parser.add_argument('-c', "--chunksize", type=int, default=0,
+                            help="merge the datasets by chunks of rows, with bounded memory (0 reads them whole); "
+                                 "with trend columns at least 3 trend windows (3 * trend_window * trend_period "
+                                 "rows, rounded up otherwise), whose trends match the trends of a whole merge "
+                                 "within trend_tolerance")
+        parser.add_argument('-i', "--incremental", action='store_true',
+                            help="reuse the trends of the last run (saved in cache_dir, or next to the output without "
+                                 "it) and fit again the last "
+                                 "2 * trend_window + 1 periods only, when rows were appended to a dataset")
+        parser.add_argument('-j', "--join", choices=['position', 'timestamp'],
+                            default=self.config['DATASET'].get('join', 'position'),
+                            help="align the rows of the PLCs by position or by timestamp (as-of join with "
+                                 "join_tolerance and join_fill)")
+        parser.add_argument('--no-cache', action='store_true',
+                            help="fit all the trends again instead of reading the unchanged ones from the cache")
         self.args = parser.parse_args()
 
         self.granularity = self.args.granularity
         self.nrows = self.args.nrows
         # La read_csv() vuole un array con tutte le righe da skippare
-        self.skiprows = [row for row in range(1, self.args.skiprows)]
+        self.skiprows = range(1, self.args.skiprows)
         self.timerange = self.args.timerange
         self.directory = self.args.directory
         self.output_file = self.args.output
         self.plcs = self.args.plcs
+        self.workers = self.args.workers
+        self.incremental = self.args.incremental
+        self.chunksize = self.args.chunksize
+        self.join = self.args.join
+        self.cache = None
+        # Stato dei trend di --incremental: dati derivati, mai nella directory dei dataset
+        self.trends_dir = os.path.dirname(os.path.abspath(self.output_file))
+        if self.config['PREPROC'].get('cache_dir'):
+            cache_dir = os.path.join(self.config['PATHS']['project_dir'], self.config['PREPROC']['preproc_dir'],
+                                     self.config['PREPROC']['cache_dir'])
+            self.trends_dir = os.path.join(cache_dir, 'trends')
+            if not self.args.no_cache:
+                self.cache = EnrichmentCache(cache_dir, self.config['PREPROC'].getint('cache_size') * 2 ** 20)
 
     def list_files(self):
         if self.plcs:
             filenames = [f'{self.directory}/{p}' for p in self.plcs]
         else:
-            filenames = glob.glob(f'{self.directory}/*.csv')
+            filenames = dataset_files(self.directory)
 
         return sorted(filenames)
 
     @staticmethod
     def clean_null(filename):
         print(f'Cleaning null columns from {filename.split("/")[-1]} ...')
-        with open(filename, newline='') as f_input:
-            csv_input = csv.reader(f_input)
-            header = next(csv_input)  # read header
-            columns = zip(*list(csv_input))  # read rows and transpose to columns
-            data = [(h, c) for h, c in zip(header, columns) if set(c) != set('0')]
+        # Le colonne sempre a zero vengono dal profilo del dataset: il csv viene riscritto solo se ce ne sono
+        profile = read_profile(filename)
+        null = {col for col, stats in profile.items() if stats['nonzero'] == 0}
+        if not null:
+            return
 
-        with open(filename, 'w', newline='') as f_output:
+        with open(filename, newline='') as f_input, open(filename + '.tmp', 'w', newline='') as f_output:
+            csv_input = csv.reader(f_input)
             csv_output = csv.writer(f_output)
-            csv_output.writerow(h for h, c in data)  # write the new header
-            csv_output.writerows(zip(*[c for h, c in data]))
-
-    def __add_setpoints(self, data_set, cols):
+            header = next(csv_input)  # read header
+            keep = [i for i, h in enumerate(header) if h not in null]
+            csv_output.writerow(header[i] for i in keep)  # write the new header
+            rows = 0
+            for row in csv_input:
+                csv_output.writerow([row[i] for i in keep])
+                rows += 1
+        os.replace(filename + '.tmp', filename)
+        # Le statistiche delle altre colonne non cambiano
+        write_profile(filename, {'rows': rows, 'columns': {col: stats for col, stats in profile.items()
+                                                           if col not in null}})
+
+    def __add_setpoints(self, data_set, cols, columns):
         for col in cols:
             data_var = data_set[col]
 
             # Valore massimo della colonna selezionata
-            max_lvl = math.ceil(data_set[col].max())
+            max_lvl = math.ceil(data_var.max())
             # Valore minimo della colonna selezionata
-            min_lvl = math.floor(data_set[col].min())
+            min_lvl = math.floor(data_var.min())
             # Valore medio della colonna selezionata (secondo me non serve...)
             # avg_lvl = round(data_set[col].mean())
 
-            max_val = [max_lvl for _ in range(len(data_var))]
-            min_val = [min_lvl for _ in range(len(data_var))]
-
-            data_set.insert(len(data_set.columns), self.config['DATASET']['max_prefix'] + col, max_val)
-            data_set.insert(len(data_set.columns), self.config['DATASET']['min_prefix'] + col, min_val)
+            columns[self.config['DATASET']['max_prefix'] + col] = np.full(len(data_var), max_lvl)
+            columns[self.config['DATASET']['min_prefix'] + col] = np.full(len(data_var), min_lvl)
 
-        return data_set
+        return columns
 
-    def __add_trends(self, data_set, cols):
+    def __add_trends(self, data_set, cols, columns, trends=None):
         for col in cols:
             # decomposition = seasonal_decompose(np.array(data_set[col]), model='additive',
             # period=int(self.config['DATASET']['trend_period']))
-            stl = STL(data_set[col], period=int(self.config['DATASET']['trend_period']), robust=True)
-            decomposition = stl.fit()
-            col_trend = [x for x in decomposition.trend]
+            if trends is not None:
+                # Trend già calcolato da fit_trends()
+                trend = trends[col]
+            else:
+                trend = stl_trend(data_set[col], int(self.config['DATASET']['trend_period']))
+
+            columns[self.config['DATASET']['trend_cols_prefix'] + col] = trend
+
+        return columns
+
+    def __matching_cols(self, dataset, cols_list):
+        return dataset.columns[dataset.columns.str.contains(pat=self.config['DATASET'][cols_list], case=False,
+                                                            regex=True)]
+
+    def __fit(self, values, tasks, period):
+        """STL trends of the tasks (dataset, row, first row fitted) on the (columns x rows) arrays `values`
+
+        A trend is read from the enrichment cache if the same values were fitted with the same period by
+        a previous run; the others are fitted (__fit_tasks()) and added to the cache.
+        """
+        if self.cache is None:
+            return self.__fit_tasks(values, tasks, period)
+
+        keys = [self.cache.key('trend', values[d][row, start:], period=period) for d, row, start in tasks]
+        trends = [self.cache.get(key) for key in keys]
+        missing = [i for i, trend in enumerate(trends) if trend is None]
+        for i, trend in zip(missing, self.__fit_tasks(values, [tasks[i] for i in missing], period)):
+            trends[i] = trend
+            self.cache.put(keys[i], trend)
+        if missing:
+            self.cache.evict()
+        return trends
+
+    def __fit_tasks(self, values, tasks, period):
+        """STL trends of the tasks, fitted by the process pool
+
+        With more than a worker the arrays of the datasets are copied once in shared memory blocks,
+        and every task is fitted by the process pool, so the workers share the columns of all the PLCs.
+        """
+        if self.workers <= 1 or len(tasks) <= 1:
+            return [stl_trend(values[d][row, start:], period) for d, row, start in tasks]
+
+        shared = dict()
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = list()
+                for d, row, start in tasks:
+                    if d not in shared:
+                        shared[d] = shared_memory.SharedMemory(create=True, size=max(values[d].nbytes, 1))
+                        np.ndarray(values[d].shape, dtype=np.float64, buffer=shared[d].buf)[:] = values[d]
+                    futures.append(executor.submit(shared_stl_trend, shared[d].name, values[d].shape, row, start,
+                                                   period))
+
+                return [future.result() for future in futures]
+        finally:
+            for shm in shared.values():
+                shm.close()
+                shm.unlink()
+
+    def fit_trends(self, datasets, filenames):
+        """Fit the STL trends of the trend columns of all the datasets
+
+        In incremental mode the trends of the last run are read from the *.trends.npz file of each
+        dataset (trends_path(), in the trends directory of cache_dir, or next to the output without it):
+        an unchanged column keeps its trend, and a column with appended rows is fitted again from
+        2 * `trend_window` + 1 periods before the end of the saved trend, and stitched to it
+        (stitch_trend()) a trend window away from the edges of both fits. A column whose stitch is off
+        by more than `trend_tolerance` times the range of the column is fitted again in full.
+
+        Returns:
+            one {column: trend} dict per dataset, or None per dataset if there are no trend columns
+        """
+        if not self.config['DATASET']['trend_cols_list']:
+            return [None for _ in datasets]
+
+        period = int(self.config['DATASET']['trend_period'])
+        # Righe di contesto dei due fit intorno al raccordo, almeno 3 periodi (gli effetti di bordo di STL)
+        window = max(self.config['DATASET'].getint('trend_window'), 3) * period
+        tolerance = self.config['DATASET'].getfloat('trend_tolerance')
+
+        names = [list(self.__matching_cols(df, 'trend_cols_list')) for df in datasets]
+        values = [df[cols].to_numpy(np.float64).T for df, cols in zip(datasets, names)]
+        saved = [read_trends(self.trends_dir, file, period) if self.incremental else {} for file in filenames]
+        trends = [dict() for _ in datasets]
+
+        tasks = list()
+        for d, cols in enumerate(names):
+            for row, col in enumerate(cols):
+                start = 0
+                if col in saved[d]:
+                    digest, old = saved[d][col]
+                    # Il trend salvato vale solo se le righe di allora sono ancora le prime del dataset
+                    if len(old) <= values[d].shape[1] and values_digest(values[d][row, :len(old)]) == digest:
+                        if len(old) == values[d].shape[1]:
+                            trends[d][col] = old
+                            continue
+                        # Con meno di 2 finestre e un periodo il fit parziale è l'intero dataset
+                        start = max(len(old) - 2 * window - period, 0)
+                tasks.append((d, row, start))
+
+        full = list()
+        for (d, row, start), trend in zip(tasks, self.__fit(values, tasks, period)):
+            col = names[d][row]
+            if start:
+                trend = stitch_trend(saved[d][col][1], trend, start, start + window, period,
+                                     tolerance * (np.ptp(values[d][row]) or 1.0))
+                if trend is None:
+                    print(f'Trend of {col} does not match the saved one, fitting it again in full ...')
+                    full.append((d, row, 0))
+                    continue
+            trends[d][col] = trend
+        for (d, row, _), trend in zip(full, self.__fit(values, full, period)):
+            trends[d][names[d][row]] = trend
+        if self.cache is not None and self.cache.hits:
+            print(f'{self.cache.hits} trends read from the cache, {self.cache.misses} fitted')
+
+        if self.incremental:
+            for file, cols, df_values, df_trends in zip(filenames, names, values, trends):
+                write_trends(self.trends_dir, file, period,
+                             {col: (values_digest(df_values[row]), df_trends[col]) for row, col in enumerate(cols)})
+
+        return trends
+
+    def __add_slopes(self, data_set, cols, columns):
+        # Genero e aggiungo le colonne slope_
+        for col in cols:
+            trend_col = self.config['DATASET']['trend_cols_prefix'] + col
+            data_var = columns[trend_col] if trend_col in columns else data_set[trend_col].to_numpy(np.float64)
 
-            data_set.insert(len(data_set.columns), self.config['DATASET']['trend_cols_prefix'] + col, col_trend)
+            # Senza nemmeno un blocco di granularity righe nel dataset la colonna resta vuota
+            if len(data_var) - 1 < self.granularity:
+                columns[self.config['DATASET']['slope_cols_prefix'] + col] = np.full(len(data_var), None, dtype=object)
+            else:
+                columns[self.config['DATASET']['slope_cols_prefix'] + col] = trend_slopes(data_var, self.granularity)
 
-        return data_set
+        return columns
 
-    def __add_slopes(self, data_set, cols):
-        # Genero e aggiungo le colonne slope_
-        for col in cols:
-            data_var = data_set[self.config['DATASET']['trend_cols_prefix'] + col]
-            # data_var = data_set[col]
-
-            mean_slope = [None for _ in range(len(data_var))]
-
-            for i in range(len(data_var)):
-                if i % self.granularity == 0 and i + self.granularity <= len(data_var) - 1:
-                    for j in range(i, (i + self.granularity)):
-                        # mean_slope[j] = round((data_var[i + self.granularity] - data_var[i]) / self.granularity, 2)
-                        if round((data_var[i + self.granularity] - data_var[i]) / self.granularity, 2) > 0:
-                            # mean_slope[j] = math.ceil(round((data_var[i + self.granularity] - data_var[i]) / self.granularity, 2))
-                            mean_slope[j] = 1
-                        elif round((data_var[i + self.granularity] - data_var[i]) / self.granularity, 2) < 0:
-                            # mean_slope[j] = math.floor(round((data_var[i + self.granularity] - data_var[i]) / self.granularity, 2))
-                            mean_slope[j] = -1
-                        else:
-                            mean_slope[j] = 0
-
-            data_set.insert(len(data_set.columns), self.config['DATASET']['slope_cols_prefix'] + col, mean_slope)
-
-        return data_set
-
-    def __add_prevs(self, data_set, cols):
-        # Genero e aggiungo le colonne prev_
+    def __add_prevs(self, data_set, cols, columns):
+        # Genero e aggiungo le colonne prev_: la colonna spostata di una riga
         for col in cols:
-            prev_val = list()
-            prev_val.append(0)
             data_var = data_set[col]
+            # zero of the column type, so that a typed column (e.g. bool) keeps its type
+            columns[self.config['DATASET']['prev_cols_prefix'] + col] = prev_column(data_var.to_numpy(),
+                                                                                   data_var.dtype.type(0))
 
-            for i in range(len(data_var) - 1):
-                prev_val.append(data_var[i])
-
-            data_set.insert(len(data_set.columns), self.config['DATASET']['prev_cols_prefix'] + col, prev_val)
-
-        return data_set
+        return columns
 
     # Enrich the dataset with a partial bounded history of registers
     # Add previous values of registers
-    def enrich_df(self, dataset, filename):
+    def enrich_df(self, dataset, filename, trends=None):
         print(f'Enriching {filename.split("/")[-1]}. This may take a while ...')
 
-        data_set = None
         val_cols_max_min = None
         val_cols_trends = None
         val_cols_slopes = None
         val_cols_prevs = None
 
         if self.config['DATASET']['max_min_cols_list']:
-            val_cols_max_min = dataset.columns[
-                dataset.columns.str.contains(pat=self.config['DATASET']['max_min_cols_list'], case=False, regex=True)]
+            val_cols_max_min = self.__matching_cols(dataset, 'max_min_cols_list')
         if self.config['DATASET']['trend_cols_list']:
-            val_cols_trends = dataset.columns[
-                dataset.columns.str.contains(pat=self.config['DATASET']['trend_cols_list'], case=False, regex=True)]
+            val_cols_trends = self.__matching_cols(dataset, 'trend_cols_list')
         if self.config['DATASET']['slope_cols_list'] and self.config['DATASET']['trend_cols_list']:
-            val_cols_slopes = dataset.columns[
-                dataset.columns.str.contains(pat=self.config['DATASET']['slope_cols_list'], case=False, regex=True)]
+            val_cols_slopes = self.__matching_cols(dataset, 'slope_cols_list')
         if self.config['DATASET']['prev_cols_list']:
-            val_cols_prevs = dataset.columns[
-                dataset.columns.str.contains(pat=self.config['DATASET']['prev_cols_list'], case=False, regex=True)]
+            val_cols_prevs = self.__matching_cols(dataset, 'prev_cols_list')
 
+        # Le colonne dell'enrichment vengono calcolate sugli array interi e aggiunte al dataset con una sola concat
+        columns = dict()
         if self.config['DATASET']['max_min_cols_list']:
-            data_set = self.__add_setpoints(dataset, val_cols_max_min)
+            self.__add_setpoints(dataset, val_cols_max_min, columns)
         if self.config['DATASET']['trend_cols_list']:
-            if data_set is not None:
-                data_set = self.__add_trends(data_set, val_cols_trends)
-            else:
-                data_set = self.__add_trends(dataset, val_cols_trends)
+            self.__add_trends(dataset, val_cols_trends, columns, trends)
         if self.config['DATASET']['slope_cols_list'] and self.config['DATASET']['trend_cols_list']:
-            if data_set is not None:
-                data_set = self.__add_slopes(data_set, val_cols_slopes)
-            else:
-                data_set = self.__add_slopes(dataset, val_cols_slopes)
+            self.__add_slopes(dataset, val_cols_slopes, columns)
         if self.config['DATASET']['prev_cols_list']:
-            if data_set is not None:
-                data_set = self.__add_prevs(data_set, val_cols_prevs)
-            else:
-                data_set = self.__add_prevs(dataset, val_cols_prevs)
+            self.__add_prevs(dataset, val_cols_prevs, columns)
 
-        # Se i campi dell'enrichment sono tutti vuoti, anche data_set è vuoto. Quindi ritorno dataset, passato
-        # in ingresso
-        if data_set is not None:
-            return data_set
-        else:
+        # Se i campi dell'enrichment sono tutti vuoti, ritorno dataset, passato in ingresso
+        if not columns:
             return dataset
 
+        existing = [c for c in columns if c in dataset.columns]
+        if existing:
+            raise ValueError(f'cannot insert {existing[0]}, already exists')
+        return pd.concat([dataset, pd.DataFrame(columns, index=dataset.index)], axis=1)
+
+    def __read(self, file, **kwargs):
+        # Le colonne sempre a zero in tutto il dataset non vengono nemmeno lette, se il profilo delle colonne
+        # è già aggiornato (altrimenti calcolarlo leggerebbe tutto il dataset: le colonne a zero nelle righe
+        # selezionate vengono comunque tolte dopo)
+        profile = current_profile(file)
+        if profile is not None:
+            kwargs['usecols'] = lambda col: col not in profile or profile[col]['nonzero'] > 0
+        # Con timerange vengono lette solo le righe dell'intervallo (ricerca binaria sul file)
+        if self.timerange:
+            return read_dataset(file, timerange=self.timerange, timestamp_col=self.config['DATASET']['timestamp_col'],
+                                datetimes=True, **kwargs)
+        return read_dataset(file, skiprows=self.skiprows, nrows=self.nrows, datetimes=True, **kwargs)
+
+    def __prepare(self, df, file):
+        df.columns = df.columns.str.replace('.', '_', regex=False)
+
+        # I timestamp restano datetime64, e vengono scritti nel formato '%Y-%m-%d %H:%M:%S.%f'
+        # (letti con il formato del dataset, lo stesso della ricerca binaria di timerange)
+        if self.timerange or self.config['DATASET']['timestamp_col'] in df.columns:
+            df[self.config['DATASET']['timestamp_col']] = parse_timestamps(
+                df[self.config['DATASET']['timestamp_col']],
+                timestamp_format(file, self.config['DATASET']['timestamp_col']))
+        if self.timerange:
+            df = df.loc[df[self.config['DATASET']['timestamp_col']].between(pd.Timestamp(self.timerange[0]),
+                                                                            pd.Timestamp(self.timerange[1]),
+                                                                            inclusive="both")]
+        return df
+
     def get_datasets_lists(self):
         filenames = self.list_files()
 
         df_list_mining = list()
         df_list_daikon = list()
+        datasets = list()
 
         for file in sorted(filenames):
             # Read Dataset files
@@ -200,23 +499,7 @@ class MergeDatasets:
             # usare skiprows=<int>, che skippa n righe da inizio file
             print(f'Reading {file.split("/")[-1]} ...')
 
-            if self.timerange:
-                df = pd.read_csv(file)
-                df.columns = df.columns.str.replace('.', '_', regex=False)
-                df[self.config['DATASET']['timestamp_col']] = \
-                    df[self.config['DATASET']['timestamp_col']].apply(lambda x:
-                                                                      pd.Timestamp(x).strftime('%Y-%m-%d %H:%M:%S.%f'))
-                df = df.loc[df[self.config['DATASET']['timestamp_col']].between(self.timerange[0],
-                                                                                self.timerange[1],
-                                                                                inclusive="both")]
-            else:
-                df = pd.read_csv(file, skiprows=self.skiprows, nrows=self.nrows)
-                df.columns = df.columns.str.replace('.', '_', regex=False)
-
-                if self.config['DATASET']['timestamp_col'] in df.columns:
-                    df[self.config['DATASET']['timestamp_col']] = \
-                        df[self.config['DATASET']['timestamp_col']].apply(lambda x: pd.Timestamp(x).strftime(
-                            '%Y-%m-%d %H:%M:%S.%f'))
+            df = self.__prepare(self.__read(file), file)
 
             # I punti nei nomi delle colonne creano parecchi problemi, quindi vanno sostituiti
             # datasetPLC.columns = datasetPLC.columns.str.replace('.', '_', regex=False)
@@ -225,22 +508,38 @@ class MergeDatasets:
             # Removing empty registers (the registers with values equal to 0 are not used in the control of the CPS)
             # self.clean_null(df)
             df = df.loc[:, (df != 0).any(axis=0)]
+            datasets.append(df)
 
+        # I trend di tutti i PLC vengono calcolati insieme, in parallelo
+        trends = self.fit_trends(datasets, sorted(filenames))
+
+        for file, df, df_trends in zip(sorted(filenames), datasets, trends):
             datasetPLC_daikon = df.copy()  # Altrimenti non mi differenzia le liste, vai a capire perchè...
 
             # Concatenate the single PLCs datasets for process mining
             df_list_mining.append(df)
 
             # Add previous values, slopes and limits to dataframe
-            datasetPLC_daikon = self.enrich_df(datasetPLC_daikon, file)
+            datasetPLC_daikon = self.enrich_df(datasetPLC_daikon, file, df_trends)
             # Concatenate the single PLCs datasets for Daikon
             df_list_daikon.append(datasetPLC_daikon)
 
         return df_list_mining, df_list_daikon
 
-    @staticmethod
-    def __concat_datasets(datasets_list):
-        df = pd.concat(datasets_list, axis=1).reset_index(drop=True)
+    def __timestamp_join(self, inputs):
+        return TimestampJoin(inputs, self.config['DATASET']['timestamp_col'],
+                             self.config['DATASET'].getfloat('join_tolerance'), self.config['DATASET']['join_fill'])
+
+    def __concat_datasets(self, datasets_list):
+        if self.join == 'timestamp':
+            # Righe dei PLC allineate per timestamp invece che per posizione
+            join = self.__timestamp_join(len(datasets_list))
+            for i, df in enumerate(datasets_list):
+                join.push(i, df)
+                join.finish(i)
+            df = join.pop()
+        else:
+            df = pd.concat(datasets_list, axis=1).reset_index(drop=True)
         df = df.loc[:, ~df.columns.duplicated()]  # Drop dup columns in the dataframe by name (i.e. Timestamps)
 
         return df
@@ -250,9 +549,10 @@ class MergeDatasets:
         # mining_datasets = mining_datasets.T.drop_duplicates().T  # Drop dup columns in the dataframe (i.e. Timestamps)
 
         # Save dataset with the timestamp for the process mining.
-        mining_datasets.to_csv(
-            f'{os.path.join(self.config["PATHS"]["project_dir"], self.config["MINING"]["data_dir"], self.output_file.split(".")[0])}_TS.csv',
-            index=False)
+        mining_file = f'{os.path.join(self.config["PATHS"]["project_dir"], self.config["MINING"]["data_dir"], self.output_file.split(".")[0])}_TS.csv'
+        write_dataset(mining_datasets, mining_file, date_format=TIMESTAMP_FORMAT)
+        # Profilo delle colonne dalle righe in memoria, così i tool di analisi non rileggono il dataset
+        profile_frame(mining_file, mining_datasets, date_format=TIMESTAMP_FORMAT)
         # print(mining_datasets)  # Debug
 
     def save_daikon_dataset(self, datasets_list):
@@ -266,25 +566,265 @@ class MergeDatasets:
         # Taglio anche le ultime righe, che hanno lo slope = 0
         # daikon_datasets = daikon_datasets.iloc[::mg.granularity, :] # Prendo solo le n-granularities righe
         daikon_datasets = daikon_datasets.iloc[1:-self.granularity, :]
-        daikon_datasets.to_csv(
-            f'{os.path.join(self.config["PATHS"]["project_dir"], self.config["DAIKON"]["daikon_invariants_dir"], self.output_file)}',
-            index=False)
+        daikon_file = f'{os.path.join(self.config["PATHS"]["project_dir"], self.config["DAIKON"]["daikon_invariants_dir"], self.output_file)}'
+        write_dataset(daikon_datasets, daikon_file)
+        profile_frame(daikon_file, daikon_datasets)
         # print(daikon_datasets)  # Debug
 
+    def __read_chunks(self, file, chunksize):
+        """Rows of a dataset selected by skiprows/nrows or timerange, `chunksize` at a time (the last chunk is
+        shorter)"""
+        reader = self.__read(file, chunksize=chunksize)
+
+        chunks = list()
+        rows = 0
+        with reader as chunks_read:
+            for chunk in chunks_read:
+                chunks.append(self.__prepare(chunk, file))
+                rows += len(chunks[-1])
+                # Con timerange i chunk filtrati vengono riuniti fino a chunksize righe
+                if rows >= chunksize:
+                    yield pd.concat(chunks)
+                    chunks = list()
+                    rows = 0
+        if rows:
+            yield pd.concat(chunks)
+
+    def __profile(self, file, chunksize):
+        """First pass on a dataset: rows, columns not always zero, dtypes of the whole columns, max/min of the
+        setpoint columns and range of the trend columns"""
+        rows = 0
+        nonzero = None
+        schema = None
+        max_lvl = dict()
+        min_lvl = dict()
+        ranges = dict()
+        for chunk in self.__read_chunks(file, chunksize):
+            rows += len(chunk)
+            nonzero = (chunk != 0).any(axis=0) if nonzero is None else nonzero | (chunk != 0).any(axis=0)
+            # Tipo comune a tutti i chunk, come se il dataset fosse letto intero
+            schema = chunk.iloc[:0] if schema is None else pd.concat([schema, chunk.iloc[:0]])
+            if self.config['DATASET']['max_min_cols_list']:
+                for col in self.__matching_cols(chunk, 'max_min_cols_list'):
+                    max_lvl.setdefault(col, list()).append(chunk[col].max())
+                    min_lvl.setdefault(col, list()).append(chunk[col].min())
+            if self.config['DATASET']['trend_cols_list']:
+                for col in self.__matching_cols(chunk, 'trend_cols_list'):
+                    low, high = ranges.get(col, (np.inf, -np.inf))
+                    ranges[col] = (min(low, chunk[col].min()), max(high, chunk[col].max()))
+
+        if schema is None:
+            raise ValueError(f'{file}: no rows selected')
+        columns = list(nonzero.index[nonzero])
+        return {'rows': rows,
+                'columns': columns,
+                'dtypes': schema[columns].dtypes,
+                'max_lvl': {col: math.ceil(pd.Series(v).max()) for col, v in max_lvl.items() if col in columns},
+                'min_lvl': {col: math.floor(pd.Series(v).min()) for col, v in min_lvl.items() if col in columns},
+                'ranges': {col: float(high - low) or 1.0 for col, (low, high) in ranges.items() if col in columns}}
+
+    def __enrich_chunk(self, stream, block, trends, rows):
+        """First `rows` rows of a block of a dataset, enriched as enrich_df() enriches the whole dataset"""
+        columns = dict()
+        for col in stream.profile['max_lvl']:
+            columns[self.config['DATASET']['max_prefix'] + col] = np.full(rows, stream.profile['max_lvl'][col])
+            columns[self.config['DATASET']['min_prefix'] + col] = np.full(rows, stream.profile['min_lvl'][col])
+        for col in trends:
+            columns[self.config['DATASET']['trend_cols_prefix'] + col] = trends[col][:rows]
+        if self.config['DATASET']['slope_cols_list'] and self.config['DATASET']['trend_cols_list']:
+            for col in self.__matching_cols(block, 'slope_cols_list'):
+                if stream.rows - 1 < self.granularity:
+                    slope = np.full(rows, None, dtype=object)
+                else:
+                    # I blocchi sono allineati alla prima riga del dataset (offset è un multiplo di granularity)
+                    slope = trend_slopes(trends[col], self.granularity, stream.rows - 1 - stream.offset)[:rows]
+                columns[self.config['DATASET']['slope_cols_prefix'] + col] = slope
+        if self.config['DATASET']['prev_cols_list']:
+            for col in self.__matching_cols(block, 'prev_cols_list'):
+                values = block[col].to_numpy()
+                first = stream.prevs.get(col, block[col].dtype.type(0))
+                columns[self.config['DATASET']['prev_cols_prefix'] + col] = prev_column(values, first)[:rows]
+
+        enriched = block.iloc[:rows]
+        if columns:
+            enriched = pd.concat([enriched, pd.DataFrame(columns, index=enriched.index)], axis=1)
+        return enriched
+
+    def __stream_step(self, streams, window, period):
+        """Read a chunk of every dataset and enrich the rows whose features do not depend on the next chunks"""
+        tolerance = self.config['DATASET'].getfloat('trend_tolerance')
+        blocks = list()
+        for stream in streams:
+            chunk = next(stream.chunks, None) if not stream.done else None
+            if chunk is None:
+                blocks.append(None)
+                continue
+            chunk = chunk[stream.profile['columns']].astype(stream.profile['dtypes'])
+            blocks.append(chunk if stream.tail is None else pd.concat([stream.tail, chunk]))
+
+        # I trend dei blocchi di tutti i PLC vengono calcolati insieme
+        names = [list(self.__matching_cols(block, 'trend_cols_list'))
+                 if block is not None and self.config['DATASET']['trend_cols_list'] else [] for block in blocks]
+        # Ogni blocco viene fittato insieme alle ultime window righe già arricchite (head): il raccordo con il
+        # trend del tail, all'inizio del tail, ha così almeno window righe di contesto in entrambi i fit
+        values = list()
+        for stream, block, cols in zip(streams, blocks, names):
+            if block is None:
+                values.append(None)
+                continue
+            block_values = block[cols].to_numpy(np.float64).T
+            values.append(block_values if stream.head is None else np.concatenate([stream.head, block_values], axis=1))
+        tasks = [(d, row, 0) for d, cols in enumerate(names) for row in range(len(cols))]
+        fitted = iter(self.__fit(values, tasks, period))
+
+        for stream, block, cols, block_values in zip(streams, blocks, names, values):
+            if block is None:
+                continue
+            head = block_values.shape[1] - len(block)
+            trends = dict()
+            for col in cols:
+                trend = next(fitted)[head:]
+                if stream.tail is not None:
+                    stitched = stitch_trend(stream.tail_trends[col], trend, 0, 0, period,
+                                            tolerance * stream.profile['ranges'][col])
+                    if stitched is None:
+                        raise ValueError(f'{stream.file}: the trends of {col} fitted before and after row '
+                                         f'{stream.offset} differ by more than trend_tolerance, merge it with a '
+                                         f'larger trend_window or without --chunksize')
+                    trend = stitched
+                trends[col] = trend
+
+            # Le righe arricchite hanno almeno window righe dopo di sé (trend) e finiscono con un blocco di slope
+            if stream.offset + len(block) >= stream.rows:
+                rows = len(block)
+                stream.done = True
+            else:
+                rows = max(len(block) - window - 1, 0) // self.granularity * self.granularity
+
+            enriched = self.__enrich_chunk(stream, block, trends, rows)
+            mining = block.iloc[:rows]
+            if stream.padded:
+                # Un PLC con meno righe degli altri viene completato con NaN, come farebbe la concat
+                mining = mining.astype(mining.iloc[:0].reindex([0]).dtypes)
+                enriched = enriched.astype(enriched.iloc[:0].reindex([0]).dtypes)
+            stream.mining.append(mining)
+            stream.daikon.append(enriched)
+
+            if rows:
+                stream.prevs = {col: block[col].iloc[rows - 1] for col in block.columns}
+            stream.offset += rows
+            stream.tail = block.iloc[rows:]
+            stream.tail_trends = {col: trend[rows:] for col, trend in trends.items()}
+            stream.head = block_values[:, max(head + rows - window, 0):head + rows].copy()
+
+    def merge_chunked(self):
+        """Merge and enrich the datasets by chunks of rows, writing the two output datasets as the chunks are done
+
+        Only the rows of the current chunk, plus the context needed by the enrichment (the rows of
+        the last trend_window periods before and after the enriched ones), are in memory. The trends
+        are fitted on every chunk with its context and stitched to the trend of the previous one
+        (see stitch_trend()) a trend window away from the edges of both fits, where they match the
+        trends of the whole datasets: a stitch off by more than `trend_tolerance` times the range of
+        the column stops the merge with a ValueError. With --join
+        timestamp the enriched rows of the PLCs are joined as they are done, keeping only the rows that
+        can still be joined in memory.
+        """
+        period = int(self.config['DATASET']['trend_period'])
+        window = max(self.config['DATASET'].getint('trend_window'), 3) * period
+        chunksize = max(self.chunksize, window + self.granularity + 1)
+        if self.config['DATASET']['trend_cols_list'] and chunksize < CHUNK_TREND_WINDOWS * window:
+            chunksize = CHUNK_TREND_WINDOWS * window
+            print(f'Chunks of {self.chunksize} rows too short for the trends, merging by chunks of {chunksize} rows')
+
+        streams = list()
+        for file in self.list_files():
+            print(f'Profiling {file.split("/")[-1]} ...')
+            streams.append(DatasetStream(file, self.__profile(file, chunksize)))
+        total = max(stream.rows for stream in streams)
+        for stream in streams:
+            stream.chunks = self.__read_chunks(stream.file, chunksize)
+            # Allineati per posizione, un PLC con meno righe viene completato con NaN
+            stream.padded = self.join == 'position' and stream.rows < total
+
+        mining_file = f'{os.path.join(self.config["PATHS"]["project_dir"], self.config["MINING"]["data_dir"], self.output_file.split(".")[0])}_TS.csv'
+        daikon_file = f'{os.path.join(self.config["PATHS"]["project_dir"], self.config["DAIKON"]["daikon_invariants_dir"], self.output_file)}'
+        joins = None
+        if self.join == 'timestamp':
+            # Un join per dataset di output: con gli stessi timestamp uniscono le stesse righe
+            joins = [self.__timestamp_join(len(streams)) for _ in range(2)]
+        written = 0
+        daikon_written = False
+        # Le ultime granularity righe per Daikon vengono scritte solo se ne seguono altre
+        daikon_tail = None
+        done = False
+        while not done:
+            self.__stream_step(streams, window, period)
+            if joins is not None:
+                for i, stream in enumerate(streams):
+                    if stream.pending():
+                        for join, df in zip(joins, stream.take(stream.pending())):
+                            join.push(i, df)
+                    if stream.done:
+                        for join in joins:
+                            join.finish(i)
+                mining, daikon = [df.loc[:, ~df.columns.duplicated()] for df in (join.pop() for join in joins)]
+                rows = len(mining)
+                done = all(stream.done for stream in streams)
+            else:
+                if all(stream.done for stream in streams):
+                    rows = max(stream.pending() for stream in streams)
+                else:
+                    rows = min(stream.pending() for stream in streams if not stream.done)
+                if not rows:
+                    continue
+
+                parts = [stream.take(rows) for stream in streams]
+                mining = self.__concat_datasets([mining for mining, _ in parts])
+                daikon = self.__concat_datasets([daikon for _, daikon in parts])
+                done = written + rows >= total
+            if not rows:
+                continue
+
+            write_dataset(mining, mining_file, mode='w' if not written else 'a', header=not written,
+                          date_format=TIMESTAMP_FORMAT)
+            # Profilo delle colonne esteso con le righe scritte, così i tool di analisi non rileggono il dataset
+            profile_frame(mining_file, mining, append=bool(written), date_format=TIMESTAMP_FORMAT)
+
+            # drop timestamps is NOT needed in Daikon; prima riga e ultime granularity righe tagliate come in
+            # save_daikon_dataset()
+            daikon = daikon.drop(self.config['DATASET']['timestamp_col'], axis=1, errors='ignore')
+            if daikon_tail is not None:
+                daikon = pd.concat([daikon_tail, daikon])
+            daikon = daikon.iloc[max(1 - written, 0):]
+            cut = max(len(daikon) - self.granularity, 0)
+            daikon, daikon_tail = daikon.iloc[:cut], daikon.iloc[cut:]
+            if len(daikon):
+                write_dataset(daikon, daikon_file, mode='a' if daikon_written else 'w', header=not daikon_written)
+                profile_frame(daikon_file, daikon, append=daikon_written)
+                daikon_written = True
+
+            written += rows
+            print(f'{written} of {total} rows merged ...' if joins is None else f'{written} rows merged ...')
+
 
 def main():
     mg = MergeDatasets()
 
-    # CSV files converted from JSON PLCs readings (convertoCSV.py)
-    df_list_mining, df_list_daikon = mg.get_datasets_lists()
-
-    print(f'Generating Process Mining dataset ...')
-    mg.save_mining_dataset(df_list_mining)
-    print('Process Mining dataset generated successfully')
-
-    print(f'Generating Invariants Analysis dataset ...')
-    mg.save_daikon_dataset(df_list_daikon)
-    print('Invariants Analysis dataset generated successfully')
+    if mg.chunksize:
+        print('Generating Process Mining and Invariants Analysis datasets by chunks ...')
+        mg.merge_chunked()
+        print('Process Mining and Invariants Analysis datasets generated successfully')
+    else:
+        # CSV files converted from JSON PLCs readings (convertoCSV.py)
+        df_list_mining, df_list_daikon = mg.get_datasets_lists()
+
+        print(f'Generating Process Mining dataset ...')
+        mg.save_mining_dataset(df_list_mining)
+        print('Process Mining dataset generated successfully')
+
+        print(f'Generating Invariants Analysis dataset ...')
+        mg.save_daikon_dataset(df_list_daikon)
+        print('Invariants Analysis dataset generated successfully')
 
     print()
 
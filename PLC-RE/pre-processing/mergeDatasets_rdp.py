@@ -1,15 +1,102 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 import pandas as pd
 import numpy as np
-import glob
 import csv
 import argparse
 import configparser
 import subprocess
 import math
-from rdp import rdp
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from column_profile import profile_frame, read_profile, write_profile
+from dataset_store import (TIMESTAMP_FORMAT, dataset_files, parse_timestamps, read_dataset, timestamp_format,
+                           write_dataset)
+from timestamp_join import TimestampJoin
+
+
+def rdp_indices(values, epsilon):
+    """Indices of the points (row, value) kept by the Ramer-Douglas-Peucker simplification of a column
+
+    Iterative version of rdp.rdp(): the segments still to simplify are kept in a stack instead of
+    recursing, and the distances of the points of a segment from its chord are computed at once.
+    """
+    keep = np.zeros(len(values), dtype=bool)
+    if not len(values):
+        return np.flatnonzero(keep)
+    keep[[0, -1]] = True
+    stack = [(0, len(values) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        # Distanza dei punti interni dalla retta tra il primo e l'ultimo punto del segmento
+        dx = end - start
+        dy = values[end] - values[start]
+        x = np.arange(start + 1, end)
+        d = np.abs(dx * (values[start] - values[start + 1:end]) - dy * (start - x)) / np.sqrt(dx * dx + dy * dy)
+        i = int(np.argmax(d))
+        if d[i] > epsilon:
+            keep[start + 1 + i] = True
+            stack.append((start + 1 + i, end))
+            stack.append((start, start + 1 + i))
+    return np.flatnonzero(keep)
+
+
+def rdp_slopes(values, epsilon):
+    """Sign (-1, 0, 1) of the slope of the RDP segment of every row, the slopes truncated to 2 decimals
+
+    The last row takes the slope of the last segment.
+    """
+    kept = rdp_indices(values, epsilon)
+    if len(kept) < 2:
+        return np.zeros(len(values), dtype=np.int64)
+    slopes = np.diff(values[kept]) / np.diff(kept)
+    signs = np.sign(np.trunc(slopes * 100)).astype(np.int64)
+    return np.append(np.repeat(signs, np.diff(kept)), signs[-1])
+
+
+def _column_values(column):
+    """Values of a column compared by duplicate_columns(): numeric and bool columns as float64 (1 == 1.0 == True),
+    with a single NaN and zero, the other columns as they are"""
+    if pd.api.types.is_numeric_dtype(column.dtype) or pd.api.types.is_bool_dtype(column.dtype):
+        values = column.to_numpy(dtype=np.float64, na_value=np.nan) + 0.0
+        values[np.isnan(values)] = np.nan
+        return 'numeric', values
+    return str(column.dtype), column
+
+
+def duplicate_columns(df):
+    """Mask of the columns with the same values as a previous column, like df.T.duplicated() without transposing
+
+    Every column is hashed once (64 bit digest of its values) and only the columns with the same digest are
+    compared, so the cost is linear in the size of the dataframe and the dtypes are preserved.
+    """
+    duplicated = np.zeros(len(df.columns), dtype=bool)
+    if not len(df):
+        # Come df.T.drop_duplicates(), che senza righe tiene tutte le colonne
+        return duplicated
+    seen = dict()
+    for j in range(len(df.columns)):
+        kind, values = _column_values(df.iloc[:, j])
+        if kind == 'numeric':
+            digest = hashlib.blake2b(memoryview(values).cast('B'), digest_size=8).digest()
+        else:
+            digest = hashlib.blake2b(pd.util.hash_pandas_object(values, index=False).to_numpy().tobytes(),
+                                     digest_size=8).digest()
+        for other in seen.setdefault((kind, digest), []):
+            # Stesso digest: conferma confrontando i valori
+            if (np.array_equal(values, other, equal_nan=True) if kind == 'numeric'
+                    else values.reset_index(drop=True).equals(other.reset_index(drop=True))):
+                duplicated[j] = True
+                break
+        else:
+            seen[(kind, digest)].append(values)
+    return duplicated
 
 
 class MergeDatasets:
@@ -19,8 +106,8 @@ class MergeDatasets:
         self.config.read('../config.ini')
 
         parser = argparse.ArgumentParser()
-        parser.add_argument('-e', "--epsilon", type=int,
-                            help="choose granularity in seconds (for slopes)")
+        parser.add_argument('-e', "--epsilon", type=float, default=0.0,
+                            help="distance threshold of the Douglas-Peucker simplification (for slopes)")
         parser.add_argument('-s', "--skiprows", type=int, default=self.config['PREPROC']['skip_rows'],
                             help="skip seconds from start")
         parser.add_argument('-n', "--nrows", type=int, default=self.config['PREPROC']['number_of_rows'],
@@ -32,38 +119,56 @@ class MergeDatasets:
         parser.add_argument('-o', "--output", type=str, default=self.config['PREPROC']['dataset_file'],
                             help="output file")
         parser.add_argument('-p', "--plcs", nargs='+', default=[], help="PLCs to include (w/o path)")
+        parser.add_argument('-j', "--join", choices=['position', 'timestamp'],
+                            default=self.config['DATASET'].get('join', 'position'),
+                            help="align the rows of the PLCs by position or by timestamp (as-of join with "
+                                 "join_tolerance and join_fill)")
+        parser.add_argument('-w', "--workers", type=int, default=os.cpu_count(),
+                            help="processes computing the slopes (1 computes them in this process)")
         self.args = parser.parse_args()
 
         self.epsilon = self.args.epsilon
         self.nrows = self.args.nrows
         # La read_csv() vuole un array con tutte le righe da skippare
-        self.skiprows = [row for row in range(1, self.args.skiprows)]
+        self.skiprows = range(1, self.args.skiprows)
         self.timerange = self.args.timerange
         self.directory = self.args.directory
         self.output_file = self.args.output
         self.plcs = self.args.plcs
+        self.join = self.args.join
+        self.workers = self.args.workers
 
     def list_files(self):
         if self.plcs:
             filenames = [f'{self.directory}/{p}' for p in self.plcs]
         else:
-            filenames = glob.glob(f'{self.directory}/*.csv')
+            filenames = dataset_files(self.directory)
 
         return sorted(filenames)
 
     @staticmethod
     def clean_null(filename):
         print(f'Cleaning null columns from {filename.split("/")[-1]} ...')
-        with open(filename, newline='') as f_input:
-            csv_input = csv.reader(f_input)
-            header = next(csv_input)  # read header
-            columns = zip(*list(csv_input))  # read rows and transpose to columns
-            data = [(h, c) for h, c in zip(header, columns) if set(c) != set('0')]
+        # Le colonne sempre a zero vengono dal profilo del dataset: il csv viene riscritto solo se ce ne sono
+        profile = read_profile(filename)
+        null = {col for col, stats in profile.items() if stats['nonzero'] == 0}
+        if not null:
+            return
 
-        with open(filename, 'w', newline='') as f_output:
+        with open(filename, newline='') as f_input, open(filename + '.tmp', 'w', newline='') as f_output:
+            csv_input = csv.reader(f_input)
             csv_output = csv.writer(f_output)
-            csv_output.writerow(h for h, c in data)  # write the new header
-            csv_output.writerows(zip(*[c for h, c in data]))
+            header = next(csv_input)  # read header
+            keep = [i for i, h in enumerate(header) if h not in null]
+            csv_output.writerow(header[i] for i in keep)  # write the new header
+            rows = 0
+            for row in csv_input:
+                csv_output.writerow([row[i] for i in keep])
+                rows += 1
+        os.replace(filename + '.tmp', filename)
+        # Le statistiche delle altre colonne non cambiano
+        write_profile(filename, {'rows': rows, 'columns': {col: stats for col, stats in profile.items()
+                                                           if col not in null}})
 
     def __add_setpoints(self, data_set, cols):
         for col in cols:
@@ -84,36 +189,16 @@ class MergeDatasets:
 
         return data_set
 
-    @staticmethod
-    def truncate_float(num, dec):
-        if num > 0:
-            return math.floor(num * 10 ** dec) / 10 ** dec
-        elif num < 0:
-            return math.ceil(num * 10 ** dec) / 10 ** dec
-
     def __add_slopes(self, data_set, cols):
-        # Genero e aggiungo le colonne slope_
-
-        slope = [None for _ in range(len(data_set))]
-
-        for col in cols:
-            ind = [i for i in data_set[col].index]
-            vals = data_set[col].values.tolist()
-
-            points = np.column_stack([ind, vals])
-            points_rdp = rdp(points, epsilon=self.epsilon)
-
-            for i in range(1, len(points_rdp)):
-                s = (points_rdp[i][1] - points_rdp[i-1][1]) / (points_rdp[i][0] - points_rdp[i-1][0])
-                print(points_rdp[i-1][0], points_rdp[i][0], self.truncate_float(s, 2))
-                for j in range(int(points_rdp[i-1][0]), int(points_rdp[i][0])):
-                    if self.truncate_floati(s, 2) > 0:
-                        slope[j] = 1
-                    elif self.truncate_float(s, 2) < 0:
-                        slope[j] = -1
-                    else:
-                        slope[j] = 0
+        # Genero e aggiungo le colonne slope_, una colonna per processo
+        values = [data_set[col].to_numpy(dtype=np.float64) for col in cols]
+        if self.workers <= 1 or len(cols) <= 1:
+            slopes = [rdp_slopes(v, self.epsilon) for v in values]
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                slopes = list(executor.map(rdp_slopes, values, [self.epsilon] * len(values)))
 
+        for col, slope in zip(cols, slopes):
             data_set.insert(len(data_set.columns), self.config['DATASET']['slope_cols_prefix'] + col, slope)
 
         return data_set
@@ -121,9 +206,10 @@ class MergeDatasets:
     def __add_prevs(self, data_set, cols):
         # Genero e aggiungo le colonne prev_
         for col in cols:
-            prev_val = list()
-            prev_val.append(0)
             data_var = data_set[col]
+            prev_val = list()
+            # zero of the column type, so that a typed column (e.g. bool) keeps its type
+            prev_val.append(data_var.dtype.type(0))
 
             for i in range(len(data_var) - 1):
                 prev_val.append(data_var[i])
@@ -185,29 +271,32 @@ class MergeDatasets:
             print(f'Reading {file.split("/")[-1]} ...')
 
             if self.timerange:
-                df = pd.read_csv(file)
-                df.columns = df.columns.str.replace('.', '_', regex=False)
-                df[self.config['DATASET']['timestamp_col']] = \
-                    df[self.config['DATASET']['timestamp_col']].apply(lambda x:
-                                                                      pd.Timestamp(x).strftime('%Y-%m-%d %H:%M:%S.%f'))
-                df = df.loc[df[self.config['DATASET']['timestamp_col']].between(self.timerange[0],
-                                                                                self.timerange[1],
-                                                                                inclusive="both")]
+                # Vengono lette solo le righe dell'intervallo (ricerca binaria sul file)
+                df = read_dataset(file, timerange=self.timerange, timestamp_col=self.config['DATASET']['timestamp_col'],
+                                  datetimes=True)
             else:
-                df = pd.read_csv(file, skiprows=self.skiprows, nrows=self.nrows)
-                df.columns = df.columns.str.replace('.', '_', regex=False)
-
-                if self.config['DATASET']['timestamp_col'] in df.columns:
-                    df[self.config['DATASET']['timestamp_col']] = \
-                        df[self.config['DATASET']['timestamp_col']].apply(lambda x: pd.Timestamp(x).strftime(
-                            '%Y-%m-%d %H:%M:%S.%f'))
+                df = read_dataset(file, skiprows=self.skiprows, nrows=self.nrows, datetimes=True)
+            df.columns = df.columns.str.replace('.', '_', regex=False)
+
+            # I timestamp restano datetime64, e vengono scritti nel formato '%Y-%m-%d %H:%M:%S.%f'
+            # (letti con il formato del dataset, lo stesso della ricerca binaria di timerange)
+            if self.timerange or self.config['DATASET']['timestamp_col'] in df.columns:
+                df[self.config['DATASET']['timestamp_col']] = parse_timestamps(
+                    df[self.config['DATASET']['timestamp_col']],
+                    timestamp_format(file, self.config['DATASET']['timestamp_col']))
+            if self.timerange:
+                df = df.loc[df[self.config['DATASET']['timestamp_col']].between(pd.Timestamp(self.timerange[0]),
+                                                                                pd.Timestamp(self.timerange[1]),
+                                                                                inclusive="both")]
 
             # I punti nei nomi delle colonne creano parecchi problemi, quindi vanno sostituiti
             # datasetPLC.columns = datasetPLC.columns.str.replace('.', '_', regex=False)
             # print(datasetPLC.isnull().values.any()) # Debug NaN
 
             # Removing empty registers (the registers with values equal to 0 are not used in the control of the CPS)
-            self.clean_null(file)
+            # (not for the datasets kept only as partitions, without csv)
+            if os.path.exists(file):
+                self.clean_null(file)
 
             datasetPLC_daikon = df.copy()  # Altrimenti non mi differenzia le liste, vai a capire perchè...
 
@@ -221,19 +310,28 @@ class MergeDatasets:
 
         return df_list_mining, df_list_daikon
 
-    @staticmethod
-    def __concat_datasets(datasets_list):
-        df = pd.concat(datasets_list, axis=1).reset_index(drop=True)
-        df = df.T.drop_duplicates().T  # Drop dup columns in the dataframe (i.e. Timestamps)
+    def __concat_datasets(self, datasets_list):
+        if self.join == 'timestamp':
+            # Righe dei PLC allineate per timestamp invece che per posizione
+            join = TimestampJoin(len(datasets_list), self.config['DATASET']['timestamp_col'],
+                                 self.config['DATASET'].getfloat('join_tolerance'), self.config['DATASET']['join_fill'])
+            for i, df in enumerate(datasets_list):
+                join.push(i, df)
+                join.finish(i)
+            df = join.pop()
+        else:
+            df = pd.concat(datasets_list, axis=1).reset_index(drop=True)
+        df = df.iloc[:, ~duplicate_columns(df)]  # Drop dup columns in the dataframe (i.e. Timestamps)
 
         return df
 
     def save_mining_dataset(self, datasets_list):
         mining_datasets = self.__concat_datasets(datasets_list)
         # Save dataset with the timestamp for the process mining.
-        mining_datasets.to_csv(
-            f'{os.path.join(self.config["PATHS"]["project_dir"], self.config["MINING"]["data_dir"], self.output_file.split(".")[0])}_TS.csv',
-            index=False)
+        mining_file = f'{os.path.join(self.config["PATHS"]["project_dir"], self.config["MINING"]["data_dir"], self.output_file.split(".")[0])}_TS.csv'
+        write_dataset(mining_datasets, mining_file, date_format=TIMESTAMP_FORMAT)
+        # Profilo delle colonne dalle righe in memoria, così i tool di analisi non rileggono il dataset
+        profile_frame(mining_file, mining_datasets, date_format=TIMESTAMP_FORMAT)
         # print(mining_datasets)  # Debug
 
     def save_daikon_dataset(self, datasets_list):
@@ -245,9 +343,9 @@ class MergeDatasets:
 
         # Drop first rows (Daikon does not process missing values)
         daikon_datasets = daikon_datasets.iloc[1:-1, :]
-        daikon_datasets.to_csv(
-            f'{os.path.join(self.config["PATHS"]["project_dir"], self.config["DAIKON"]["daikon_invariants_dir"], self.output_file)}',
-            index=False)
+        daikon_file = f'{os.path.join(self.config["PATHS"]["project_dir"], self.config["DAIKON"]["daikon_invariants_dir"], self.output_file)}'
+        write_dataset(daikon_datasets, daikon_file)
+        profile_frame(daikon_file, daikon_datasets)
         # print(daikon_datasets)  # Debug
 
 
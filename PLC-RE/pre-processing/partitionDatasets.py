@@ -0,0 +1,50 @@
+import argparse
+import configparser
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dataset_store import dataset_files, parse_timestamps, read_dataset
+from partition_store import FREQS, PartitionedDataset, PartitionWriter
+
+
+def partition(file, timestamp_col, freq, chunksize):
+    """One-time import of a csv dataset in hour or day partitions, read afterwards by read_dataset()"""
+    print(f'Partitioning {file.split("/")[-1]} ...')
+    writer = PartitionWriter(file, timestamp_col, freq)
+    with read_dataset(file, chunksize=chunksize) as chunks:
+        for chunk in chunks:
+            if timestamp_col in chunk.columns:
+                chunk[timestamp_col] = parse_timestamps(chunk[timestamp_col])
+            writer.append(chunk)
+    writer.close()
+    print(f'{file.split("/")[-1]}: {writer.rows} rows in {len(writer.manifest["partitions"])} partitions')
+
+
+def main():
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config.ini'))
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='*', help="csv datasets to import (default: all the datasets of the directory)")
+    parser.add_argument('-d', "--directory", type=str,
+                        default=os.path.join(config['PATHS']['root_dir'], config['PREPROC']['raw_dataset_directory']),
+                        help="directory of the PLC datasets")
+    parser.add_argument('-f', "--freq", choices=list(FREQS), default='day', help="one partition per hour or day")
+    parser.add_argument('-c', "--chunksize", type=int, default=100000, help="csv rows read at a time")
+    parser.add_argument('--force', action='store_true', help="import again the datasets already partitioned")
+    args = parser.parse_args()
+
+    files = args.files or dataset_files(args.directory)
+    for file in files:
+        if not os.path.exists(file):
+            # Dataset already imported, without csv
+            continue
+        if not args.force and PartitionedDataset.exists(file) and PartitionedDataset(file).current():
+            print(f'{file.split("/")[-1]}: already partitioned')
+            continue
+        partition(file, config['DATASET']['timestamp_col'], args.freq, args.chunksize)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,19 @@
 #!/usr/bin/env python3
 
-import pandas as pd
 import os
+import sys
 import argparse
 import configparser
 import subprocess
 import re
 from collections import defaultdict
 
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from column_profile import read_profile
+from dataset_store import read_dataset
+
 
 class SystemInfo:
     def __init__(self):
@@ -88,14 +94,15 @@ class SystemInfo:
         print()
 
     def find_sensors(self):
-        df = pd.read_csv(self.dataset)
-        df_cols = list(df.columns)
+        # Valori distinti, max e min delle colonne dal profilo del dataset, senza rileggerlo
+        profile = read_profile(self.dataset)
+        df_cols = list(profile)
         actuators_list = [k for k, v, in self.actuators.items()]
 
         # Se le colonne hanno un unico valore, abbiamo un attuatore di spare o un setpoint settato
         # nei registri, quindi elimino il registro dalla lista
         for col in df_cols[:]:
-            if len(df[col].unique()) == 1:
+            if profile[col]['cardinality'] == 1:
                 df_cols.remove(col)
 
         # Rimuovo dalla lista gli attuatori trovati in precedenza, ottenendo così i soli sensori
@@ -108,9 +115,10 @@ class SystemInfo:
                    and not x.startswith(self.config['DATASET']['trend_cols_prefix'])
                    and not x.startswith(self.config['DATASET']['slope_cols_prefix'])]
 
+        # np.round come per i massimi e minimi numpy della colonna (il profilo li salva come float Python)
         for col in df_cols:
-            self.sensors[col]['max_lvl'] = round(df[col].max(), 1)
-            self.sensors[col]['min_lvl'] = round(df[col].min(), 1)
+            self.sensors[col]['max_lvl'] = np.round(profile[col]['max'], 1)
+            self.sensors[col]['min_lvl'] = np.round(profile[col]['min'], 1)
 
         # print(self.sensors)
         print("Sensors: ")
@@ -119,8 +127,8 @@ class SystemInfo:
         print()
 
     def find_setpoints_spares(self):
-        df = pd.read_csv(self.dataset)
-        df_cols = list(df.columns)
+        profile = read_profile(self.dataset)
+        df_cols = list(profile)
 
         df_cols = [x for x in df_cols if not x.startswith(self.config['DATASET']['max_prefix'])
                    and not x.startswith(self.config['DATASET']['min_prefix'])
@@ -129,8 +137,8 @@ class SystemInfo:
                    and not x.startswith(self.config['DATASET']['slope_cols_prefix'])]
 
         for col in df_cols[:]:
-            if len(df[col].unique()) == 1:
-                self.setpoints[col] = df[col].unique()[0]
+            if profile[col]['cardinality'] == 1:
+                self.setpoints[col] = profile[col]['values'][0]
 
         # print(self.setpoints)
         print("Hardcoded setpoints or spare actuators: ")
@@ -140,7 +148,7 @@ class SystemInfo:
 
     def actuator_status_period(self):
         actuators_list = [k for k, v, in self.actuators.items()]
-        df = pd.read_csv(self.dataset, encoding='utf-8', usecols=actuators_list)
+        df = read_dataset(self.dataset, bool_as_int=True, encoding='utf-8', usecols=actuators_list)
 
         print("Actuator state durations:")
         for actuator in actuators_list:
@@ -184,8 +192,8 @@ class SystemInfo:
         print("Actuator state changes:")
         for actuator, _ in actuators.items():
             for sensor, _ in sensors.items():
-                df = pd.read_csv(self.dataset,
-                                 usecols=[actuator, self.config["DATASET"]["prev_cols_prefix"] + actuator, sensor])
+                df = read_dataset(self.dataset, bool_as_int=True,
+                                  usecols=[actuator, self.config["DATASET"]["prev_cols_prefix"] + actuator, sensor])
 
                 for v in actuators[actuator]:
                     print(df[df.eval(f'{actuator} == {v} '
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import numpy as np
-import pandas as pd
 import os
+import sys
 import argparse
 import configparser
 import subprocess
@@ -13,6 +13,10 @@ from statistics import mean
 from collections import defaultdict
 import json
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from column_profile import read_profile
+from dataset_store import read_dataset
+
 
 class ProcessMining:
     def __init__(self):
@@ -53,7 +57,7 @@ class ProcessMining:
                   f"not found. Aborting.")
             exit(1)
 
-        self.df = pd.read_csv(self.dataset)
+        self.df = read_dataset(self.dataset, bool_as_int=True)
 
         # Recupero la lista completa di attuatori e sensori (mi servono poi)
         output = self.call_daikon()
@@ -116,12 +120,14 @@ class ProcessMining:
         return equals
 
     def find_sensors(self):
+        # Valori distinti delle colonne dal profilo del dataset (calcolato da self.df se non è già salvato)
+        profile = read_profile(self.dataset, rows=self.df)
         df_cols = list(self.df.columns)
 
         # Se le colonne hanno un unico valore, abbiamo un attuatore di spare o un setpoint settato
         # nei registri, quindi elimino il registro dalla lista
         for col in df_cols[:]:
-            if len(self.df[col].unique()) == 1:
+            if profile[col]['cardinality'] == 1:
                 df_cols.remove(col)
 
         # Rimuovo il timestamp
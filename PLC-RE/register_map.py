@@ -0,0 +1,228 @@
+import configparser
+import os
+from collections import defaultdict, namedtuple
+
+import modbus_tk.defines as cst
+import numpy as np
+
+# Register tables read from every PLC: function code, IEC prefix, base address, bit addressed
+Table = namedtuple('Table', 'function_code prefix base bits')
+
+TABLES = {
+    'DiscreteInputRegisters': Table(cst.READ_DISCRETE_INPUTS, '%IX', 0, True),
+    'InputRegisters': Table(cst.READ_INPUT_REGISTERS, '%IW', 0, False),
+    'HoldingOutputRegisters': Table(cst.READ_HOLDING_REGISTERS, '%QW', 0, False),
+    'MemoryRegisters': Table(cst.READ_HOLDING_REGISTERS, '%MW', 1024, False),
+    'Coils': Table(cst.READ_COILS, '%QX', 0, True),
+}
+
+# Register types and their NumPy dtypes: bit tables default to bool, register tables to uint16.
+# int16 reinterprets the register as two's complement, float32 is the register times its scale
+TYPES = {
+    'bool': '?',
+    'uint16': '<u2',
+    'int16': '<i2',
+    'float32': '<f4',
+}
+
+# Modbus PDU limits: max number of bits/registers returned by a single read
+MAX_READ_BITS = 2000
+MAX_READ_REGISTERS = 125
+
+# Registers read when a PLC has no register map (the historical hardcoded layout)
+DEFAULT_ADDRESSES = {
+    'DiscreteInputRegisters': '0-87',
+    'InputRegisters': '0-10',
+    'HoldingOutputRegisters': '0-10',
+    'MemoryRegisters': '0-10',
+    'Coils': '0-87',
+}
+
+# A single Modbus request: the entries are (column index, position in the response)
+ReadBlock = namedtuple('ReadBlock', 'function_code start count entries')
+
+
+def parse_addresses(spec):
+    """Parse an address list such as "0-10, 16, 20-23" into a sorted list of ints
+
+    Args:
+        spec (string): comma separated addresses or inclusive ranges
+    """
+    addresses = set()
+    for item in spec.replace('\n', ',').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '-' in item:
+            first, last = item.split('-')
+            addresses.update(range(int(first), int(last) + 1))
+        else:
+            addresses.add(int(item))
+    return sorted(addresses)
+
+
+def register_name(table, offset):
+    """IEC name of a register, e.g. %QX1.5 for coil 13 or %MW3 for memory register 3"""
+    prefix, bits = TABLES[table].prefix, TABLES[table].bits
+    if bits:
+        return f'{prefix}{offset // 8}.{offset % 8}'
+    return f'{prefix}{offset}'
+
+
+class RegisterMap:
+    """Registers to read from a PLC and the Modbus requests needed to read them.
+
+    The map file is an INI file with one section per register table (see TABLES) and an
+    `addresses` key listing the IEC indexes actually used; e.g. coil 13 is %QX1.5.
+    A table section can override its `base` Modbus address and an optional [PLC]
+    section sets the Modbus `unit` id. For the change-only recording, `deadband` sets the
+    minimum change recorded for the registers of a table and `deadband.<index>` the one of
+    a single register. `type`/`type.<index>` set the register type (see TYPES) and
+    `scale`/`scale.<index>` the scale of the float32 registers.
+    """
+
+    def __init__(self, addresses, bases=None, unit=1, max_gap=0, deadbands=None, types=None, scales=None):
+        """
+        Args:
+            addresses (dict): table name -> list of IEC indexes to read
+            bases (dict): table name -> Modbus base address (default from TABLES)
+            unit (int): Modbus unit (slave) id
+            max_gap (int): unused addresses that can be read to merge two ranges in one request
+            deadbands (dict): table name -> {IEC index: deadband}, 0 (any change) if missing
+            types (dict): table name -> {IEC index: type}, bool or uint16 if missing
+            scales (dict): table name -> {IEC index: scale of a float32 register}, 1 if missing
+        """
+        self.addresses = {t: sorted(set(addresses.get(t, []))) for t in TABLES}
+        self.bases = {t: TABLES[t].base for t in TABLES}
+        self.bases.update(bases or {})
+        self.unit = int(unit)
+        self.max_gap = int(max_gap)
+        # Flat list of (table, register name), in the order used by read_values()
+        self.columns = [(t, register_name(t, o)) for t in TABLES for o in self.addresses[t]]
+        self.blocks = self.plan()
+        deadbands = deadbands or {}
+        self.deadbands = [float(deadbands.get(t, {}).get(o, 0)) for t in TABLES for o in self.addresses[t]]
+        types = types or {}
+        scales = scales or {}
+        self.types = [types.get(t, {}).get(o, 'bool' if TABLES[t].bits else 'uint16')
+                      for t in TABLES for o in self.addresses[t]]
+        unknown = set(self.types) - set(TYPES)
+        if unknown:
+            raise ValueError(f'unknown register types {", ".join(sorted(unknown))} (valid: {", ".join(TYPES)})')
+        self.scales = [float(scales.get(t, {}).get(o, 1)) for t in TABLES for o in self.addresses[t]]
+        self._schema = [(f'{t}/{n}', TYPES[k]) for (t, n), k in zip(self.columns, self.types)]
+        # Conversion of the raw Modbus values of the columns that are not uint16
+        self._conversions = [(i, k, s) for i, (k, s) in enumerate(zip(self.types, self.scales)) if k != 'uint16']
+
+    @classmethod
+    def default(cls, max_gap=0):
+        return cls({t: parse_addresses(a) for t, a in DEFAULT_ADDRESSES.items()}, max_gap=max_gap)
+
+    @classmethod
+    def from_file(cls, filename, max_gap=0):
+        parser = configparser.ConfigParser()
+        if not parser.read(filename):
+            raise FileNotFoundError(filename)
+
+        addresses = dict()
+        bases = dict()
+        deadbands = dict()
+        types = dict()
+        scales = dict()
+        for table in TABLES:
+            if parser.has_section(table):
+                section = parser[table]
+                addresses[table] = parse_addresses(section.get('addresses', ''))
+                if 'base' in section:
+                    bases[table] = section.getint('base')
+                deadbands[table] = {o: section.getfloat('deadband', 0) for o in addresses[table]}
+                types[table] = {o: section['type'] for o in addresses[table] if 'type' in section}
+                scales[table] = {o: section.getfloat('scale', 1) for o in addresses[table]}
+                for key in section:
+                    if key.startswith('deadband.'):
+                        deadbands[table][int(key.split('.', 1)[1])] = section.getfloat(key)
+                    elif key.startswith('type.'):
+                        types[table][int(key.split('.', 1)[1])] = section[key]
+                    elif key.startswith('scale.'):
+                        scales[table][int(key.split('.', 1)[1])] = section.getfloat(key)
+
+        unit = parser['PLC'].getint('unit', 1) if parser.has_section('PLC') else 1
+        return cls(addresses, bases, unit, max_gap, deadbands, types, scales)
+
+    @classmethod
+    def for_plc(cls, directory, name, max_gap=0):
+        """Load register_maps/plc<name>.ini, falling back to default.ini and then to the builtin layout"""
+        for filename in (f'plc{name}.ini', 'default.ini'):
+            path = os.path.join(directory, filename)
+            if os.path.exists(path):
+                return cls.from_file(path, max_gap)
+        return cls.default(max_gap)
+
+    def plan(self):
+        """Coalesce the registers into the fewest reads allowed by the PDU limits and max_gap"""
+        by_function = defaultdict(list)
+        column = 0
+        for table, offsets in self.addresses.items():
+            for offset in offsets:
+                by_function[TABLES[table].function_code].append((self.bases[table] + offset, column))
+                column += 1
+
+        blocks = list()
+        for function_code, items in by_function.items():
+            limit = MAX_READ_BITS if function_code in (cst.READ_COILS, cst.READ_DISCRETE_INPUTS) \
+                else MAX_READ_REGISTERS
+            items.sort()
+
+            start, end, entries = None, None, list()
+            for address, column in items:
+                if start is not None and (address - end - 1 > self.max_gap or address - start + 1 > limit):
+                    blocks.append(ReadBlock(function_code, start, end - start + 1, entries))
+                    start, entries = None, list()
+                if start is None:
+                    start = address
+                end = address
+                entries.append((column, address - start))
+            if start is not None:
+                blocks.append(ReadBlock(function_code, start, end - start + 1, entries))
+
+        return blocks
+
+    def schema(self):
+        """Column names and NumPy dtypes of a sample, as used by the segment store"""
+        return self._schema
+
+    def read_values(self, master):
+        """Read all the mapped registers
+
+        Args:
+            master (object): to send the read command to the right plc
+
+        Returns:
+            list: register values, in the order of self.columns, converted to their type
+        """
+        row = [0] * len(self.columns)
+        for block in self.blocks:
+            values = master.execute(self.unit, block.function_code, block.start, block.count)
+            for column, position in block.entries:
+                row[column] = values[position]
+        for column, kind, scale in self._conversions:
+            value = row[column]
+            if kind == 'bool':
+                row[column] = bool(value)
+            elif kind == 'int16':
+                row[column] = value - 0x10000 if value & 0x8000 else value
+            else:
+                row[column] = np.float32(value * scale)
+        return row
+
+    def to_dict(self, row):
+        """Nest a row returned by read_values() as table name -> {register name: value}"""
+        registers = {t: dict() for t in TABLES if self.addresses[t]}
+        for (table, name), value in zip(self.columns, row):
+            # bools as 0/1, like the raw coils
+            registers[table][name] = str(int(value)) if isinstance(value, (bool, np.bool_)) else str(value)
+        return registers
+
+    def read(self, master):
+        """Read all the mapped registers, nested as table name -> {register name: value}"""
+        return self.to_dict(self.read_values(master))
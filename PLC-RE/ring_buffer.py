@@ -0,0 +1,168 @@
+import json
+import logging
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from segment_store import TIMESTAMP, row_dtype
+
+logger = logging.getLogger(__name__)
+
+
+class RingBuffer:
+    """Last `capacity` samples of a PLC, in a preallocated structured array.
+
+    There is a single writer (the polling thread of the PLC) and readers never take a
+    lock: they copy the rows they need and then drop the ones the writer may have
+    overwritten in the meantime, detected through the monotonic `written` counter.
+    One spare slot is allocated, so the row being written is never one of the
+    `capacity` rows a reader can see.
+    """
+
+    def __init__(self, columns, capacity):
+        self.dtype = row_dtype(columns)
+        self.columns = [name for name, _ in columns]
+        self.capacity = int(capacity)
+        self.slots = self.capacity + 1
+        self.data = np.zeros(self.slots, dtype=self.dtype)
+        self.written = 0
+
+    def append(self, ts, values):
+        self.data[self.written % self.slots] = (ts, *values)
+        # Publish the row only once it is complete
+        self.written += 1
+
+    def window(self, start=None, end=None, columns=None):
+        """Samples with start <= timestamp <= end, oldest first
+
+        Args:
+            start (float): optional first epoch timestamp
+            end (float): optional last epoch timestamp
+            columns (list): optional subset of columns (the timestamp is always included)
+        """
+        written = self.written
+        first = max(written - self.capacity, 0)
+        order = np.arange(first, written) % self.slots
+
+        timestamps = self.data[TIMESTAMP][order]
+        lo = np.searchsorted(timestamps, start, side='left') if start is not None else 0
+        hi = np.searchsorted(timestamps, end, side='right') if end is not None else len(order)
+
+        fields = [TIMESTAMP] + [c for c in columns if c != TIMESTAMP] if columns else None
+        rows = (self.data[fields] if fields else self.data)[order[lo:hi]]
+
+        # Rows whose slot was reused by the writer while copying are not valid any more
+        overwritten = self.written - self.capacity - (first + lo)
+        if overwritten > 0:
+            rows = rows[overwritten:]
+        return rows
+
+
+class LiveBuffers:
+    """Ring buffers of all the PLCs, created on the first sample of each PLC"""
+
+    def __init__(self, minutes, period):
+        self.capacity = max(int(minutes * 60 / period), 1)
+        self.buffers = dict()
+        self._lock = threading.Lock()
+
+    def append(self, name, ip, port, columns, ts, values):
+        buffer = self.buffers.get(str(name))
+        if buffer is None:
+            with self._lock:
+                buffer = self.buffers.setdefault(str(name), RingBuffer(columns, self.capacity))
+        buffer.append(ts, values)
+
+
+def parse_time(value):
+    """Epoch seconds from an epoch number or an ISO date (YYYY-MM-DD HH:MM:SS)"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+class QueryServer:
+    """Localhost HTTP endpoint on the live buffers.
+
+    GET /plcs
+        PLC names, columns and time span held in memory
+    GET /query?plc=1&registers=Coils/%25QX0.0,InputRegisters/%25IW1&start=...&end=...
+    GET /query?plc=1&last=60
+        columnar JSON with the timestamps and the values of the selected registers
+        (all of them if registers is omitted); start/end are epoch seconds or ISO dates
+    """
+
+    def __init__(self, buffers, port, host='127.0.0.1'):
+        live = buffers
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                logger.debug("Query %s", fmt % args)
+
+            def _reply(self, code, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                try:
+                    if url.path == '/plcs':
+                        self._reply(200, QueryServer.describe(live))
+                    elif url.path == '/query':
+                        self._reply(200, QueryServer.query(live, query))
+                    else:
+                        self._reply(404, {'error': f'unknown path {url.path}'})
+                except (KeyError, ValueError) as e:
+                    self._reply(400, {'error': str(e)})
+
+        self.httpd = ThreadingHTTPServer((host, int(port)), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='query-server', daemon=True)
+
+    @staticmethod
+    def describe(live):
+        plcs = dict()
+        for name, buffer in list(live.buffers.items()):
+            rows = buffer.window(columns=[TIMESTAMP])
+            plcs[name] = {'columns': buffer.columns, 'samples': len(rows),
+                          'first': float(rows[TIMESTAMP][0]) if len(rows) else None,
+                          'last': float(rows[TIMESTAMP][-1]) if len(rows) else None}
+        return plcs
+
+    @staticmethod
+    def query(live, query):
+        if query.get('plc') not in live.buffers:
+            raise KeyError(f'unknown PLC {query.get("plc")}')
+        buffer = live.buffers[query['plc']]
+
+        columns = query['registers'].split(',') if query.get('registers') else buffer.columns
+        unknown = [c for c in columns if c not in buffer.columns]
+        if unknown:
+            raise KeyError(f'unknown registers {", ".join(unknown)}')
+
+        start = parse_time(query['start']) if 'start' in query else None
+        end = parse_time(query['end']) if 'end' in query else None
+        if 'last' in query:
+            newest = buffer.window(columns=[TIMESTAMP])[TIMESTAMP]
+            start = float(newest[-1]) - float(query['last']) if len(newest) else None
+
+        rows = buffer.window(start, end, columns)
+        return {c: rows[c].tolist() for c in [TIMESTAMP] + columns}
+
+    def start(self):
+        self._thread.start()
+        logger.info("Query endpoint on http://%s:%d", *self.httpd.server_address[:2])
+        return self
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
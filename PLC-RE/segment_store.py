@@ -0,0 +1,424 @@
+import glob
+import json
+import os
+import struct
+import threading
+from datetime import datetime
+
+import numpy as np
+import numpy.lib.recfunctions as rfn
+import pandas as pd
+from dateutil import tz
+
+# Segment file layout:
+#   MAGIC | header length (uint32) | JSON header | fixed-size binary rows ...
+# and, next to it, a .idx file with one INDEX_DTYPE entry per block of rows written.
+# In the change-only ("delta") segments the rows are replaced by records, with the register values
+# in the dtypes of their columns:
+#   RECORD (kind, timestamp) | all the registers                                for a keyframe
+#   RECORD | bitmap of the changed registers (1 bit per column) | their values  for the changes
+# and the index entries (DELTA_INDEX_DTYPE) also hold the offset of the keyframe the block starts from.
+MAGIC = b'PLCSEG1\n'
+PREAMBLE = struct.Struct('<8sI')
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('nbytes', '<u8'), ('rows', '<u4'),
+                        ('ts_min', '<f8'), ('ts_max', '<f8')])
+DELTA_INDEX_DTYPE = np.dtype(INDEX_DTYPE.descr + [('keyframe', '<u8')])
+RECORD = struct.Struct('<Bd')
+KEYFRAME, CHANGES = 1, 0
+TIMESTAMP = 'timestamp'
+
+
+def row_dtype(columns):
+    """Structured dtype of a row: epoch timestamp followed by the register columns
+
+    Args:
+        columns (list): list of (column name, dtype) tuples
+    """
+    return np.dtype([(TIMESTAMP, '<f8')] + [(name, dtype) for name, dtype in columns])
+
+
+def values_layout(dtype):
+    """Packed dtype of the register values of a row (without the timestamp), with the byte offset and size
+    of each column in it"""
+    names = list(dtype.names[1:])
+    values = np.dtype([(name, dtype[name]) for name in names])
+    offsets = np.array([values.fields[name][1] for name in names], dtype=np.int64)
+    sizes = np.array([values[name].itemsize for name in names], dtype=np.int64)
+    return values, offsets, sizes
+
+
+class SegmentWriter:
+    """Append-only writer of the samples of a single PLC.
+
+    Rows are buffered in a preallocated block and written when the block is full. A new
+    segment file is started when the current one exceeds max_bytes or spans more than
+    max_seconds.
+    """
+
+    def __init__(self, directory, name, ip, port, columns, max_bytes=64 * 2**20, max_seconds=3600,
+                 block_rows=60, metrics=None):
+        self.directory = directory
+        self.metrics = metrics
+        self.header = {'plc': str(name), 'ip': str(ip), 'port': str(port),
+                       'columns': [list(c) for c in columns]}
+        self.dtype = row_dtype(columns)
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.block = np.zeros(block_rows, dtype=self.dtype)
+        self.buffered = 0
+
+        self.path = None
+        self._data = None
+        self._index = None
+        self._size = 0
+        self._first_ts = None
+
+    def _open(self, ts):
+        created = datetime.fromtimestamp(ts)
+        header = dict(self.header, created=created.isoformat(), row_size=self.dtype.itemsize)
+        header = json.dumps(header).encode('utf-8')
+
+        self.path = os.path.join(self.directory, f'plc{self.header["plc"]}-{self.header["ip"]}-'
+                                                 f'{self.header["port"]}@{created:%Y%m%dT%H%M%S.%f}.seg')
+        self._data = open(self.path, 'wb')
+        self._data.write(PREAMBLE.pack(MAGIC, len(header)))
+        self._data.write(header)
+        self._data.flush()
+        self._index = open(self.path[:-4] + '.idx', 'wb')
+        self._size = self._data.tell()
+        self._first_ts = ts
+        self._written(self._size)
+
+    def _written(self, nbytes):
+        if self.metrics is not None:
+            self.metrics.add_bytes(self.header['plc'], nbytes)
+
+    def append(self, ts, values):
+        """Append a sample
+
+        Args:
+            ts (float): epoch timestamp of the sample
+            values (list): register values, in the order of the columns
+        """
+        if self._data is not None and ts - self._first_ts >= self.max_seconds:
+            self.rotate()
+
+        self.block[self.buffered] = (ts, *values)
+        self.buffered += 1
+        if self.buffered == len(self.block):
+            self.flush()
+
+    def flush(self):
+        if not self.buffered:
+            return
+        rows = self.block[:self.buffered]
+        if self._data is None:
+            self._open(float(rows[TIMESTAMP][0]))
+
+        data = rows.tobytes()
+        self._data.write(data)
+        self._data.flush()
+        entry = np.array([(self._size, len(data), len(rows), rows[TIMESTAMP][0], rows[TIMESTAMP][-1])],
+                         dtype=INDEX_DTYPE)
+        self._index.write(entry.tobytes())
+        self._index.flush()
+        self._size += len(data)
+        self._written(len(data) + INDEX_DTYPE.itemsize)
+        self.buffered = 0
+
+        if self._size >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.flush()
+        if self._data is not None:
+            self._data.close()
+            self._index.close()
+            self._data = None
+            self._index = None
+
+    def close(self):
+        self.rotate()
+
+
+class DeltaSegmentWriter(SegmentWriter):
+    """Change-only writer: a full keyframe every keyframe_interval samples (and at the start
+    of every segment), otherwise only the registers that moved by more than their deadband
+    since the last recorded value, in the dtypes of their columns.
+
+    The keyframes do not depend on the blocks: the index entry of a block points to the
+    keyframe its first record is decoded from.
+    """
+
+    def __init__(self, directory, name, ip, port, columns, deadbands=None, keyframe_interval=600, **options):
+        super().__init__(directory, name, ip, port, columns, **options)
+        self.header['mode'] = 'delta'
+        self.deadbands = np.zeros(len(columns)) if deadbands is None else np.asarray(deadbands, dtype=np.float64)
+        self.keyframe_interval = keyframe_interval
+        self.block_rows = len(self.block)
+        self.values, self.offsets, self.sizes = values_layout(self.dtype)
+        self.row = np.zeros(1, dtype=self.values)
+        self.bitmap = np.zeros(len(columns), dtype=bool)
+
+        self.last = None
+        self.since_keyframe = 0
+        self.keyframe = 0
+        self.records = list()
+        self.timestamps = list()
+        # Offsets of the keyframes in the buffered records
+        self.keyframes = list()
+        self.buffered_bytes = 0
+
+    def append(self, ts, values):
+        if self._data is not None and ts - self._first_ts >= self.max_seconds:
+            self.rotate()
+
+        row = np.asarray(values, dtype=np.float64)
+        self.row[0] = tuple(values)
+        data = self.row.tobytes()
+        if self.last is None or self.since_keyframe >= self.keyframe_interval:
+            record = RECORD.pack(KEYFRAME, ts) + data
+            self.keyframes.append(self.buffered_bytes)
+            self.last = row
+            self.since_keyframe = 0
+        else:
+            changed = np.flatnonzero(np.abs(row - self.last) > self.deadbands)
+            self.last[changed] = row[changed]
+            self.bitmap[:] = False
+            self.bitmap[changed] = True
+            record = RECORD.pack(CHANGES, ts) + np.packbits(self.bitmap, bitorder='little').tobytes() \
+                + b''.join(data[o:o + n] for o, n in zip(self.offsets[changed], self.sizes[changed]))
+        self.records.append(record)
+        self.buffered_bytes += len(record)
+        self.since_keyframe += 1
+        self.timestamps.append(ts)
+
+        if len(self.records) == self.block_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.records:
+            return
+        if self._data is None:
+            self._open(self.timestamps[0])
+
+        # The block is decoded from its own first record if it is a keyframe, from the last one before otherwise
+        if self.keyframes and self.keyframes[0] == 0:
+            self.keyframe = self._size
+        data = b''.join(self.records)
+        self._data.write(data)
+        self._data.flush()
+        entry = np.array([(self._size, len(data), len(self.records), self.timestamps[0], self.timestamps[-1],
+                           self.keyframe)], dtype=DELTA_INDEX_DTYPE)
+        self._index.write(entry.tobytes())
+        self._index.flush()
+        if self.keyframes:
+            self.keyframe = self._size + self.keyframes[-1]
+        self._size += len(data)
+        self._written(len(data) + DELTA_INDEX_DTYPE.itemsize)
+        self.records = list()
+        self.timestamps = list()
+        self.keyframes = list()
+        self.buffered_bytes = 0
+
+        if self._size >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        super().rotate()
+        # Every segment starts with a keyframe
+        self.last = None
+
+
+class SegmentStore:
+    """Segment writers of all the PLCs, created on the first sample of each PLC
+
+    With recording='changes' the writers are DeltaSegmentWriter.
+    """
+
+    def __init__(self, directory, max_bytes=64 * 2**20, max_seconds=3600, block_rows=60, recording='full',
+                 keyframe_interval=600, metrics=None):
+        self.directory = directory
+        self.options = {'max_bytes': max_bytes, 'max_seconds': max_seconds, 'block_rows': block_rows,
+                        'metrics': metrics}
+        self.recording = recording
+        self.keyframe_interval = keyframe_interval
+        self.writers = dict()
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _writer(self, name, ip, port, columns, deadbands):
+        if self.recording == 'changes':
+            return DeltaSegmentWriter(self.directory, name, ip, port, columns, deadbands, self.keyframe_interval,
+                                      **self.options)
+        return SegmentWriter(self.directory, name, ip, port, columns, **self.options)
+
+    def append(self, name, ip, port, columns, ts, values, deadbands=None):
+        key = (str(name), str(ip), str(port))
+        writer = self.writers.get(key)
+        if writer is None:
+            with self._lock:
+                if key not in self.writers:
+                    self.writers[key] = self._writer(name, ip, port, columns, deadbands)
+                writer = self.writers[key]
+        writer.append(ts, values)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+def read_header(path):
+    """Header of a segment file and the offset of its first row"""
+    with open(path, 'rb') as f:
+        magic, length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a historian segment')
+        header = json.loads(f.read(length).decode('utf-8'))
+    return header, PREAMBLE.size + length
+
+
+def decode_delta(data, dtype):
+    """Expand the records of a change-only segment back into dense rows
+
+    Args:
+        data (bytes): records, starting with a keyframe (the records before the first keyframe are skipped)
+        dtype (numpy.dtype): row dtype of the segment
+    """
+    values, offsets, sizes = values_layout(dtype)
+    bitmap_size = (len(offsets) + 7) // 8
+    timestamps = list()
+    rows = list()
+    # Forward fill: the raw values of the last row, updated by each record
+    state = None
+
+    pos = 0
+    while pos + RECORD.size <= len(data):
+        kind, ts = RECORD.unpack_from(data, pos)
+        start = pos + RECORD.size
+        if kind == KEYFRAME:
+            pos = start + values.itemsize
+            if pos > len(data):
+                break  # truncated record (interrupted capture)
+            state = bytearray(data[start:pos])
+        else:
+            if start + bitmap_size > len(data):
+                break
+            bitmap = np.unpackbits(np.frombuffer(data, dtype=np.uint8, count=bitmap_size, offset=start),
+                                   count=len(offsets), bitorder='little')
+            changed = np.flatnonzero(bitmap)
+            pos = start + bitmap_size + int(sizes[changed].sum())
+            if pos > len(data):
+                break
+            if state is not None:
+                value = start + bitmap_size
+                for o, n in zip(offsets[changed], sizes[changed]):
+                    state[o:o + n] = data[value:value + n]
+                    value += n
+        if state is not None:
+            timestamps.append(ts)
+            rows.append(bytes(state))
+
+    out = np.zeros(len(rows), dtype=dtype)
+    out[TIMESTAMP] = timestamps
+    decoded = np.frombuffer(b''.join(rows), dtype=values)
+    for name in values.names:
+        out[name] = decoded[name]
+    return out
+
+
+class SegmentReader:
+    """Read the samples of a PLC back from its segments"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def segments(self, plc):
+        return sorted(glob.glob(os.path.join(self.directory, f'plc{plc}-*.seg')))
+
+    def _read_segment(self, path, start, end):
+        header, data_offset = read_header(path)
+        dtype = row_dtype(header['columns'])
+        delta = header.get('mode') == 'delta'
+        index_dtype = DELTA_INDEX_DTYPE if delta else INDEX_DTYPE
+
+        index = np.fromfile(path[:-4] + '.idx', dtype=index_dtype) if os.path.exists(path[:-4] + '.idx') \
+            else np.zeros(0, dtype=index_dtype)
+        if len(index):
+            if (start is not None and index['ts_max'][-1] < start) or (end is not None and index['ts_min'][0] > end):
+                return np.zeros(0, dtype=dtype)
+            # Only the blocks overlapping the time window
+            selected = np.ones(len(index), dtype=bool)
+            if start is not None:
+                selected &= index['ts_max'] >= start
+            if end is not None:
+                selected &= index['ts_min'] <= end
+            blocks = index[selected]
+            first = int(blocks['offset'][0]) if len(blocks) else data_offset
+            rows = int(blocks['rows'].sum())
+            nbytes = int(blocks['nbytes'].sum())
+            if delta and len(blocks):
+                # Decoded from the keyframe before the first block
+                first = int(blocks['keyframe'][0])
+                nbytes = int(blocks['offset'][-1] + blocks['nbytes'][-1]) - first
+        else:
+            # No index (e.g. interrupted capture): rows have a fixed size, read them all
+            first = data_offset
+            rows = (os.path.getsize(path) - data_offset) // dtype.itemsize
+            nbytes = -1
+
+        if delta:
+            with open(path, 'rb') as f:
+                f.seek(first)
+                data = decode_delta(f.read(nbytes), dtype)
+        else:
+            data = np.fromfile(path, dtype=dtype, count=rows, offset=first)
+        mask = np.ones(len(data), dtype=bool)
+        if start is not None:
+            mask &= data[TIMESTAMP] >= start
+        if end is not None:
+            mask &= data[TIMESTAMP] <= end
+        return data[mask]
+
+    def read(self, plc, start=None, end=None, columns=None):
+        """Samples of a PLC as a NumPy structured array
+
+        Args:
+            plc (string): name of the PLC
+            start (datetime): optional first timestamp
+            end (datetime): optional last timestamp
+            columns (list): optional subset of columns (the timestamp is always included)
+        """
+        start = start.timestamp() if isinstance(start, datetime) else start
+        end = end.timestamp() if isinstance(end, datetime) else end
+
+        chunks = [self._read_segment(path, start, end) for path in self.segments(plc)]
+        chunks = [c for c in chunks if len(c)]
+        if columns:
+            fields = [TIMESTAMP] + [c for c in columns if c != TIMESTAMP]
+            chunks = [rfn.repack_fields(c[fields]) for c in chunks]
+        if not chunks:
+            return np.zeros(0, dtype=row_dtype([]))
+        if any(c.dtype != chunks[0].dtype for c in chunks):
+            raise ValueError(f'The segments of PLC {plc} have different schemas, use to_dataframe()')
+        return np.concatenate(chunks)
+
+    def to_dataframe(self, plc, start=None, end=None, columns=None):
+        """Samples of a PLC as a DataFrame, with a datetime64 timestamp column"""
+        start = start.timestamp() if isinstance(start, datetime) else start
+        end = end.timestamp() if isinstance(end, datetime) else end
+
+        frames = list()
+        for path in self.segments(plc):
+            data = self._read_segment(path, start, end)
+            if len(data):
+                frames.append(pd.DataFrame(data if not columns else data[[TIMESTAMP] + list(columns)]))
+        if not frames:
+            return pd.DataFrame(columns=[TIMESTAMP] + list(columns or []))
+
+        df = pd.concat(frames, ignore_index=True)
+        # Local time, as in the names of the JSON files
+        df[TIMESTAMP] = pd.to_datetime(df[TIMESTAMP], unit='s', utc=True).dt.tz_convert(tz.tzlocal()) \
+            .dt.tz_localize(None)
+        return df
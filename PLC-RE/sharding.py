@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+from datetime import datetime
+from multiprocessing.connection import wait
+
+from connection_pool import ConnectionPool
+from modbus_poller import AsyncPoller
+from poll_metrics import PollMetrics
+
+logger = logging.getLogger(__name__)
+
+# Time given to the workers to connect to their PLCs before the first tick
+STARTUP_DELAY = 2.0
+# Interval between two metrics snapshots sent by a worker (seconds)
+METRICS_INTERVAL = 5.0
+
+
+def split_fleet(plc_list, shards):
+    """Round robin assignment of the PLCs to `shards` workers"""
+    return [plc_list[i::shards] for i in range(shards) if plc_list[i::shards]]
+
+
+def _send_sample(name, ip, port, connection, ora, register_maps, pipe, lock):
+    values = register_maps[str(name)].read_values(connection)
+    with lock:
+        pipe.send((str(name), str(ip), str(port), ora.timestamp(), values))
+
+
+def _send_metrics(metrics, pipe, lock):
+    snapshot = metrics.snapshot()
+    with lock:
+        pipe.send(('metrics', snapshot))
+
+
+def _worker(plc_list, register_maps, duration, period, start, pool_options, pipe):
+    """Poll a subset of the PLCs with its own connections and stream the samples to the writer"""
+    metrics = PollMetrics(period)
+    pool = ConnectionPool(plc_list, metrics=metrics, **pool_options).start()
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def poll_fn(name, ip, port, connection, ora):
+        _send_sample(name, ip, port, connection, ora, register_maps, pipe, lock)
+
+    def metrics_loop():
+        while not stop.wait(METRICS_INTERVAL):
+            _send_metrics(metrics, pipe, lock)
+
+    reporter = threading.Thread(target=metrics_loop, name='metrics-report', daemon=True)
+    reporter.start()
+    poller = AsyncPoller(plc_list, pool, period, poll_fn, metrics=metrics)
+    try:
+        asyncio.run(poller.run(duration, start))
+    finally:
+        stop.set()
+        reporter.join()
+        pool.close()
+        _send_metrics(metrics, pipe, lock)
+        pipe.send(None)
+        pipe.close()
+
+
+def run_sharded(plc_list, register_maps, shards, duration, period, save_fn, pool_options=None, metrics=None):
+    """Poll the PLCs from `shards` worker processes; the calling process writes the samples.
+
+    Every worker owns the connections of its PLCs and runs its own AsyncPoller. All the
+    pollers share the same start time (CLOCK_MONOTONIC is system wide), so the samples of
+    different shards keep aligned timestamps.
+
+    Args:
+        plc_list (list): list of (name, ip, port) tuples
+        register_maps (dict): PLC name -> RegisterMap
+        shards (int): number of worker processes
+        duration (float): capture length in seconds
+        period (float): sampling period in seconds
+        save_fn (callable): save_fn(name, ip, port, values, ora) stores a sample
+        pool_options (dict): ConnectionPool options
+        metrics (PollMetrics): optional, receives the timing snapshots of the workers
+    """
+    start = (time.monotonic() + STARTUP_DELAY, time.time() + STARTUP_DELAY)
+
+    workers = list()
+    pipes = list()
+    sources = dict()
+    for worker_id, subset in enumerate(split_fleet(plc_list, shards)):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        worker = multiprocessing.Process(target=_worker, daemon=True,
+                                         args=(subset, register_maps, duration, period, start,
+                                               pool_options or {}, sender))
+        worker.start()
+        sender.close()
+        workers.append(worker)
+        pipes.append(receiver)
+        sources[receiver] = worker_id
+    logger.info("Polling %d PLCs from %d worker processes", len(plc_list), len(workers))
+
+    samples = 0
+    while pipes:
+        for pipe in wait(pipes):
+            try:
+                message = pipe.recv()
+            except EOFError:
+                message = None
+            if message is None:
+                pipes.remove(pipe)
+                continue
+            if len(message) == 2:
+                if metrics is not None:
+                    metrics.merge(sources[pipe], message[1])
+                continue
+            name, ip, port, ts, values = message
+            try:
+                save_fn(name, ip, port, values, datetime.fromtimestamp(ts))
+                samples += 1
+            except Exception as e:
+                logger.error("Cannot save the sample of PLC %s (%s:%s): %s", name, ip, port, e)
+
+    for worker in workers:
+        worker.join()
+    return samples
@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 
-import pandas as pd
 import os
+import sys
 import configparser
 import argparse
 import matplotlib.pyplot as plt
 from scipy.stats import shapiro
 from scipy.stats import chisquare
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dataset_store import read_dataset
+
 
 class HistoryPlotStats:
     def __init__(self):
@@ -24,9 +27,9 @@ class HistoryPlotStats:
         self.filename = self.args.filename.split('/')[-1]
         self.register = self.args.register
 
-        self.df = pd.read_csv(os.path.join(self.config['PATHS']['project_dir'],
-                                           self.config['DAIKON']['daikon_invariants_dir'],
-                                           self.filename))
+        self.df = read_dataset(os.path.join(self.config['PATHS']['project_dir'],
+                                            self.config['DAIKON']['daikon_invariants_dir'],
+                                            self.filename), usecols=[self.register])
 
     def chi_squared_uniformity(self):
         print(f"Chi-squared test for uniformity")
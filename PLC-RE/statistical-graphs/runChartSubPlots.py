@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 import pandas as pd
 import matplotlib.pyplot as plt
 import argparse
@@ -8,6 +9,9 @@ import configparser
 
 from matplotlib import gridspec
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dataset_store import read_dataset
+
 
 class RunChartsSubPlots:
     def __init__(self):
@@ -24,7 +28,10 @@ class RunChartsSubPlots:
 
         self.filename = self.args.filename
 
-        self.df = pd.read_csv(f'{os.path.join(self.config["PATHS"]["project_dir"], self.config["DAIKON"]["daikon_invariants_dir"], self.filename)}')
+        # Con -r vengono lette solo le colonne dei registri da disegnare
+        registers = set(self.args.registers or [])
+        self.df = read_dataset(f'{os.path.join(self.config["PATHS"]["project_dir"], self.config["DAIKON"]["daikon_invariants_dir"], self.filename)}',
+                               usecols=(lambda c: c in registers) if registers else None)
 
         if self.args.registers:
             self.registers = [r for r in self.args.registers]
@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from column_profile import PROFILE_VALUES, current_profile, profile_frame, profile_path, read_profile
+from dataset_store import TIMESTAMP_FORMAT, write_dataset
+
+
+def dataset(rng, rows, first=0):
+    """Rows of a merged dataset: timestamps, bools, few and many distinct integers, floats with NaN"""
+    many = rng.integers(0, 10 * PROFILE_VALUES, rows)
+    return pd.DataFrame({'Timestamp': pd.Timestamp('2024-01-01') + pd.to_timedelta(first + np.arange(rows), 's'),
+                         'bool': rng.random(rows) > 0.7,
+                         'few': rng.integers(0, 5, rows).astype(np.uint16),
+                         'many': many,
+                         'float': np.where(rng.random(rows) > 0.9, np.nan, rng.random(rows).round(3))})
+
+
+def fresh_profile(path):
+    """Profile computed from the whole csv, without the saved one"""
+    os.replace(profile_path(path), profile_path(path) + '.saved')
+    try:
+        return read_profile(path, chunksize=97)
+    finally:
+        os.replace(profile_path(path) + '.saved', profile_path(path))
+
+
+class TestColumnProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'merged.csv')
+        self.rng = np.random.default_rng(0)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def assertProfileEqual(self, profile, expected):
+        # NaN != NaN: compare the json texts
+        self.assertEqual(pd.Series(profile).to_json(), pd.Series(expected).to_json())
+
+    def test_appended_rows(self):
+        write_dataset(dataset(self.rng, 500), self.path, date_format=TIMESTAMP_FORMAT)
+        profile = read_profile(self.path, chunksize=97)
+        self.assertEqual(profile['few']['cardinality'], 5)
+        self.assertIsNone(profile['many']['cardinality'])
+        self.assertEqual(current_profile(self.path), profile)
+
+        dataset(self.rng, 300, 500).astype({'bool': np.uint8}).to_csv(self.path, mode='a', header=False,
+                                                                     index=False, date_format=TIMESTAMP_FORMAT)
+        self.assertIsNone(current_profile(self.path))
+        profile = read_profile(self.path, chunksize=97)
+        self.assertProfileEqual(profile, fresh_profile(self.path))
+        self.assertEqual(profile['bool']['nonzero'], int(pd.read_csv(self.path)['bool'].sum()))
+
+    def test_rewritten_csv(self):
+        write_dataset(dataset(self.rng, 500), self.path, date_format=TIMESTAMP_FORMAT)
+        read_profile(self.path)
+        write_dataset(dataset(self.rng, 600), self.path, date_format=TIMESTAMP_FORMAT)
+        profile = read_profile(self.path)
+        self.assertEqual(profile['Timestamp']['cardinality'], None)
+        self.assertProfileEqual(profile, fresh_profile(self.path))
+
+    def test_profile_frame(self):
+        df = dataset(self.rng, 500)
+        write_dataset(df, self.path, date_format=TIMESTAMP_FORMAT)
+        profile_frame(self.path, df, date_format=TIMESTAMP_FORMAT)
+        self.assertProfileEqual(current_profile(self.path), fresh_profile(self.path))
+
+        more = dataset(self.rng, 200, 500)
+        write_dataset(more, self.path, mode='a', header=False, date_format=TIMESTAMP_FORMAT)
+        profile_frame(self.path, more, append=True, date_format=TIMESTAMP_FORMAT)
+        self.assertProfileEqual(current_profile(self.path), fresh_profile(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
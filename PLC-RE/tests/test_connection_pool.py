@@ -0,0 +1,160 @@
+import asyncio
+import os
+import socket
+import sys
+import time
+import unittest
+
+import modbus_tk.defines as cst
+from modbus_tk.exceptions import ModbusError
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from connection_pool import ConnectionPool, PLCConnection
+from modbus_poller import AsyncPoller
+from plc_simulator import SimulatedPLC
+from register_map import RegisterMap
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def listening(port):
+    try:
+        socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+        return True
+    except OSError:
+        return False
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.simulators = list()
+
+    def tearDown(self):
+        for simulator in self.simulators:
+            simulator.stop()
+
+    def simulator(self, port, **options):
+        self.simulators.append(SimulatedPLC(port, change_rate=0, seed=0, **options).start())
+        # The server listens from its own thread
+        self.assertTrue(wait_until(lambda: listening(port)))
+        return self.simulators[-1]
+
+    def test_timeout_follows_rtt(self):
+        connection = PLCConnection('1', '127.0.0.1', free_port(), min_timeout=0.05, max_timeout=5.0)
+        for _ in range(20):
+            connection._update_timeout(0.2)
+        # srtt + 4 * rttvar converges to the round trip time
+        self.assertAlmostEqual(connection.srtt, 0.2)
+        self.assertLess(connection.timeout, 0.25)
+        self.assertGreaterEqual(connection.timeout, 0.2)
+        # A jittery PLC gets a larger timeout, clamped to [min_timeout, max_timeout]
+        for rtt in (0.01, 0.4) * 10:
+            connection._update_timeout(rtt)
+        self.assertGreater(connection.timeout, 0.4)
+        for _ in range(50):
+            connection._update_timeout(0.001)
+        self.assertEqual(connection.timeout, 0.05)
+        connection._update_timeout(60)
+        self.assertEqual(connection.timeout, 5.0)
+
+    def test_health(self):
+        port = free_port()
+        self.simulator(port, latency=0.01)
+        pool = ConnectionPool([('1', '127.0.0.1', port)], initial_timeout=1.0).start()
+        try:
+            connection = pool[0]
+            self.assertTrue(connection.healthy)
+            for _ in range(5):
+                self.assertEqual(len(connection.execute(1, cst.READ_INPUT_REGISTERS, 0, 11)), 11)
+            self.assertLess(connection.timeout, 1.0)
+
+            # An exception code from the PLC: still connected
+            with self.assertRaises(ModbusError):
+                connection.execute(1, cst.READ_INPUT_REGISTERS, 500, 1)
+            self.assertTrue(connection.healthy)
+        finally:
+            pool.close()
+        self.assertFalse(pool[0].healthy)
+
+    def test_reconnection(self):
+        port = free_port()
+        pool = ConnectionPool([('1', '127.0.0.1', port)], initial_timeout=0.5, backoff=0.05,
+                              max_backoff=0.2)
+        try:
+            with self.assertLogs('connection_pool', 'WARNING'):
+                pool.start()
+            connection = pool[0]
+            self.assertFalse(connection.healthy)
+            self.assertGreaterEqual(connection.failures, 1)
+
+            # The PLC comes up: reconnected in background
+            simulator = self.simulator(port)
+            self.assertTrue(wait_until(lambda: connection.healthy))
+            self.assertEqual(connection.failures, 0)
+            connection.execute(1, cst.READ_COILS, 0, 8)
+
+            # The PLC goes down: a network error marks it unhealthy until it is back
+            simulator.stop()
+            self.simulators.remove(simulator)
+            with self.assertRaises(Exception):
+                connection.execute(1, cst.READ_COILS, 0, 8)
+            self.assertFalse(connection.healthy)
+            self.simulator(port)
+            self.assertTrue(wait_until(lambda: connection.healthy))
+            connection.execute(1, cst.READ_COILS, 0, 8)
+        finally:
+            pool.close()
+
+    def test_backoff(self):
+        pool = ConnectionPool([('1', '127.0.0.1', free_port())], initial_timeout=0.5, backoff=1.0,
+                              max_backoff=4.0)
+        connection = pool[0]
+        with self.assertLogs('connection_pool', 'WARNING'):
+            for failures in range(1, 6):
+                before = time.monotonic()
+                pool._try_connect(connection)
+                # Exponential, capped, with jitter in [delay / 2, delay]
+                delay = min(2 ** (failures - 1), 4.0)
+                self.assertEqual(connection.failures, failures)
+                self.assertGreaterEqual(connection.next_retry - before, delay / 2)
+                self.assertLessEqual(connection.next_retry - time.monotonic(), delay)
+
+    def test_poll_simulated_plcs(self):
+        ports = [free_port() for _ in range(2)]
+        for port in ports:
+            self.simulator(port)
+        plc_list = [(str(i + 1), '127.0.0.1', port) for i, port in enumerate(ports)]
+        register_map = RegisterMap.default()
+        samples = list()
+
+        def poll(name, ip, port, connection, ora):
+            samples.append((name, ora, register_map.read_values(connection)))
+
+        pool = ConnectionPool(plc_list).start()
+        try:
+            poller = AsyncPoller(plc_list, pool, 0.05, poll)
+            asyncio.run(poller.run(0.25))
+        finally:
+            pool.close()
+        self.assertEqual((poller.failed_polls, poller.unhealthy_polls), (0, 0))
+        self.assertEqual(len(samples) + poller.skipped_polls, len(plc_list) * poller.ticks)
+        self.assertEqual({name for name, _, _ in samples}, {'1', '2'})
+        self.assertTrue(all(len(values) == len(register_map.columns) for _, _, values in samples))
+
+
+if __name__ == '__main__':
+    unittest.main()
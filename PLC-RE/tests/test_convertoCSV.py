@@ -0,0 +1,121 @@
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dataset_store import read_dataset, read_dtypes
+from register_map import RegisterMap
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pre-processing', 'convertoCSV.py')
+
+
+class TestConvertJson(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        for directory in ('historian', 'register_maps', 'pre-processing', 'daikon/Daikon_Invariants'):
+            os.makedirs(os.path.join(self.tmp.name, directory))
+        with open(os.path.join(self.tmp.name, 'register_maps', 'plc2.ini'), 'w') as f:
+            f.write('[InputRegisters]\naddresses = 0-1\n')
+        with open(os.path.join(self.tmp.name, 'register_maps', 'plc3.ini'), 'w') as f:
+            f.write('[InputRegisters]\naddresses = 0-1\ntype = float32\nscale = 0.1\n'
+                    '[HoldingOutputRegisters]\naddresses = 0\ntype = int16\n')
+        # The script works on the directories relative to pre-processing/
+        os.chdir(os.path.join(self.tmp.name, 'pre-processing'))
+        spec = importlib.util.spec_from_file_location('convertoCSV', SCRIPT)
+        self.convertoCSV = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.convertoCSV)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def poll(self, second, addresses):
+        """json file of a poll of PLC 2, as written by main.py, with the input registers at `addresses`"""
+        registers = RegisterMap({'InputRegisters': addresses})
+        data = {'127.0.0.1': registers.to_dict([second * 10 + a for a in addresses])}
+        with open(f'../historian/plc2-127.0.0.1-502@2024-01-01 00:00:{second:02d}.000000.json', 'w') as f:
+            json.dump(data, f)
+
+    def test_append_new_register(self):
+        csv_file = 'PLC_CSV/PLC2Dataset.csv'
+        for second in range(3):
+            self.poll(second, [0])
+        self.convertoCSV.convert(2)
+        self.assertEqual(read_dtypes(csv_file), {'PLC2_InputRegisters_IW0': 'uint16'})
+
+        # A register added to the captures: the older rows have no value for it
+        for second in range(3, 5):
+            self.poll(second, [0, 1])
+        self.convertoCSV.convert(2)
+        self.assertEqual(read_dtypes(csv_file), {'PLC2_InputRegisters_IW0': 'uint16'})
+        df = read_dataset(csv_file)
+        self.assertEqual(df['PLC2_InputRegisters_IW0'].dtype, np.uint16)
+        self.assertEqual(list(df['PLC2_InputRegisters_IW0']), [0, 10, 20, 30, 40])
+        self.assertEqual(df['PLC2_InputRegisters_IW1'].isna().tolist(), [True] * 3 + [False] * 2)
+
+        # Appended with the same columns: the older rows still have missing values
+        self.poll(5, [0, 1])
+        self.convertoCSV.convert(2)
+        self.assertEqual(read_dtypes(csv_file), {'PLC2_InputRegisters_IW0': 'uint16'})
+        df = read_dataset(csv_file)
+        self.assertEqual(list(df['PLC2_InputRegisters_IW1'].iloc[3:]), [31, 41, 51])
+
+    def test_float32_registers(self):
+        # The main.py historian writes the json files, from the raw registers read by the register map
+        import main
+
+        class Master:
+            def __init__(self, registers):
+                self.registers = registers
+
+            def execute(self, unit, function_code, start, count):
+                return self.registers[function_code][start:start + count]
+
+        register_map = RegisterMap.for_plc('../register_maps', 3)
+        raws = [(125, 7, 0xFFFE), (3, 65535, 12)]
+        for second, (iw0, iw1, qw0) in enumerate(raws):
+            values = register_map.read_values(Master({4: [iw0, iw1], 3: [qw0]}))
+            main.save_registers(3, '127.0.0.1', 502, values, datetime(2024, 1, 1, 0, 0, second), register_map,
+                                directory='../historian')
+        self.convertoCSV.convert(3)
+
+        df = read_dataset('PLC_CSV/PLC3Dataset.csv')
+        self.assertEqual(df['PLC3_InputRegisters_IW0'].dtype, np.float32)
+        np.testing.assert_array_equal(df['PLC3_InputRegisters_IW0'], np.float32([12.5, 0.3]))
+        np.testing.assert_array_equal(df['PLC3_InputRegisters_IW1'], np.float32([0.7, 6553.5]))
+        self.assertEqual(df['PLC3_HoldingOutputRegisters_QW0'].tolist(), [-2, 12])
+
+    def test_typed_chunks(self):
+        register_map = RegisterMap({'Coils': [0, 1], 'InputRegisters': [0]})
+        files = list()
+        for second in range(4):
+            files.append(f'../historian/plc2-127.0.0.1-502@2024-01-01 00:00:{second:02d}.000000.json')
+            with open(files[-1], 'w') as f:
+                values = {'Coils': [second % 2 == 0, True], 'InputRegisters': [1000 * second]}
+                row = [values[table].pop(0) for table, _ in register_map.columns]
+                json.dump({'127.0.0.1': register_map.to_dict(row)}, f)
+
+        with open('../register_maps/plc2.ini', 'w') as f:
+            f.write('[Coils]\naddresses = 0-1\n[InputRegisters]\naddresses = 0\n')
+        df = self.convertoCSV.convert_chunk(2, files, self.convertoCSV.infer_schema(2, files[0]))
+        types = {'PLC2_InputRegisters_IW0': np.uint16, 'PLC2_Coils_QX00': bool, 'PLC2_Coils_QX01': bool}
+        self.assertEqual(df.dtypes.to_dict(), types)
+        self.assertEqual(df['PLC2_Coils_QX00'].tolist(), [True, False, True, False])
+        self.assertEqual(df['PLC2_InputRegisters_IW0'].tolist(), [0, 1000, 2000, 3000])
+
+        self.convertoCSV.convert(2)
+        with open('PLC_CSV/PLC2Dataset.csv') as f:
+            self.assertEqual(f.read().splitlines()[1:3], ['0,1,1', '1000,0,1'])
+        self.assertEqual(read_dataset('PLC_CSV/PLC2Dataset.csv').dtypes.to_dict(), types)
+
+
+if __name__ == '__main__':
+    unittest.main()
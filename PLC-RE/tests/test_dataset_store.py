@@ -0,0 +1,104 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dataset_store import (TIMESTAMP_FORMAT, DatasetWriter, read_dataset, read_dtypes, row_index,
+                           time_range_offsets)
+
+COLUMNS = [('Coils/%QX0.0', 'bool'), ('InputRegisters/%IW0', 'uint16'), ('InputRegisters/%IW1', 'int16')]
+T0 = 1_700_000_000.0
+
+
+def capture(directory, rows, first=0):
+    """PLC1Dataset.csv with `rows` samples one second apart (rows with the same timestamp every 7 rows)"""
+    writer = DatasetWriter(directory, 1, COLUMNS, block_rows=100)
+    for i in range(first, first + rows):
+        writer.append(T0 + i - (i % 7 == 1), [i % 3 == 0, i % 65536, -i % 1000])
+    writer.close()
+    return writer.path
+
+
+class TestTimeRange(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = capture(self.tmp.name, 3000)
+        self.df = read_dataset(self.path)
+        self.timestamps = pd.to_datetime(self.df['Timestamp'], format=TIMESTAMP_FORMAT)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_binary_search_equals_filter(self):
+        rng = np.random.default_rng(0)
+        first, last = self.timestamps.iloc[0], self.timestamps.iloc[-1]
+        bounds = [(first - pd.Timedelta(hours=1), first - pd.Timedelta(seconds=1)),
+                  (last + pd.Timedelta(seconds=1), last + pd.Timedelta(hours=1)),
+                  (first - pd.Timedelta(hours=1), last + pd.Timedelta(hours=1)),
+                  (first, first), (last, last)]
+        for _ in range(30):
+            a, b = np.sort(rng.integers(-10, 3010, 2))
+            bounds.append((first + pd.Timedelta(seconds=int(a)), first + pd.Timedelta(seconds=int(b) + 0.5)))
+        for start, end in bounds:
+            expected = self.df[(self.timestamps >= start) & (self.timestamps <= end)].reset_index(drop=True)
+            df = read_dataset(self.path, timerange=(start, end))
+            self.assertEqual(df['Timestamp'].tolist(), expected['Timestamp'].tolist())
+            np.testing.assert_array_equal(df['PLC1_InputRegisters_IW0'], expected['PLC1_InputRegisters_IW0'])
+
+    def test_offsets_are_row_starts(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        first, last = time_range_offsets(self.path, self.timestamps.iloc[100], self.timestamps.iloc[200])
+        self.assertEqual(data[first - 1:first], b'\n')
+        self.assertEqual(data[last - 1:last], b'\n')
+        self.assertEqual(data[first:last].count(b'\n'), 101)
+
+
+class TestRowIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = capture(self.tmp.name, 5000)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def assert_rows(self, skip, nrows):
+        expected = pd.read_csv(self.path, skiprows=range(1, skip + 1), nrows=nrows, dtype=read_dtypes(self.path))
+        df = read_dataset(self.path, skiprows=range(1, skip + 1), nrows=nrows)
+        pd.testing.assert_frame_equal(df, expected)
+
+    def test_skiprows_nrows(self):
+        for skip, nrows in [(0, 10), (1, 1), (1023, 2), (1024, 1), (1025, 3000), (4990, 100), (5000, 5),
+                            (6000, 5), (2500, None)]:
+            self.assert_rows(skip, nrows)
+        self.assertEqual(read_dataset(self.path, skiprows=range(1, 11)).shape[0], 4990)
+
+    def test_appended_rows(self):
+        index = row_index(self.path)
+        self.assertEqual(index['rows'], 5000)
+        capture(self.tmp.name, 1500, first=5000)
+        index = row_index(self.path)
+        self.assertEqual(index['rows'], 6500)
+        self.assertEqual(len(index['offsets']), 6500 // index['step'] + 1)
+        for skip, nrows in [(4999, 3), (5000, 10), (6100, 400)]:
+            self.assert_rows(skip, nrows)
+
+    def test_rewritten_csv(self):
+        row_index(self.path)
+        # Same header, other rows: the index is built again
+        df = pd.read_csv(self.path)
+        df.iloc[::-1].to_csv(self.path, index=False)
+        with open(self.path, 'a') as f:
+            f.write(df.iloc[:1].to_csv(index=False, header=False))
+        for skip, nrows in [(0, 5), (1024, 5), (4999, 2)]:
+            self.assert_rows(skip, nrows)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import importlib.util
+import os
+import types
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pre-processing', 'mergeDatasets_rdp.py')
+spec = importlib.util.spec_from_file_location('mergeDatasets_rdp', SCRIPT)
+mergeDatasets_rdp = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mergeDatasets_rdp)
+
+
+def transposed(df):
+    """Duplicate columns as dropped by the previous df.T.drop_duplicates().T"""
+    return df.T.duplicated().to_numpy()
+
+
+def pairwise(df):
+    """Columns equal (Series.equals) to a previous column"""
+    return np.array([any(df.iloc[:, j].equals(df.iloc[:, i]) for i in range(j)) for j in range(len(df.columns))])
+
+
+def edge_cases():
+    nan = np.nan
+    return pd.DataFrame({
+        'Timestamp': pd.to_datetime(['2024-01-01 00:00:00', '2024-01-01 00:00:01', '2024-01-01 00:00:02']),
+        'PLC1_IW0': np.array([1, 0, 1], dtype=np.uint16),
+        'PLC1_IW0_float': [1.0, 0.0, 1.0],
+        'PLC1_QX0': [True, False, True],
+        'negative_zero': [1.0, -0.0, 1.0],
+        'PLC1_IW1': [1.0, nan, 1.0],
+        'PLC2_IW1': [1.0, nan, 1.0],
+        'nan_elsewhere': [1.0, 1.0, nan],
+        'nullable': pd.array([1, None, 1], dtype='Int64'),
+        'PLC2_Timestamp': pd.to_datetime(['2024-01-01 00:00:00', '2024-01-01 00:00:01', '2024-01-01 00:00:02']),
+        'names': ['a', 'b', None],
+        'names_again': ['a', 'b', None],
+        'names_nan': ['a', 'b', nan],
+        'zeros': [0, 0, 0],
+        'false': [False, False, False],
+    })
+
+
+class TestDuplicateColumns(unittest.TestCase):
+
+    def test_edge_cases(self):
+        df = edge_cases()
+        duplicated = mergeDatasets_rdp.duplicate_columns(df)
+        np.testing.assert_array_equal(duplicated, transposed(df))
+        self.assertEqual(list(df.columns[duplicated]),
+                         ['PLC1_IW0_float', 'PLC1_QX0', 'negative_zero', 'PLC2_IW1', 'nullable', 'PLC2_Timestamp',
+                          'names_again', 'names_nan', 'false'])
+
+    def test_same_dtype_columns(self):
+        # Among columns of the same dtype, the duplicates are the columns equal to a previous one
+        rng = np.random.default_rng(0)
+        for dtype in (np.uint16, np.float64, bool):
+            values = rng.integers(0, 2, (50, 4)).astype(dtype)
+            df = pd.DataFrame(values[:, rng.integers(0, 4, 12)])
+            if dtype == np.float64:
+                df.iloc[rng.integers(0, 50, 10), rng.integers(0, 12, 10)] = np.nan
+            np.testing.assert_array_equal(mergeDatasets_rdp.duplicate_columns(df), pairwise(df))
+            np.testing.assert_array_equal(mergeDatasets_rdp.duplicate_columns(df), transposed(df))
+
+    def test_digest_collisions(self):
+        # With every digest equal, the values still tell the columns apart
+        digest = types.SimpleNamespace(digest=lambda: b'0')
+        collisions = types.SimpleNamespace(blake2b=lambda data, digest_size: digest)
+        df = edge_cases()
+        with mock.patch.object(mergeDatasets_rdp, 'hashlib', collisions):
+            duplicated = mergeDatasets_rdp.duplicate_columns(df)
+        np.testing.assert_array_equal(duplicated, transposed(df))
+
+    def test_no_rows(self):
+        # df.T.drop_duplicates() keeps every column of a frame without rows
+        df = edge_cases().iloc[:0]
+        self.assertEqual(df.T.drop_duplicates().T.shape, df.shape)
+        self.assertFalse(mergeDatasets_rdp.duplicate_columns(df).any())
+        self.assertEqual(len(mergeDatasets_rdp.duplicate_columns(pd.DataFrame())), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from enrichment_cache import EnrichmentCache
+
+
+class TestEnrichmentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_keys(self):
+        values = np.arange(100, dtype=np.float64)
+        key = EnrichmentCache.key('trend', values, period=150)
+        self.assertEqual(key, EnrichmentCache.key('trend', values.copy(), period=150))
+        self.assertNotEqual(key, EnrichmentCache.key('trend', values, period=151))
+        self.assertNotEqual(key, EnrichmentCache.key('slope', values, period=150))
+        self.assertNotEqual(key, EnrichmentCache.key('trend', values.astype(np.float32), period=150))
+        changed = values.copy()
+        changed[-1] += 1
+        self.assertNotEqual(key, EnrichmentCache.key('trend', changed, period=150))
+
+    def test_round_trip(self):
+        cache = EnrichmentCache(self.tmp.name, 2 ** 20)
+        values = np.random.default_rng(0).random(1000)
+        key = cache.key('trend', values, period=150)
+        self.assertIsNone(cache.get(key))
+        cache.put(key, values * 2)
+        np.testing.assert_array_equal(cache.get(key), values * 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_lru_eviction(self):
+        # Room for 3 entries of 1000 float64
+        entry = np.zeros(1000)
+        cache = EnrichmentCache(self.tmp.name, 3 * (entry.nbytes + 200))
+        keys = [cache.key('trend', entry, i=i) for i in range(5)]
+        for i, key in enumerate(keys[:3]):
+            cache.put(key, entry)
+            os.utime(cache._path(key), ns=(i * 10 ** 9, i * 10 ** 9))
+        # keys[0] used last, keys[1] is the least recently used
+        cache.get(keys[0])
+        cache.put(keys[3], entry)
+        cache.evict()
+        self.assertIsNone(cache.get(keys[1]))
+        for key in (keys[0], keys[2], keys[3]):
+            self.assertIsNotNone(cache.get(key))
+
+        cache.put(keys[4], entry)
+        cache.evict()
+        self.assertEqual(len([f for f in os.listdir(self.tmp.name) if f.endswith('.npy')]), 3)
+        self.assertIsNotNone(cache.get(keys[4]))
+
+
+if __name__ == '__main__':
+    unittest.main()
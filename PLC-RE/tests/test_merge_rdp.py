@@ -0,0 +1,67 @@
+import importlib.util
+import os
+import sys
+import unittest
+
+import numpy as np
+
+try:
+    import rdp
+except ImportError:
+    rdp = None
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pre-processing', 'mergeDatasets_rdp.py')
+spec = importlib.util.spec_from_file_location('mergeDatasets_rdp', SCRIPT)
+mergeDatasets_rdp = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mergeDatasets_rdp)
+
+# Points kept by rdp.rdp() 0.8 on (row, value) of SERIES
+SERIES = np.array([0, 0.1, 2, 2.1, 1.9, 5, 5.2, 4.8, 0, 0.3, 0, 1])
+KEPT = {
+    0: [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11],
+    0.5: [0, 1, 2, 4, 5, 6, 7, 8, 10, 11],
+    1: [0, 4, 6, 8, 11],
+    3: [0, 6, 11],
+}
+
+
+def columns(rng):
+    """Tank levels (random walks), integer steps with plateaus and collinear runs, and noise"""
+    yield np.cumsum(rng.normal(0, 1, 1000))
+    yield np.repeat(rng.integers(0, 5, 100), rng.integers(1, 20, 100)).astype(np.float64)
+    yield np.arange(300, dtype=np.float64) * 0.5
+    yield rng.random(500)
+
+
+class TestRdp(unittest.TestCase):
+
+    def test_reference_series(self):
+        for epsilon, kept in KEPT.items():
+            self.assertEqual(mergeDatasets_rdp.rdp_indices(SERIES, epsilon).tolist(), kept)
+
+    @unittest.skipIf(rdp is None, 'rdp package not installed')
+    def test_same_points_as_rdp(self):
+        rng = np.random.default_rng(0)
+        for values in columns(rng):
+            points = np.column_stack([np.arange(len(values)), values])
+            for epsilon in (0, 0.1, 0.5, 2, 10):
+                mask = rdp.rdp(points, epsilon=epsilon, return_mask=True)
+                np.testing.assert_array_equal(mergeDatasets_rdp.rdp_indices(values, epsilon), np.flatnonzero(mask))
+
+    def test_long_column(self):
+        # 200k rows: segmented without recursion, in a couple of seconds
+        values = np.cumsum(np.random.default_rng(0).normal(0, 1, 200_000))
+        kept = mergeDatasets_rdp.rdp_indices(values, 1.0)
+        self.assertEqual((kept[0], kept[-1]), (0, len(values) - 1))
+        self.assertTrue(np.all(np.diff(kept) > 0))
+
+    def test_slopes(self):
+        # Segments 0-4 rising, 4-6 flat, 6-8 falling by 0.005 a row (truncated to 0), then 8-9 and 9-10 falling
+        values = np.array([0, 1, 2, 3, 4, 4, 4, 3.995, 3.99, 2, 0], dtype=np.float64)
+        self.assertEqual(mergeDatasets_rdp.rdp_slopes(values, 0.001).tolist(), [1] * 4 + [0] * 4 + [-1] * 3)
+        self.assertEqual(mergeDatasets_rdp.rdp_slopes(np.array([7.0]), 0).tolist(), [0])
+        self.assertEqual(mergeDatasets_rdp.rdp_slopes(np.array([]), 0).tolist(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import importlib.util
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dataset_store import TIMESTAMP_FORMAT, read_dataset, write_dataset
+
+PREPROC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pre-processing')
+spec = importlib.util.spec_from_file_location('mergeDatasets', os.path.join(PREPROC, 'mergeDatasets.py'))
+mergeDatasets = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mergeDatasets)
+
+LEVEL = 'PLC1_InputRegisters_LIT101'
+
+
+def tank_dataset(rng, rows):
+    """Dataset of a PLC filling and draining a tank between two levels, with its pump"""
+    level = np.empty(rows)
+    pump = np.empty(rows, dtype=bool)
+    value = 580.0
+    filling = True
+    for i in range(rows):
+        value += rng.uniform(0.2, 0.4) if filling else -rng.uniform(0.3, 0.6)
+        if value > 660:
+            filling = False
+        elif value < 500:
+            filling = True
+        level[i] = value
+        pump[i] = filling
+    return pd.DataFrame({'Timestamp': pd.Timestamp('2024-01-01') + pd.to_timedelta(np.arange(rows), 's'),
+                         LEVEL: (level + rng.normal(0, 0.5, rows)).round(2),
+                         'PLC1_Coils_P101': pump})
+
+
+class TestMergeTrends(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.datasets = os.path.join(self.tmp.name, 'datasets')
+        for directory in ('datasets', 'process-mining/data', 'daikon/Daikon_Invariants'):
+            os.makedirs(os.path.join(self.tmp.name, directory))
+        self.rng = np.random.default_rng(0)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, df):
+        write_dataset(df, os.path.join(self.datasets, 'PLC1Dataset.csv'), date_format=TIMESTAMP_FORMAT)
+
+    def merger(self, *args):
+        """MergeDatasets of the datasets in the temporary directory, with the settings of config.ini"""
+        cwd, argv = os.getcwd(), sys.argv
+        # config.ini is read relative to pre-processing/
+        os.chdir(PREPROC)
+        sys.argv = ['mergeDatasets.py', '-d', self.datasets, '-s', '0', '-n', '100000', '-w', '1', '--no-cache',
+                    *args]
+        try:
+            mg = mergeDatasets.MergeDatasets()
+        finally:
+            os.chdir(cwd)
+            sys.argv = argv
+        mg.config['PATHS']['project_dir'] = self.tmp.name
+        mg.trends_dir = os.path.join(self.tmp.name, 'trends')
+        return mg
+
+    def merge(self, *args):
+        """Daikon dataset merged by mergeDatasets.py with `args`"""
+        mg = self.merger(*args)
+        if mg.chunksize:
+            mg.merge_chunked()
+        else:
+            mining, daikon = mg.get_datasets_lists()
+            mg.save_daikon_dataset(daikon)
+        return read_dataset(os.path.join(self.tmp.name, 'daikon/Daikon_Invariants', mg.output_file))
+
+    def test_chunked_trends(self):
+        self.write(tank_dataset(self.rng, 8000))
+        mg = self.merger()
+        window = mg.config['DATASET'].getint('trend_window') * int(mg.config['DATASET']['trend_period'])
+        tolerance = mg.config['DATASET'].getfloat('trend_tolerance')
+
+        full = self.merge('-o', 'full.csv')
+        chunked = self.merge('-o', 'chunked.csv', '-c', str(3 * window))
+        self.assertEqual(list(chunked.columns), list(full.columns))
+        self.assertEqual(len(chunked), len(full))
+        trend = 'trend_' + LEVEL
+        self.assertLessEqual(np.max(np.abs(chunked[trend] - full[trend])), tolerance * np.ptp(full[LEVEL]))
+        others = [col for col in full.columns if col not in (trend, 'slope_' + LEVEL)]
+        pd.testing.assert_frame_equal(chunked[others], full[others])
+        # Only the blocks with a slope right at the ±0.005 threshold may change sign
+        self.assertLessEqual(np.mean(chunked['slope_' + LEVEL] != full['slope_' + LEVEL]), 0.01)
+
+    def test_chunked_stitch_beyond_tolerance(self):
+        self.write(tank_dataset(self.rng, 4000))
+        mg = self.merger('-c', '2700')
+        mg.config['DATASET']['trend_tolerance'] = '0'
+        with self.assertRaises(ValueError):
+            mg.merge_chunked()
+
+    def incremental_trends(self, rows, appended, tolerance=None):
+        """Trend of the level fitted by an incremental run on `rows` rows, then on `appended` more rows, the
+        saved trend and the whole fit of all the rows"""
+        df = tank_dataset(self.rng, rows + appended)
+        path = os.path.join(self.datasets, 'PLC1Dataset.csv')
+        mg = self.merger('-i')
+        old = mg.fit_trends([df.iloc[:rows]], [path])[0][LEVEL]
+        if tolerance is not None:
+            mg.config['DATASET']['trend_tolerance'] = tolerance
+        trend = mg.fit_trends([df], [path])[0][LEVEL]
+        return trend, old, mergeDatasets.stl_trend(df[LEVEL].to_numpy(np.float64), 150)
+
+    def test_incremental_stitch(self):
+        mg = self.merger()
+        window = mg.config['DATASET'].getint('trend_window') * 150
+        tolerance = mg.config['DATASET'].getfloat('trend_tolerance')
+
+        trend, old, full = self.incremental_trends(2500, 500)
+        # Stitched: the saved trend is kept up to the crossfade
+        at = 2500 - window - 150
+        np.testing.assert_array_equal(trend[:at], old[:at])
+        self.assertFalse(np.array_equal(trend, full))
+        # The last rows of any fit depend on where the fitted rows start
+        last = len(trend) - window
+        self.assertLessEqual(np.max(np.abs(trend[:last] - full[:last])), tolerance * np.ptp(full))
+
+    def test_incremental_fallback(self):
+        # No stitch is close enough: the column is fitted again in full
+        trend, old, full = self.incremental_trends(2500, 500, tolerance='0')
+        np.testing.assert_array_equal(trend, full)
+
+
+if __name__ == '__main__':
+    unittest.main()
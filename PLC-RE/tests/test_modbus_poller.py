@@ -0,0 +1,112 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from modbus_poller import AsyncPoller
+
+PERIOD = 0.05
+
+
+class Connection:
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+
+
+class Polls:
+    """poll_fn recording the polls of every PLC, `delays` seconds long, failing for the PLCs in `failing`"""
+
+    def __init__(self, delays=None, failing=()):
+        self.delays = delays or {}
+        self.failing = failing
+        self.polls = dict()
+        self.running = dict()
+        self.overlaps = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, name, ip, port, connection, ora):
+        with self.lock:
+            self.polls.setdefault(name, list()).append(ora)
+            self.running[name] = self.running.get(name, 0) + 1
+            if self.running[name] > 1:
+                self.overlaps += 1
+        try:
+            time.sleep(self.delays.get(name, 0))
+            if name in self.failing:
+                raise ConnectionError('no response')
+        finally:
+            with self.lock:
+                self.running[name] -= 1
+
+
+def run(poller, duration, start=None):
+    asyncio.run(poller.run(duration, start))
+
+
+class TestAsyncPoller(unittest.TestCase):
+
+    def setUp(self):
+        self.plcs = [('1', '127.0.0.1', '502'), ('2', '127.0.0.1', '503'), ('3', '127.0.0.1', '504')]
+
+    def test_shared_ticks(self):
+        polls = Polls()
+        poller = AsyncPoller(self.plcs, [Connection() for _ in self.plcs], PERIOD, polls)
+        start = (time.monotonic(), 1_700_000_000.0)
+        run(poller, 10 * PERIOD, start)
+
+        self.assertEqual(poller.ticks, 10)
+        # Every PLC polled at every tick, with the timestamp of the tick
+        for name, _, _ in self.plcs:
+            self.assertEqual([ora.timestamp() for ora in polls.polls[name]],
+                             [start[1] + k * PERIOD for k in range(10)])
+        self.assertEqual((poller.missed_ticks, poller.skipped_polls, poller.failed_polls), (0, 0, 0))
+
+    def test_busy_and_unhealthy_plcs(self):
+        # PLC 2 takes 2.5 periods to answer, PLC 3 is not connected
+        polls = Polls(delays={'2': 2.5 * PERIOD})
+        connections = [Connection(), Connection(), Connection(healthy=False)]
+        poller = AsyncPoller(self.plcs, connections, PERIOD, polls)
+        run(poller, 12 * PERIOD)
+
+        self.assertEqual(len(polls.polls['1']), poller.ticks)
+        self.assertNotIn('3', polls.polls)
+        self.assertEqual(poller.unhealthy_polls, poller.ticks)
+        # A busy PLC is skipped, never polled twice at the same time
+        self.assertEqual(polls.overlaps, 0)
+        self.assertLess(len(polls.polls['2']), poller.ticks)
+        self.assertEqual(len(polls.polls['2']) + poller.skipped_polls, poller.ticks)
+
+        # Back online: polled at the next tick
+        connections[2].healthy = True
+        run(poller, 2 * PERIOD)
+        self.assertEqual(len(polls.polls['3']), 2)
+
+    def test_failed_polls(self):
+        polls = Polls(failing={'2'})
+        poller = AsyncPoller(self.plcs, [Connection() for _ in self.plcs], PERIOD, polls)
+        with self.assertLogs('modbus_poller', 'ERROR'):
+            run(poller, 5 * PERIOD)
+        self.assertEqual(poller.failed_polls, 5)
+        self.assertEqual(len(polls.polls['1']), 5)
+        self.assertEqual(len(polls.polls['2']), 5)
+
+    def test_late_ticks_skipped(self):
+        # Started 10 periods late: one tick for the slot that is over, then the current slot, no burst
+        polls = Polls()
+        poller = AsyncPoller(self.plcs[:1], [Connection()], PERIOD, polls)
+        start = (time.monotonic() - 10.5 * PERIOD, 1_700_000_000.0)
+        with self.assertLogs('modbus_poller', 'WARNING'):
+            run(poller, 14 * PERIOD, start)
+
+        self.assertEqual((poller.ticks, poller.missed_ticks), (5, 9))
+        ticks = [round((ora.timestamp() - start[1]) / PERIOD) for ora in polls.polls['1']]
+        # Tick 10 fires right after tick 0, and can find the PLC still busy with it
+        self.assertIn(ticks, ([0, 10, 11, 12, 13], [0, 11, 12, 13]))
+        self.assertEqual(len(ticks) + poller.skipped_polls, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
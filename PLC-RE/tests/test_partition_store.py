@@ -0,0 +1,113 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dataset_store import DatasetWriter, parse_timestamps, read_dataset
+from partition_store import MANIFEST, PartitionedDataset, PartitionWriter, partitions_path
+
+COLUMNS = [('Coils/%QX0.0', 'bool'), ('InputRegisters/%IW0', 'uint16'), ('InputRegisters/%IW1', 'float32')]
+T0 = 1_700_000_000.0
+
+
+def partition(path, freq, chunksize=1000):
+    """Import of a csv dataset, as pre-processing/partitionDatasets.py does"""
+    writer = PartitionWriter(path, 'Timestamp', freq)
+    with read_dataset(path, chunksize=chunksize) as chunks:
+        for chunk in chunks:
+            chunk['Timestamp'] = parse_timestamps(chunk['Timestamp'])
+            writer.append(chunk)
+    writer.close()
+    return writer
+
+
+class TestPartitions(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        # 3 hours and a half of samples, 10 seconds apart
+        writer = DatasetWriter(self.tmp.name, 1, COLUMNS)
+        for i in range(1260):
+            writer.append(T0 + 10 * i, [i % 4 == 0, i % 500, i / 4 if i % 3 else 0])
+        writer.close()
+        self.path = writer.path
+        self.csv = read_dataset(self.path)
+        self.timestamps = pd.to_datetime(self.csv['Timestamp'])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_manifest(self):
+        partition(self.path, 'hour')
+        with open(os.path.join(partitions_path(self.path), MANIFEST)) as f:
+            manifest = json.load(f)
+        hours = self.timestamps.dt.floor('h')
+        self.assertEqual(len(manifest['partitions']), hours.nunique())
+        self.assertEqual([c for c, _ in manifest['columns']], list(self.csv.columns))
+
+        first_row = 0
+        for part, (hour, rows) in zip(manifest['partitions'], self.csv.groupby(hours, sort=False)):
+            self.assertEqual(part['name'], hour.strftime('%Y%m%dT%H'))
+            self.assertEqual((part['first_row'], part['rows']), (first_row, len(rows)))
+            self.assertEqual(pd.Timestamp(part['ts_min']), self.timestamps[rows.index].min())
+            self.assertEqual(pd.Timestamp(part['ts_max']), self.timestamps[rows.index].max())
+            stats = part['stats']['PLC1_InputRegisters_IW0']
+            self.assertEqual((stats['min'], stats['max']), (rows['PLC1_InputRegisters_IW0'].min(),
+                                                            rows['PLC1_InputRegisters_IW0'].max()))
+            self.assertEqual(part['stats']['PLC1_Coils_QX00']['nonzero'], int(rows['PLC1_Coils_QX00'].sum()))
+            first_row += len(rows)
+        self.assertEqual(first_row, len(self.csv))
+
+    def test_reads_equal_csv(self):
+        partition(self.path, 'hour', chunksize=333)
+        self.assertTrue(PartitionedDataset(self.path).current())
+        pd.testing.assert_frame_equal(read_dataset(self.path), self.csv)
+
+        usecols = ['Timestamp', 'PLC1_InputRegisters_IW1']
+        pd.testing.assert_frame_equal(read_dataset(self.path, usecols=usecols, skiprows=range(1, 301), nrows=500),
+                                      self.csv[usecols].iloc[300:800].reset_index(drop=True))
+
+        start, end = self.timestamps[400], self.timestamps[900]
+        selected = self.csv[(self.timestamps >= start) & (self.timestamps <= end)].reset_index(drop=True)
+        pd.testing.assert_frame_equal(read_dataset(self.path, timerange=(start, end)), selected)
+
+        with read_dataset(self.path, chunksize=400) as chunks:
+            chunks = list(chunks)
+        self.assertEqual([len(c) for c in chunks], [400, 400, 400, 60])
+        pd.testing.assert_frame_equal(pd.concat(chunks), self.csv)
+
+    def test_changed_and_deleted_csv(self):
+        partition(self.path, 'day')
+        with open(self.path, 'a') as f:
+            f.write(f'{self.csv["Timestamp"].iloc[-1]},1,7,0.5\n')
+        self.assertFalse(PartitionedDataset(self.path).current())
+        # The csv changed after the import: it is read instead of the partitions
+        self.assertEqual(len(read_dataset(self.path)), len(self.csv) + 1)
+
+        partition(self.path, 'day')
+        os.remove(self.path)
+        self.assertTrue(PartitionedDataset(self.path).current())
+        self.assertEqual(len(read_dataset(self.path)), len(self.csv) + 1)
+
+    def test_rows_out_of_order(self):
+        writer = PartitionWriter(self.path, 'Timestamp', 'hour')
+        df = self.csv.assign(Timestamp=self.timestamps)
+        writer.append(df.iloc[600:])
+        writer.append(df.iloc[:600])
+        writer.close()
+        dataset = PartitionedDataset(self.path)
+        names = [p['name'] for p in dataset.manifest['partitions']]
+        self.assertEqual(len(names), len(set(names)))
+        self.assertEqual(dataset.rows, len(self.csv))
+        np.testing.assert_array_equal(dataset.read()['PLC1_InputRegisters_IW0'],
+                                      np.r_[self.csv['PLC1_InputRegisters_IW0'].iloc[600:],
+                                            self.csv['PLC1_InputRegisters_IW0'].iloc[:600]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from register_map import MAX_READ_BITS, MAX_READ_REGISTERS, TABLES, RegisterMap
+
+
+class Master:
+    """Modbus master whose register at address a of function code f is f * 100000 + a, recording the requests"""
+
+    def __init__(self):
+        self.requests = list()
+
+    def execute(self, unit, function_code, start, count):
+        self.requests.append((function_code, start, count))
+        return [function_code * 100000 + address for address in range(start, start + count)]
+
+
+def limit(function_code):
+    bits = (TABLES['Coils'].function_code, TABLES['DiscreteInputRegisters'].function_code)
+    return MAX_READ_BITS if function_code in bits else MAX_READ_REGISTERS
+
+
+def spans(register_map):
+    return [(block.function_code, block.start, block.count) for block in register_map.blocks]
+
+
+class TestPlan(unittest.TestCase):
+
+    def test_gaps(self):
+        addresses = {'InputRegisters': [0, 1, 2, 5, 6, 20]}
+        fc = TABLES['InputRegisters'].function_code
+        self.assertEqual(spans(RegisterMap(addresses)), [(fc, 0, 3), (fc, 5, 2), (fc, 20, 1)])
+        self.assertEqual(spans(RegisterMap(addresses, max_gap=1)), [(fc, 0, 3), (fc, 5, 2), (fc, 20, 1)])
+        # 2 unused registers between 2 and 5, 13 between 6 and 20
+        self.assertEqual(spans(RegisterMap(addresses, max_gap=2)), [(fc, 0, 7), (fc, 20, 1)])
+        self.assertEqual(spans(RegisterMap(addresses, max_gap=13)), [(fc, 0, 21)])
+
+    def test_pdu_limits(self):
+        fc = TABLES['InputRegisters'].function_code
+        register_map = RegisterMap({'InputRegisters': range(300)}, max_gap=1000)
+        self.assertEqual(spans(register_map), [(fc, 0, MAX_READ_REGISTERS),
+                                               (fc, MAX_READ_REGISTERS, MAX_READ_REGISTERS),
+                                               (fc, 2 * MAX_READ_REGISTERS, 300 - 2 * MAX_READ_REGISTERS)])
+        # A gap read to join two ranges counts towards the limit too
+        register_map = RegisterMap({'InputRegisters': [0, MAX_READ_REGISTERS - 1, MAX_READ_REGISTERS]}, max_gap=1000)
+        self.assertEqual(spans(register_map), [(fc, 0, MAX_READ_REGISTERS), (fc, MAX_READ_REGISTERS, 1)])
+
+        fc = TABLES['Coils'].function_code
+        register_map = RegisterMap({'Coils': range(MAX_READ_BITS + 100)})
+        self.assertEqual(spans(register_map), [(fc, 0, MAX_READ_BITS), (fc, MAX_READ_BITS, 100)])
+
+    def test_tables_sharing_a_function_code(self):
+        # %QW and %MW are both holding registers: adjacent once %MW starts right after %QW
+        addresses = {'HoldingOutputRegisters': range(11), 'MemoryRegisters': range(11)}
+        fc = TABLES['MemoryRegisters'].function_code
+        self.assertEqual(spans(RegisterMap(addresses, max_gap=8)), [(fc, 0, 11), (fc, 1024, 11)])
+        register_map = RegisterMap(addresses, bases={'MemoryRegisters': 11})
+        self.assertEqual(spans(register_map), [(fc, 0, 22)])
+        row = register_map.read_values(Master())
+        self.assertEqual(row, [fc * 100000 + a for a in range(22)])
+
+    def test_random_maps(self):
+        rng = np.random.default_rng(0)
+        for _ in range(50):
+            addresses = {t: sorted(rng.choice(2500 if TABLES[t].bits else 300, rng.integers(0, 60), replace=False))
+                         for t in TABLES}
+            register_map = RegisterMap(addresses, max_gap=int(rng.integers(0, 20)))
+            master = Master()
+            row = register_map.read_values(master)
+            self.assertEqual(len(master.requests), len(register_map.blocks))
+
+            # Every register is read, once, from its address
+            expected = [TABLES[t].function_code * 100000 + register_map.bases[t] + o
+                        for t in TABLES for o in register_map.addresses[t]]
+            expected = [bool(v) if TABLES[t].bits else v for (t, _), v in zip(register_map.columns, expected)]
+            self.assertEqual(row, expected)
+            self.assertEqual(sorted(c for block in register_map.blocks for c, _ in block.entries),
+                             list(range(len(register_map.columns))))
+
+            for block in register_map.blocks:
+                self.assertLessEqual(block.count, limit(block.function_code))
+                # Each block starts and ends with a mapped register
+                self.assertEqual((block.entries[0][1], block.entries[-1][1]), (0, block.count - 1))
+            blocks = sorted(register_map.blocks)
+            for block, following in zip(blocks, blocks[1:]):
+                if block.function_code == following.function_code:
+                    # Two blocks are never joinable: too far apart, or too long together
+                    gap = following.start - (block.start + block.count)
+                    self.assertTrue(gap > register_map.max_gap or
+                                    following.start - block.start + 1 > limit(block.function_code))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ring_buffer import RingBuffer
+
+COLUMNS = [('InputRegisters/%IW0', 'uint16'), ('Coils/%QX0.0', 'bool')]
+
+
+class RacingData(np.ndarray):
+    """Rows of a ring buffer whose writer appends `writes` rows right before a reader copies its rows"""
+
+    writes = None
+
+    def __getitem__(self, index):
+        if isinstance(index, np.ndarray) and self.dtype.names and RacingData.writes:
+            writes, RacingData.writes = RacingData.writes, None
+            writes()
+        return np.asarray(super().__getitem__(index))
+
+
+def fill(buffer, first, last):
+    for ts in range(first, last):
+        buffer.append(float(ts), [ts * 2, ts % 2 == 0])
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def test_window_after_wraparound(self):
+        buffer = RingBuffer(COLUMNS, 10)
+        fill(buffer, 0, 25)
+        rows = buffer.window()
+        self.assertEqual(rows['timestamp'].tolist(), list(range(15, 25)))
+        self.assertEqual(rows['InputRegisters/%IW0'].tolist(), [ts * 2 for ts in range(15, 25)])
+        rows = buffer.window(17, 20.5, ['Coils/%QX0.0'])
+        self.assertEqual(rows.dtype.names, ('timestamp', 'Coils/%QX0.0'))
+        self.assertEqual(rows['timestamp'].tolist(), [17, 18, 19, 20])
+
+    def test_rows_overwritten_while_copying(self):
+        for start in (None, 3, 5):
+            buffer = RingBuffer(COLUMNS, 10)
+            fill(buffer, 0, 10)
+            buffer.data = buffer.data.view(RacingData)
+            # The writer reuses the slots of the 3 oldest rows before the reader copies them
+            RacingData.writes = lambda: fill(buffer, 10, 13)
+            rows = buffer.window(start)
+            self.assertEqual(rows['timestamp'].tolist(), list(range(max(start or 0, 3), 10)))
+            self.assertEqual(rows['InputRegisters/%IW0'].tolist(), [ts * 2 for ts in rows['timestamp']])
+
+    def test_empty(self):
+        buffer = RingBuffer(COLUMNS, 10)
+        self.assertEqual(len(buffer.window()), 0)
+        fill(buffer, 0, 3)
+        self.assertEqual(len(buffer.window(5)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import glob
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from segment_store import DeltaSegmentWriter, SegmentReader, SegmentWriter, read_header, decode_delta, row_dtype
+
+COLUMNS = [('Coils/QX00', 'bool'), ('InputRegisters/IW0', 'uint16'), ('InputRegisters/IW1', 'int16'),
+           ('InputRegisters/IW2', 'float32')]
+
+
+def samples(rng, n):
+    """Slowly changing samples: each register moves in about one sample out of ten"""
+    moved = rng.random((n, len(COLUMNS))) < 0.1
+    steps = np.column_stack([moved[:, 0], moved[:, 1] * rng.integers(1, 100, n),
+                             -1 * moved[:, 2] * rng.integers(1, 100, n), moved[:, 3] * rng.random(n)])
+    values = np.cumsum(steps, axis=0)
+    return [[bool(v[0] % 2), int(v[1]), int(v[2]), float(np.float32(v[3]))] for v in values]
+
+
+def write(writer, rows, t0=1_700_000_000.0):
+    for i, values in enumerate(rows):
+        writer.append(t0 + i, values)
+    writer.close()
+
+
+def expected(rows, t0=1_700_000_000.0):
+    out = np.zeros(len(rows), dtype=row_dtype(COLUMNS))
+    out['timestamp'] = t0 + np.arange(len(rows))
+    for i, values in enumerate(rows):
+        out[i] = (out['timestamp'][i], *values)
+    return out
+
+
+class TestDeltaSegments(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.rows = samples(np.random.default_rng(0), 500)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def directory(self, name):
+        path = os.path.join(self.tmp.name, name)
+        os.makedirs(path)
+        return path
+
+    def test_round_trip(self):
+        # Keyframes sparser than the blocks: most blocks start from the keyframe of an earlier block
+        directory = self.directory('delta')
+        write(DeltaSegmentWriter(directory, 1, '127.0.0.1', 502, COLUMNS, keyframe_interval=200, block_rows=30),
+              self.rows)
+        data = SegmentReader(directory).read(1)
+        np.testing.assert_array_equal(data, expected(self.rows))
+
+    def test_time_window(self):
+        directory = self.directory('delta')
+        write(DeltaSegmentWriter(directory, 1, '127.0.0.1', 502, COLUMNS, keyframe_interval=200, block_rows=30),
+              self.rows)
+        data = SegmentReader(directory).read(1, 1_700_000_000.0 + 250, 1_700_000_000.0 + 320)
+        np.testing.assert_array_equal(data, expected(self.rows)[250:321])
+
+    def test_rotation(self):
+        directory = self.directory('delta')
+        write(DeltaSegmentWriter(directory, 1, '127.0.0.1', 502, COLUMNS, keyframe_interval=1000, block_rows=16,
+                                 max_seconds=120), self.rows)
+        self.assertGreater(len(SegmentReader(directory).segments(1)), 1)
+        np.testing.assert_array_equal(SegmentReader(directory).read(1), expected(self.rows))
+
+    def test_truncated_record(self):
+        directory = self.directory('delta')
+        write(DeltaSegmentWriter(directory, 1, '127.0.0.1', 502, COLUMNS, keyframe_interval=50, block_rows=30),
+              self.rows)
+        path = glob.glob(os.path.join(directory, '*.seg'))[0]
+        header, offset = read_header(path)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        rows = decode_delta(data[:-1], row_dtype(header['columns']))
+        np.testing.assert_array_equal(rows, expected(self.rows)[:len(self.rows) - 1])
+
+    def test_smaller_than_full(self):
+        full, delta = self.directory('full'), self.directory('delta')
+        write(SegmentWriter(full, 1, '127.0.0.1', 502, COLUMNS), self.rows)
+        write(DeltaSegmentWriter(delta, 1, '127.0.0.1', 502, COLUMNS), self.rows)
+        size = lambda d: sum(os.path.getsize(p) for p in glob.glob(os.path.join(d, '*')))
+        self.assertLess(size(delta), size(full))
+
+
+if __name__ == '__main__':
+    unittest.main()
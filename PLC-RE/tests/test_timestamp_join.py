@@ -0,0 +1,70 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from timestamp_join import TimestampJoin
+
+
+def plc_datasets(rng, plcs, rows):
+    """Datasets with sorted timestamps (ties within and across the datasets) and int, float and bool columns"""
+    datasets = list()
+    for i in range(plcs):
+        n = int(rng.integers(1, rows))
+        ts = np.sort(rng.integers(0, rows * 3, n)) * 10 ** 8
+        datasets.append(pd.DataFrame({'Timestamp': pd.to_datetime(ts),
+                                      f'PLC{i}_IW0': rng.integers(0, 9, n),
+                                      f'PLC{i}_IW1': rng.random(n),
+                                      f'PLC{i}_QX0': rng.random(n) > 0.5}))
+    return datasets
+
+
+def join(datasets, tolerance, fill, chunks=None, rng=None):
+    """Joined datasets, pushed whole or in `chunks` random chunks each, interleaved at random with pop()"""
+    joiner = TimestampJoin(len(datasets), 'Timestamp', tolerance, fill)
+    queues = list()
+    for df in datasets:
+        cuts = np.sort(rng.integers(0, len(df) + 1, chunks)) if chunks else []
+        queues.append([df.iloc[rows] for rows in np.split(np.arange(len(df)), cuts)])
+
+    popped = list()
+    while any(queues):
+        i = int(rng.choice([i for i, queue in enumerate(queues) if queue])) if chunks else \
+            next(i for i, queue in enumerate(queues) if queue)
+        joiner.push(i, queues[i].pop(0))
+        if not queues[i]:
+            joiner.finish(i)
+        popped.append(joiner.pop())
+    popped.append(joiner.pop())
+    return pd.concat([df for df in popped if len(df)], ignore_index=True)
+
+
+class TestTimestampJoin(unittest.TestCase):
+
+    def test_chunks_equal_single_push(self):
+        rng = np.random.default_rng(0)
+        for _ in range(20):
+            datasets = plc_datasets(rng, int(rng.integers(1, 4)), 80)
+            for tolerance in (0, 0.1, 0.5):
+                for fill in ('ffill', 'none'):
+                    expected = join(datasets, tolerance, fill)
+                    chunked = join(datasets, tolerance, fill, int(rng.integers(1, 10)), rng)
+                    pd.testing.assert_frame_equal(chunked, expected)
+
+    def test_rows_within_tolerance_are_joined(self):
+        a = pd.DataFrame({'Timestamp': pd.to_datetime(['2024-01-01 00:00:00.0', '2024-01-01 00:00:01.0']),
+                          'a': [1, 2]})
+        b = pd.DataFrame({'Timestamp': pd.to_datetime(['2024-01-01 00:00:00.3', '2024-01-01 00:00:02.0']),
+                          'b': [10, 20]})
+        df = join([a, b], 0.5, 'ffill')
+        self.assertEqual(list(df['Timestamp'].astype(str)),
+                         ['2024-01-01 00:00:00', '2024-01-01 00:00:01', '2024-01-01 00:00:02'])
+        self.assertEqual(list(df['a']), [1, 2, 2])
+        self.assertEqual(list(df['b']), [10, 10, 20])
+
+
+if __name__ == '__main__':
+    unittest.main()
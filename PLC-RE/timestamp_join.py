@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+
+FILLS = ('ffill', 'none')
+
+
+class TimestampJoin:
+    """As-of join of the datasets of several PLCs on their timestamp column, by a k-way merge of their rows
+
+    The rows of every dataset are pushed in chronological order, by chunks of any size, and their
+    timestamps are merged in a single pass: an output row starts from the earliest timestamp not joined
+    yet and takes at most a row of every dataset within `tolerance` seconds from it (its timestamp is
+    the earliest one). A dataset without a row in an output row is filled according to `fill`:
+        ffill: with its last row (with its first row, before it starts), keeping the column types
+        none:  with NaN (the integer and bool columns become float and object)
+    pop() returns the output rows that the rows not pushed yet cannot change, so only the rows of the
+    last timestamps of every dataset are kept in memory. Every row is merged once: the merge goes on
+    from where the previous pop() stopped.
+    """
+
+    def __init__(self, inputs, timestamp_col='Timestamp', tolerance=0.0, fill='ffill'):
+        if fill not in FILLS:
+            raise ValueError(f'unknown fill policy {fill}, expected one of {", ".join(FILLS)}')
+        self.timestamp_col = timestamp_col
+        self.tolerance = int(pd.Timedelta(seconds=tolerance).value)
+        self.fill = fill
+        # Per dataset: rows not returned yet, timestamps not merged yet and groups of the rows already merged
+        self.buffers = [list() for _ in range(inputs)]
+        self.unmerged = [list() for _ in range(inputs)]
+        self.groups = [list() for _ in range(inputs)]
+        self.seen = [None] * inputs
+        self.finished = [False] * inputs
+        self.schemas = [None] * inputs
+        self.last = [None] * inputs
+        # State of the merge between two pop(): timestamps of the output rows not returned yet
+        # (the first has id `released`), datasets already in the last one
+        self.starts = list()
+        self.released = 0
+        self.taken = 0
+
+    def push(self, i, df):
+        """Append the rows `df` (sorted by timestamp, after the ones already pushed) to the dataset `i`"""
+        if self.timestamp_col not in df.columns:
+            raise ValueError(f'dataset {i} has no {self.timestamp_col} column, it cannot be joined by timestamp')
+        if self.schemas[i] is None:
+            self.schemas[i] = df.drop(columns=self.timestamp_col).iloc[:0]
+        if not len(df):
+            return
+        ts = self._timestamps(df)
+        self.buffers[i].append(df.drop(columns=self.timestamp_col))
+        self.unmerged[i].append(ts)
+        self.seen[i] = ts[-1]
+
+    def finish(self, i):
+        """No more rows for the dataset `i`"""
+        self.finished[i] = True
+
+    def _timestamps(self, df):
+        return df[self.timestamp_col].to_numpy('datetime64[ns]').view(np.int64)
+
+    def _merge(self, until):
+        """Merge the rows with timestamp < `until` (all the rows if None) not merged yet"""
+        timestamps = list()
+        sources = list()
+        for i, pending in enumerate(self.unmerged):
+            if not pending:
+                continue
+            ts = np.concatenate(pending)
+            # The rows with timestamp >= until are left to merge: other rows with the same timestamp can
+            # still arrive and precede them
+            merged = len(ts) if until is None else int(np.searchsorted(ts, until, side='left'))
+            self.unmerged[i] = [ts[merged:]] if merged < len(ts) else []
+            timestamps.append(ts[:merged])
+            sources.append(np.full(merged, i))
+        if not timestamps:
+            return
+        timestamps = np.concatenate(timestamps)
+        sources = np.concatenate(sources)
+        order = np.argsort(timestamps, kind='stable')
+        timestamps = timestamps[order]
+        sources = sources[order]
+
+        # Merge: a new row when the timestamp is beyond the tolerance or the dataset already has a row
+        groups = np.empty(len(timestamps), dtype=np.int64)
+        group = self.released + len(self.starts) - 1
+        start = self.starts[-1] if self.starts else None
+        taken = self.taken
+        for j, (ts, source) in enumerate(zip(timestamps.tolist(), sources.tolist())):
+            bit = 1 << source
+            if start is None or ts - start > self.tolerance or taken & bit:
+                start = ts
+                taken = 0
+                group += 1
+                self.starts.append(ts)
+            taken |= bit
+            groups[j] = group
+        self.taken = taken
+
+        for i in range(len(self.buffers)):
+            self.groups[i].append(groups[sources == i])
+
+    def pop(self):
+        """Output rows that the next pushes cannot change (all the rows left, once every dataset is finished)"""
+        open_inputs = [i for i, finished in enumerate(self.finished) if not finished]
+        if any(self.seen[i] is None for i in open_inputs):
+            # A dataset without rows could still have the oldest timestamps
+            return self._rows(0)
+        # The next timestamps of every open dataset are >= the last one received
+        until = min(self.seen[i] for i in open_inputs) if open_inputs else None
+        self._merge(until)
+
+        # The rows starting within the tolerance from the last timestamp can still change
+        rows = len(self.starts) if until is None else int(np.searchsorted(self.starts, until - self.tolerance,
+                                                                           side='left'))
+        return self._rows(rows)
+
+    def _take(self, i, rows):
+        """First `rows` rows not returned yet of the dataset `i`"""
+        taken = list()
+        while rows:
+            buffer = self.buffers[i][0]
+            if len(buffer) <= rows:
+                taken.append(self.buffers[i].pop(0))
+            else:
+                taken.append(buffer.iloc[:rows])
+                self.buffers[i][0] = buffer.iloc[rows:]
+            rows -= len(taken[-1])
+        return pd.concat(taken) if len(taken) > 1 else taken[0] if taken else self.schemas[i]
+
+    def _rows(self, rows):
+        """The next `rows` output rows"""
+        columns = [pd.DataFrame({self.timestamp_col: np.array(self.starts[:rows], dtype=np.int64)
+                                .view('datetime64[ns]')})]
+        end = self.released + rows
+        for i, schema in enumerate(self.schemas):
+            if schema is None:
+                continue
+            # Rows of the dataset in the output rows returned, and their position in the output
+            merged = np.concatenate(self.groups[i]) if self.groups[i] else np.empty(0, dtype=np.int64)
+            taken = int(np.searchsorted(merged, end, side='left'))
+            self.groups[i] = [merged[taken:]] if taken < len(merged) else []
+            groups = merged[:taken] - self.released
+            values = self._take(i, taken)
+
+            if self.fill == 'ffill' and (self.last[i] is not None or len(values) or self.buffers[i]):
+                # Previous row first: every row takes the last row present up to there
+                previous = self.last[i]
+                if previous is None:
+                    previous = values.iloc[:1] if len(values) else self.buffers[i][0].iloc[:1]
+                present = np.zeros(rows, dtype=np.int64)
+                present[groups] = 1
+                df = pd.concat([previous, values]).iloc[np.cumsum(present)]
+                if len(df):
+                    self.last[i] = df.iloc[-1:]
+            else:
+                df = values.set_axis(groups, axis=0).reindex(range(rows))
+                # Types that allow NaN also in the chunks without missing rows
+                df = df.astype(schema.reindex([0]).dtypes)
+            columns.append(df.reset_index(drop=True))
+
+        del self.starts[:rows]
+        self.released = end
+        return pd.concat(columns, axis=1)